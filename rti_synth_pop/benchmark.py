@@ -0,0 +1,262 @@
+# Description: This file benchmarks the pipeline stages on synthetic inputs and compares them to a baseline.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# For each fixture size, synthetic inputs are written to a fresh data directory and the
+# task files of each stage are run with pytask in a subprocess, with
+# RTI_SYNTH_POP_DATA_DIR pointing at that directory. A stage records:
+#   wall_time_s     <- wall clock time of the pytask run
+#   peak_rss_mb     <- peak resident memory of the largest single process of the run,
+#                      pytask or one of its workers, not their sum
+#   rows            <- rows in the outputs of the stage
+#   rows_per_s      <- rows / wall_time_s
+# The results are written as JSON. With a baseline, every stage that is slower or uses
+# more memory than the baseline by more than the threshold is reported, and the exit
+# code is 1.
+#
+# Usage:
+#   python -m rti_synth_pop.benchmark --sizes small medium
+#   python -m rti_synth_pop.benchmark --sizes small --save-baseline
+#   python -m rti_synth_pop.benchmark --sizes small --threshold 0.2
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pyarrow import parquet
+from pyprojroot import here
+
+from rti_synth_pop.config import (
+    INTERIM_SUFFIX,
+    PYTASK_CONFIG,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    query_dict,
+)
+from rti_synth_pop.interim import count_interim_rows
+from rti_synth_pop.synthetic_fixtures import write_fixtures
+
+BENCHMARK_DIR = here() / "benchmarks"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+
+# block groups per state and mean households per block group of each fixture size.
+SIZES = {
+    "small": {"n_block_groups": 50, "households_per_bg": 100},
+    "medium": {"n_block_groups": 500, "households_per_bg": 200},
+    "large": {"n_block_groups": 2500, "households_per_bg": 400},
+}
+
+# the tasks that only prepare the inputs of the benchmarked stages. They are run and
+# recorded, but are not compared to the baseline.
+SETUP_TASKS = [
+    "task_1_download_census_data.py",
+    "task_1b_download_pums_and_geo_data.py",
+    "task_1c_tiger_to_geoparquet.py",
+    "task_1d_clip_population_raster.py",
+    "task_3b_cache_pums_persons.py",
+    "task_5_puma_bg_crosswalk.py",
+]
+
+# stage name to its task files and the outputs its rows are counted from, relative to
+# the data directory. The coordinates are counted from the households with geometry,
+# which task 8 writes in both layouts and without partitioning.
+STAGES = {
+    "marginals": (
+        ["task_2_create_marginal_tables.py"],
+        [f"interim/*_{SURVEY}_{YEAR}_{var}.parquet" for var in query_dict],
+    ),
+    "recode": (
+        ["task_3_recode_pums_data.py"],
+        [f"interim/csv_h*_{YEAR}_recoded{INTERIM_SUFFIX}"],
+    ),
+    "ipf": (
+        ["task_4_run_ipf.py"],
+        [f"interim/*_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}"],
+    ),
+    "sampling": (
+        ["task_6_sample_pums_serialnos.py"],
+        [f"interim/*_{YEAR}_household_synthpop_serialnos{INTERIM_SUFFIX}"],
+    ),
+    "derive": (
+        ["task_7_generate_population.py"],
+        [f"interim/*_{YEAR}_households{INTERIM_SUFFIX}"],
+    ),
+    "coordinates": (
+        ["task_8_assign_coordinates.py"],
+        [f"processed/*_{YEAR}_households*_w_geom.parquet"],
+    ),
+}
+
+
+# %%
+def count_rows(directory: Path, patterns: list[str]):
+    """Counts the rows of the files that match the patterns.
+
+    The interim tables are counted in INTERIM_FORMAT, and the other files as parquet.
+
+    directory: Path = The directory to look in.
+    patterns: list[str] = The glob patterns of the files.
+
+    Returns: The total number of rows.
+    """
+    n_rows = 0
+    for pattern in patterns:
+        for path in directory.glob(pattern):
+            if path.suffix == INTERIM_SUFFIX and path.parent.name == "interim":
+                n_rows += count_interim_rows(path)
+            else:
+                n_rows += parquet.ParquetFile(path).metadata.num_rows
+    return n_rows
+
+
+def run_stage(task_files: list[str], run_dir: Path, log_path: Path):
+    """Runs task files with pytask in a subprocess and measures it.
+
+    The pytask root is run_dir, so the lock file and database of the benchmark stay
+    out of the project.
+
+    task_files: list[str] = The task files to run, in the rti_synth_pop package.
+    run_dir: Path = The benchmark run directory, with a data directory inside.
+    log_path: Path = The file the pytask output is appended to.
+
+    Returns: A dictionary with wall_time_s and peak_rss_mb.
+    """
+    package_dir = Path(__file__).parent
+    env = dict(os.environ, RTI_SYNTH_POP_DATA_DIR=str(run_dir / "data"))
+    env.setdefault("MPLBACKEND", "Agg")
+    cmd = [sys.executable, "-m", "pytask", "-c", str(run_dir / "pyproject.toml")]
+    cmd += [str(package_dir / f) for f in task_files]
+
+    with open(log_path, "a") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            cmd, cwd=here(), env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        # wait4 gives the resource usage of this run alone. ru_maxrss is the peak of the
+        # largest single process among pytask and the workers it waited for.
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall_time = time.perf_counter() - start
+
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"pytask failed for {task_files}, see {log_path}")
+    return {"wall_time_s": wall_time, "peak_rss_mb": rusage.ru_maxrss / 1024}
+
+
+def benchmark_size(size: str, run_dir: Path, seed: int):
+    """Writes the fixtures of one size and runs every stage on them.
+
+    size: str = The name of the size in SIZES.
+    run_dir: Path = The directory to write the fixtures, outputs and logs to. It is
+    replaced.
+    seed: int = The seed of the fixtures.
+
+    Returns: A dictionary of the size parameters and the results of each stage.
+    """
+    shutil.rmtree(run_dir, ignore_errors=True)
+    data_dir = run_dir / "data"
+    for sub_dir in ["raw", "interim", "processed"]:
+        (data_dir / sub_dir).mkdir(parents=True)
+    (run_dir / "pyproject.toml").write_text(PYTASK_CONFIG)
+    write_fixtures(output_dir=data_dir / "raw", seed=seed, **SIZES[size])
+
+    log_path = run_dir / "pytask.log"
+    stages = {"setup": run_stage(SETUP_TASKS, run_dir, log_path)}
+    for stage, (task_files, patterns) in STAGES.items():
+        result = run_stage(task_files, run_dir, log_path)
+        result["rows"] = count_rows(data_dir, patterns)
+        result["rows_per_s"] = result["rows"] / result["wall_time_s"]
+        stages[stage] = result
+        print(
+            f"{size:>8} {stage:>12}: {result['wall_time_s']:8.2f} s "
+            f"{result['peak_rss_mb']:9.1f} MB {result['rows_per_s']:12,.0f} rows/s"
+        )
+    return {**SIZES[size], "stages": stages}
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Finds the stages that regressed from the baseline.
+
+    results: dict = The benchmark results.
+    baseline: dict = The baseline results.
+    threshold: float = The allowed relative increase, 0.25 is 25%.
+
+    Returns: A list of messages, one per regressed stage and metric.
+    """
+    regressions = []
+    for size, size_result in results["sizes"].items():
+        base_stages = baseline.get("sizes", {}).get(size, {}).get("stages", {})
+        for stage, result in size_result["stages"].items():
+            if stage == "setup" or stage not in base_stages:
+                continue
+            for metric in ["wall_time_s", "peak_rss_mb"]:
+                base_value = base_stages[stage][metric]
+                if result[metric] > base_value * (1 + threshold):
+                    regressions.append(
+                        f"{size} {stage} {metric}: {result[metric]:.2f} vs baseline "
+                        f"{base_value:.2f} (+{result[metric] / base_value - 1:.0%})"
+                    )
+    return regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on synthetic inputs."
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"]
+    )
+    parser.add_argument("--run-dir", type=Path, default=BENCHMARK_DIR / "runs")
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "year": YEAR,
+        "states": STATE_INFO,
+        "sizes": {
+            size: benchmark_size(size, args.run_dir / size, args.seed)
+            for size in args.sizes
+        },
+    }
+
+    output = args.output or (
+        BENCHMARK_DIR / "results" / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}, nothing to compare")
+        return
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.threshold
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Description: This file contains the checkpoints that let long tasks resume the shards they finished before a crash.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# A task that works through the shards of a state (the counties of IPF, the PUMAs of
+# the sampling, the counties of the coordinates) writes every finished shard to a
+# partial directory, data/interim/checkpoints/{name}:
+#   {shard}.parquet  <- the result of a shard, written to a temporary file and renamed
+#                       into place.
+#   manifest.json    <- the signature of the inputs and parameters the shards were run
+#                       with, and the shards that are finished.
+# When the task runs again after a crash with the same inputs, it skips the finished
+# shards. The output is written to a temporary file and renamed into place at the
+# end, and then the partial directory is deleted. Shards of different inputs are
+# thrown away.
+
+import json
+import os
+import shutil
+import socket
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from rti_synth_pop.config import CHECKPOINT, checkpoint_dir
+
+
+# %%
+def write_atomic(path: Path, write: Callable[[Path], None]):
+    """Writes a file under a temporary name and renames it into place.
+
+    path: Path = The file to write.
+    write: Callable[[Path], None] = Writes the file to the path it is given.
+
+    Returns: None
+    """
+    tmp_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def input_signature(input_paths: list[Path], params: dict | None = None):
+    """Describes the inputs of a task cheaply, by the size and modification time of
+    its files, plus the parameters that change its results.
+
+    input_paths: list[Path] = The input files of the task.
+    params: dict | None = Other values that change the results, for example the seed.
+
+    Returns: A JSON serializable dictionary of the file stats and the parameters.
+    """
+    signature = {}
+    for path in input_paths:
+        stat = Path(path).stat()
+        signature[str(path)] = [stat.st_size, stat.st_mtime_ns]
+    return {"inputs": signature, "params": params or {}}
+
+
+def open_checkpoint(name: str, input_paths: list[Path], params: dict | None = None):
+    """Opens the partial directory of a task, keeping its shards if the inputs match.
+
+    name: str = The name of the partial directory, unique per task and state.
+    input_paths: list[Path] = The input files of the task.
+    params: dict | None = Other values that change the results, for example the seed.
+
+    Returns: The partial directory and the set of finished shards, or None and an empty
+    set if CHECKPOINT is off.
+    """
+    if not CHECKPOINT:
+        return None, set()
+    partial_dir = checkpoint_dir / name
+    signature = input_signature(input_paths, params)
+    manifest_path = partial_dir / "manifest.json"
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["signature"] == signature:
+            return partial_dir, set(manifest["shards"])
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    partial_dir.mkdir(parents=True)
+    manifest = {"signature": signature, "shards": []}
+    write_atomic(manifest_path, lambda p: p.write_text(json.dumps(manifest)))
+    return partial_dir, set()
+
+
+def save_shard(partial_dir: Path | None, shard: str, df: pd.DataFrame):
+    """Writes a finished shard and adds it to the manifest.
+
+    partial_dir: Path | None = The partial directory from open_checkpoint.
+    shard: str = The shard id, for example the county FIPS.
+    df: pd.DataFrame = The result of the shard.
+
+    Returns: None
+    """
+    if partial_dir is None:
+        return
+    write_atomic(partial_dir / f"{shard}.parquet", df.to_parquet)
+    manifest_path = partial_dir / "manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+    manifest["shards"] = sorted(set(manifest["shards"]) | {shard})
+    write_atomic(manifest_path, lambda p: p.write_text(json.dumps(manifest)))
+
+
+def load_shard(partial_dir: Path, shard: str):
+    """Reads a finished shard.
+
+    partial_dir: Path = The partial directory from open_checkpoint.
+    shard: str = The name of the shard, for example a county or PUMA.
+
+    Returns: The dataframe of the shard.
+    """
+    return pd.read_parquet(partial_dir / f"{shard}.parquet")
+
+
+def finalize(
+    partial_dir: Path | None, output_path: Path, write: Callable[[Path], None]
+):
+    """Writes the output of a task atomically and deletes its partial directory.
+
+    partial_dir: Path | None = The partial directory from open_checkpoint.
+    output_path: Path = The output file.
+    write: Callable[[Path], None] = Writes the output to the path it is given.
+
+    Returns: None
+    """
+    write_atomic(output_path, write)
+    close_checkpoint(partial_dir)
+
+
+def close_checkpoint(partial_dir: Path | None):
+    """Deletes the partial directory of a task once its outputs are written.
+
+    partial_dir: Path | None = The partial directory from open_checkpoint, or None if
+    CHECKPOINT is off.
+
+    Returns: None
+    """
+    if partial_dir is not None:
+        shutil.rmtree(partial_dir, ignore_errors=True)
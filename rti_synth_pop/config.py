@@ -3,7 +3,9 @@
 # Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
 # nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
 
-import pandas as pd
+import os
+from pathlib import Path
+
 from pyprojroot import here
 
 # FOR THE USER: Currently you can configure the year and states you would like to run
@@ -18,13 +20,135 @@ from pyprojroot import here
 STATE_INFO = [("WY", "56")]
 YEAR = 2019
 SURVEY = "acs5"
+# run every state and DC instead of the states above. Run it with the scheduler,
+# python -m rti_synth_pop.scheduler, which runs the states in parallel pytask processes
+# sized to the cores and memory of the machine.
+NATIONAL_RUN = False
 # ======================================================================================
 
+if NATIONAL_RUN:
+    # pytask imports the config for every task file, so the libraries that only some
+    # settings or functions need are imported where they are used.
+    import us
+
+    STATE_INFO = [(state.abbr, state.fips) for state in us.states.STATES]
+    STATE_INFO = sorted(STATE_INFO + [(us.states.DC.abbr, us.states.DC.fips)])
+# the scheduler runs each state in its own pytask process, with the state set here as
+# "st_abbr:st_fips", separated by commas.
+if os.environ.get("RTI_SYNTH_POP_STATES"):
+    STATE_INFO = [
+        tuple(state.split(":"))
+        for state in os.environ["RTI_SYNTH_POP_STATES"].split(",")
+    ]
+# number of workers of the pools inside a task: the threads task 6 samples the PUMAs of
+# a state with, and the processes task 8 places counties with. The scheduler sets it for
+# each state from the estimated work of the state.
+N_JOBS = int(os.environ.get("RTI_SYNTH_POP_N_JOBS", os.cpu_count()))
+
 vars_list = ["size", "age", "income", "race", "ethnicity"]
-data_dir = here() / "data"
+# set RTI_SYNTH_POP_DATA_DIR to keep the data somewhere else, for example for the
+# benchmarks or a run on synthetic inputs.
+if os.environ.get("RTI_SYNTH_POP_DATA_DIR"):
+    data_dir = Path(os.environ["RTI_SYNTH_POP_DATA_DIR"])
+else:
+    data_dir = here() / "data"
 raw_data_dir = data_dir / "raw"
 interim_data_dir = data_dir / "interim"
 processed_data_dir = data_dir / "processed"
+metrics_dir = data_dir / "metrics"
+checkpoint_dir = interim_data_dir / "checkpoints"
+incremental_dir = interim_data_dir / "incremental"
+
+# record the time, memory and row counts of every task to data/metrics. See
+# instrumentation.py.
+METRICS = True
+# also profile every task and tracked block: None, "cprofile", or "py-spy" for the
+# sampling profiler (py-spy has to be installed).
+PROFILER = None
+# the pytask configuration of the pytask roots the scheduler and the benchmarks
+# create. Like pyproject.toml, it registers the metrics hook of instrumentation.py.
+PYTASK_CONFIG = (
+    '[tool.pytask.ini_options]\nhook_module = ["rti_synth_pop.instrumentation"]\n'
+)
+
+# write the finished counties of IPF, PUMAs of the sampling and counties of the
+# coordinates ("mask" method) to data/interim/checkpoints, so a task that crashed
+# resumes from the shards it finished when it runs again. See checkpoint.py.
+CHECKPOINT = True
+# rerun IPF, sampling and coordinates when their inputs change, and recompute only the
+# block groups (PUMAs for the sampling) whose inputs changed, keeping the rest of the
+# existing output. See incremental.py. Without it, these tasks are skipped while their
+# outputs exist.
+INCREMENTAL = False
+# run IPF, the sampling, the population files and the coordinates (tasks 4 to 8) of a
+# state in one task, task_4_to_8_fused.py, handing the tables from stage to stage in
+# memory instead of writing and reading them back from data/interim. The separate
+# tasks are not collected then. With INCREMENTAL, the fused task reruns in full when
+# its inputs change, instead of only for the units that changed.
+FUSED = False
+# with FUSED, still write the interim IPF counts, sampled serial numbers and households,
+# for debugging.
+FUSED_WRITE_INTERIM = False
+
+# the file format of the recoded PUMS households, IPF counts, sampled serial numbers
+# and households that tasks 3 to 8 hand to each other. See interim.py.
+#   "parquet" = compressed Parquet, decoded in full when it is read.
+#   "arrow"   = Arrow IPC (Feather v2), read through a memory map. Uncompressed files
+#               are used in place without decoding, and processes that read the same
+#               file share its pages.
+INTERIM_FORMAT = "parquet"
+# the compression of the "arrow" interim files: None, "lz4" or "zstd". Compressed files
+# are smaller but have to be decompressed into memory when they are read.
+INTERIM_COMPRESSION = None
+INTERIM_SUFFIX = ".arrow" if INTERIM_FORMAT == "arrow" else ".parquet"
+
+# Population rasters written by the pipeline are tiled and compressed, so windowed
+# reads only decode the blocks they touch.
+RASTER_PROFILE = {
+    "driver": "GTiff",
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "compress": "deflate",
+    "BIGTIFF": "IF_SAFER",
+    "num_threads": "all_cpus",
+}
+RASTER_OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+# size in MB of the chunks the LandScan merge is processed in.
+RASTER_MERGE_MEM_LIMIT = 512
+# number of cells to pad the per-state clip of the population raster by.
+RASTER_CLIP_BUFFER_CELLS = 16
+
+# How task 8 places households on the population raster:
+#   "mask"  = read and polygonize the raster cells of each block group separately.
+#   "zonal" = label the raster with block groups once per state and draw the cells of
+#             all households from that single read. Much faster for large states.
+COORDINATE_METHOD = "mask"
+# how many times a household point that fell outside its block group is redrawn inside
+# its cell before it is put on the cell center.
+POINT_REDRAW_LIMIT = 20
+# number of worker processes task 8 spreads the counties of a state over for the
+# "mask" method. 1 runs in the main process. N_JOBS when the scheduler sets it.
+COORDINATE_N_JOBS = N_JOBS if "RTI_SYNTH_POP_N_JOBS" in os.environ else 1
+# keep the masked population window of each block group in data/interim, so reruns of
+# task 8 with an unchanged raster and geometry skip the raster reads.
+WEIGHT_CACHE = True
+# base seed for the random draws. Each block group seeds its own generator from this
+# and its GEOID, so results do not depend on how the work is split up.
+SEED = 42
+
+# How task 5 finds the PUMA of each block group:
+#   "spatial"      = join a representative point of each block group to the PUMA
+#                    polygons.
+#   "relationship" = look up the tract of each block group in the Census tract to PUMA
+#                    relationship file. Tracts missing from the file fall back to the
+#                    spatial join.
+CROSSWALK_METHOD = "spatial"
+TRACT_PUMA_REL_URL = (
+    "https://www2.census.gov/geo/docs/maps-data/data/rel/"
+    "2010_Census_Tract_to_2010_PUMA.txt"
+)
+tract_puma_rel_path = raw_data_dir / "2010_Census_Tract_to_2010_PUMA.txt"
 
 pums_h_col_dict = {
     "size": "NP",
@@ -63,6 +187,8 @@ income_labels = [
 
 
 def income_map(column):
+    import pandas as pd
+
     return pd.cut(
         column,
         bins=[-(10**10), 9999, 14999, 24999, 34999, 49999, 99999, 10**10],
@@ -74,6 +200,8 @@ age_labels = ["<25", "25-34", "35-44", "45-54", "55-64", "65-74", ">=75"]
 
 
 def age_map(column):
+    import pandas as pd
+
     return pd.cut(
         column,
         bins=[-1, 24.5, 34.5, 44.5, 54.5, 64.5, 74.5, 10**10],
@@ -85,6 +213,8 @@ ethnicity_labels = ["hispanic", "not_hispanic"]
 
 
 def ethnicity_map(column):
+    import pandas as pd
+
     return pd.cut(
         column,
         bins=[-1, 1, 100],
@@ -234,6 +364,26 @@ pums_h_col_dict = {
 }
 pums_col_list = list(pums_h_col_dict.values())
 
+# How the processed households and persons are written:
+#   "wide"       = every household and person with all their PUMS attributes.
+#   "normalized" = a narrow household table (hh_id, serialno_id, blkgrp_fips, lon_4326,
+#                  lat_4326), the PUMS households and persons once per serialno_id, and
+#                  a DuckDB view file that joins them back into the wide tables.
+OUTPUT_LAYOUT = "wide"
+
+# write the processed households and persons as Hive partitioned datasets
+# (households/year=/state_fips=/county_fips=/) instead of one file per state.
+OUTPUT_PARTITIONED = False
+# max rows per row group in the partitioned datasets.
+OUTPUT_ROW_GROUP_SIZE = 131_072
+
+# rows per row group in the PUMS person cache. Smaller groups let the serialno filter
+# in task 7 skip more of the file.
+PERSON_CACHE_ROW_GROUP_SIZE = 65_536
+
+# hh_id is the state FIPS times this plus the household row number in the state.
+HH_ID_STATE_MULTIPLIER = 10**10
+
 rename_synpop_h = {
     "SERIALNO": "serialno",
     "BG_GEOID": "blkgrp_fips",
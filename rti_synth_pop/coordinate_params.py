@@ -0,0 +1,59 @@
+# Description: This file contains the paths of the coordinate stage of each state.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The paths are used by task 8, by the fused task and by the sharded coordinates stage.
+# They live here rather than in task_8_assign_coordinates.py, so importing them does not
+# collect the tasks of task 8 or load its dependencies.
+
+from rti_synth_pop.config import (
+    INTERIM_SUFFIX,
+    OUTPUT_LAYOUT,
+    OUTPUT_PARTITIONED,
+    YEAR,
+    interim_data_dir,
+    processed_data_dir,
+)
+from rti_synth_pop.partitions import partitioned_path
+
+
+# %%
+def generate_params(st_info: list[tuple]) -> dict:
+    id_to_kwargs = {}
+    for st_abbr, st_fips in st_info:
+        id_to_kwargs[st_abbr] = {
+            # "serialno_path": interim_data_dir
+            # / f"{st_fips}_household_synthpop_serialnos.parquet",
+            "h_sp_path": interim_data_dir
+            / f"{st_fips}_{YEAR}_households{INTERIM_SUFFIX}",
+            "bg_geo_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_bg.parquet",
+            "pop_raster_path": interim_data_dir / f"{st_fips}_{YEAR}_pop_raster.tif",
+            "output_paths": {
+                "households": processed_data_dir
+                / f"{st_abbr}_{YEAR}_households.parquet",
+                "households_w_geom": processed_data_dir
+                / f"{st_abbr}_{YEAR}_households_w_geom.parquet",
+            },
+            # a str and not a Path, so pytask does not track the cache as a
+            # dependency of the task.
+            "weight_cache_dir": str(interim_data_dir / f"{st_fips}_{YEAR}_bg_weights"),
+        }
+        if OUTPUT_LAYOUT == "normalized":
+            id_to_kwargs[st_abbr]["pums_persons_path"] = (
+                processed_data_dir / f"{st_fips}_{YEAR}_pums_persons.parquet"
+            )
+            id_to_kwargs[st_abbr]["output_paths"] = {
+                "households": processed_data_dir
+                / f"{st_abbr}_{YEAR}_households_fact.parquet",
+                "households_w_geom": processed_data_dir
+                / f"{st_abbr}_{YEAR}_households_fact_w_geom.parquet",
+                "pums_households": processed_data_dir
+                / f"{st_fips}_{YEAR}_pums_households.parquet",
+                "views": processed_data_dir / f"{st_abbr}_{YEAR}_views.sql",
+            }
+        if OUTPUT_PARTITIONED:
+            id_to_kwargs[st_abbr]["output_paths"]["households"] = partitioned_path(
+                "households", processed_data_dir, YEAR, st_fips
+            )
+    return id_to_kwargs
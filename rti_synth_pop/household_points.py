@@ -0,0 +1,567 @@
+# Description: This file contains the functions to place synthetic households on the population raster.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+from contextlib import ExitStack
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import rasterio
+import shapely
+from affine import Affine
+from joblib import Parallel, delayed
+from pyarrow import parquet
+from rasterio.features import rasterize
+from rasterio.mask import mask
+from tqdm.auto import tqdm
+
+from rti_synth_pop.checkpoint import load_shard, save_shard
+from rti_synth_pop.config import (
+    COORDINATE_METHOD,
+    COORDINATE_N_JOBS,
+    POINT_REDRAW_LIMIT,
+    SEED,
+)
+from rti_synth_pop.incremental import hash_values
+from rti_synth_pop.weight_cache import (
+    geometry_hashes,
+    read_window,
+    window_hashes,
+)
+
+
+# %%
+def block_group_rng(geoid: str):
+    """Creates the random generator for placing the households of one block group.
+
+    The generator is seeded from the block group GEOID, so a block group gets the
+    same points whether it is run alone, serially, or in any worker process.
+
+    geoid: str = The block group GEOID.
+
+    Returns: A numpy random Generator.
+    """
+    return np.random.default_rng([SEED, int(geoid)])
+
+
+def households_by_block_group(households: pa.Table):
+    """Sorts the households by block group once.
+
+    The households of each block group are one contiguous slice of the sort order, so
+    the points of a block group can be written into the rows of its households.
+
+    households: pa.Table = The households, with blkgrp_fips.
+
+    Returns: The sort order of the households, and the GEOID, start in the sort order
+    and household count of each block group.
+    """
+    geoids = households["blkgrp_fips"].to_pandas().astype(str).str.zfill(12).to_numpy()
+    hh_order = np.argsort(geoids, kind="stable")
+    bg_geoids, bg_starts, bg_counts = np.unique(
+        geoids[hh_order], return_index=True, return_counts=True
+    )
+    return hh_order, bg_geoids, bg_starts, bg_counts
+
+
+def read_block_groups(bg_geo_path: Path, crs, household_count: pd.Series):
+    """Reads the block groups of a state with their number of households.
+
+    bg_geo_path: Path = The GeoParquet of the block groups of the state.
+    crs: CRS = The CRS of the population raster.
+    household_count: pd.Series = The household count of each block group GEOID.
+
+    Returns: A GeoDataFrame of the block groups in the raster CRS, indexed by GEOID,
+    with COUNTYFP and household_count.
+    """
+    return (
+        gpd.read_parquet(bg_geo_path, columns=["GEOID", "COUNTYFP", "geometry"])
+        .to_crs(crs)
+        .set_index("GEOID")
+        .join(household_count.rename("household_count"))
+        .fillna({"household_count": 0})
+        .astype({"household_count": int})
+    )
+
+
+def block_group_hashes(
+    bg_gdf: gpd.GeoDataFrame,
+    pop_raster_path: Path,
+    raster_hash: str,
+    old_hashes: pd.DataFrame,
+):
+    """Hashes the inputs of the points of each block group, for INCREMENTAL.
+
+    The points of a block group depend on its household count, its geometry and the
+    raster cells under it. The cells are only hashed again for block groups that are
+    new, whose geometry changed, or all of them if the raster changed, so an unchanged
+    raster is not read at all.
+
+    bg_gdf: gpd.GeoDataFrame = The block groups from read_block_groups.
+    pop_raster_path: Path = The population raster.
+    raster_hash: str = The raster_signature of the population raster.
+    old_hashes: pd.DataFrame = The hashes stored with the existing output.
+
+    Returns: A dataframe of the hash, geom_hash, window_hash and raster_hash of each
+    block group.
+    """
+    geom_hash = pd.Series(geometry_hashes(bg_gdf.geometry.values), index=bg_gdf.index)
+    window_hash = pd.Series(None, index=bg_gdf.index, dtype=object)
+    if old_hashes.shape[0] and (old_hashes["raster_hash"] == raster_hash).all():
+        same_geom = geom_hash == old_hashes["geom_hash"].reindex(bg_gdf.index)
+        window_hash[same_geom] = old_hashes["window_hash"].reindex(bg_gdf.index)
+    todo = window_hash.isna().to_numpy()
+    if todo.any():
+        window_hash[todo] = window_hashes(pop_raster_path, bg_gdf.geometry.values[todo])
+    return pd.DataFrame(
+        {
+            "hash": hash_values(
+                bg_gdf["household_count"],
+                geom_hash,
+                window_hash,
+                salt=f"{COORDINATE_METHOD}|{SEED}",
+            ),
+            "geom_hash": geom_hash,
+            "window_hash": window_hash,
+            "raster_hash": raster_hash,
+        },
+        index=bg_gdf.index,
+    )
+
+
+def read_output_points(households_w_geom_path: Path, geoids):
+    """Reads the points of some block groups back from an existing output.
+
+    households_w_geom_path: Path = The households with geometry output.
+    geoids: array like = The block groups to read.
+
+    Returns: A dictionary of block group GEOID to the x and y arrays of its households,
+    in the row order of its households.
+    """
+    households = parquet.read_table(
+        households_w_geom_path, columns=["blkgrp_fips", "lon_4326", "lat_4326"]
+    ).to_pandas()
+    points_df = pd.DataFrame(
+        {
+            "GEOID": households["blkgrp_fips"].astype(str).str.zfill(12),
+            "x": households["lon_4326"],
+            "y": households["lat_4326"],
+        }
+    )
+    points_df = points_df.loc[points_df["GEOID"].isin(geoids)]
+    return points_from_frame(points_df.sort_values("GEOID", kind="stable"))
+
+
+def household_coordinates(
+    bg_points: dict,
+    hh_order: np.ndarray,
+    bg_geoids: np.ndarray,
+    bg_starts: np.ndarray,
+    bg_counts: np.ndarray,
+):
+    """Lines the points of every block group up with the rows of its households.
+
+    bg_points: dict = Block group GEOID to the x and y arrays of its households.
+    hh_order: np.ndarray = The sort order from households_by_block_group.
+    bg_geoids: np.ndarray = The block group GEOIDs from households_by_block_group.
+    bg_starts: np.ndarray = The starts from households_by_block_group.
+    bg_counts: np.ndarray = The household counts from households_by_block_group.
+
+    Returns: The x and y arrays of the households, in the row order of the households.
+    """
+    lon = np.empty(hh_order.size, dtype=np.float64)
+    lat = np.empty(hh_order.size, dtype=np.float64)
+    for geoid, start, count in zip(bg_geoids, bg_starts, bg_counts):
+        bg_hh_idx = hh_order[start : start + count]
+        lon[bg_hh_idx], lat[bg_hh_idx] = bg_points[geoid]
+    return lon, lat
+
+
+def points_to_frame(bg_points: dict):
+    """Flattens the points of block groups into a dataframe, to store them.
+
+    bg_points: dict = Block group GEOID to the x and y arrays of its households.
+
+    Returns: A dataframe of the GEOID, x and y of every point, with the points of each
+    block group in one run of rows in the order they were drawn.
+    """
+    if not bg_points:
+        return pd.DataFrame({"GEOID": [], "x": [], "y": []})
+    return pd.DataFrame(
+        {
+            "GEOID": np.repeat(
+                list(bg_points), [x.size for x, _ in bg_points.values()]
+            ),
+            "x": np.concatenate([x for x, _ in bg_points.values()]),
+            "y": np.concatenate([y for _, y in bg_points.values()]),
+        }
+    )
+
+
+def points_from_frame(points_df: pd.DataFrame):
+    """Reverses points_to_frame.
+
+    points_df: pd.DataFrame = The points from points_to_frame, or several of them put
+    together.
+
+    Returns: A dictionary of block group GEOID to the x and y arrays of its households.
+    """
+    geoids = points_df["GEOID"].to_numpy()
+    x, y = points_df["x"].to_numpy(), points_df["y"].to_numpy()
+    bg_geoids, bg_starts, bg_counts = np.unique(
+        geoids, return_index=True, return_counts=True
+    )
+    return {
+        geoid: (x[start : start + count], y[start : start + count])
+        for geoid, start, count in zip(bg_geoids, bg_starts, bg_counts)
+    }
+
+
+def label_block_groups(
+    bg_gdf: gpd.GeoDataFrame, out_shape: tuple[int, int], transform: Affine
+):
+    """Burns the position of each block group onto the population raster grid.
+
+    A cell belongs to the block group that contains its center, so every cell has at
+    most one label.
+
+    bg_gdf: gpd.GeoDataFrame = Block groups in the raster CRS.
+    out_shape: tuple[int, int] = The (rows, cols) of the population raster.
+    transform: Affine = The transform of the population raster.
+
+    Returns: An int32 array of 1-based block group positions, 0 where there is none.
+    """
+    return rasterize(
+        zip(bg_gdf.geometry.values, range(1, bg_gdf.shape[0] + 1)),
+        out_shape=out_shape,
+        transform=transform,
+        fill=0,
+        dtype="int32",
+    )
+
+
+def group_cells_by_label(label_arr: np.ndarray, pop_arr: np.ndarray, n_labels: int):
+    """Gathers the populated cells of every block group with a single sort.
+
+    label_arr: np.ndarray = The block group labels from label_block_groups.
+    pop_arr: np.ndarray = The population raster, same shape as label_arr.
+    n_labels: int = The number of block groups that were labeled.
+
+    Returns: The flat cell indexes sorted by label and the offsets into them, so the
+    cells of the block group at position i are cell_idx[offsets[i]:offsets[i + 1]].
+    """
+    labels = label_arr.ravel()
+    cell_idx = np.flatnonzero((labels > 0) & (pop_arr.ravel() > 0))
+    cell_labels = labels[cell_idx]
+    cell_idx = cell_idx[np.argsort(cell_labels, kind="stable")]
+
+    offsets = np.zeros(n_labels + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cell_labels, minlength=n_labels + 1)[1:], out=offsets[1:])
+    return cell_idx, offsets
+
+
+def sample_cells(
+    cell_idx: np.ndarray,
+    pop_arr: np.ndarray,
+    household_count: int,
+    rng: np.random.Generator,
+):
+    """Draws the raster cell of every household in a block group.
+
+    cell_idx: np.ndarray = The flat indexes of the block group's populated cells.
+    pop_arr: np.ndarray = The population raster.
+    household_count: int = The number of households to place.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: The flat index of the cell for each household.
+    """
+    weights = pop_arr.ravel()[cell_idx].astype(np.float64)
+    cell_counts = rng.multinomial(household_count, weights / weights.sum())
+    return np.repeat(cell_idx, cell_counts)
+
+
+def points_in_cells(
+    cells: np.ndarray,
+    width: int,
+    transform: Affine,
+    rng: np.random.Generator,
+):
+    """Generates a uniformly random point inside each of the given raster cells.
+
+    cells: np.ndarray = Flat cell indexes, one per point.
+    width: int = The number of columns in the raster.
+    transform: Affine = The transform of the raster.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: Arrays of the x and y coordinates of the points.
+    """
+    rows, cols = np.divmod(cells, width)
+    x, y = transform * (
+        cols + rng.random(cells.size),
+        rows + rng.random(cells.size),
+    )
+    return x, y
+
+
+def keep_points_in_geometry(
+    geom: shapely.Geometry,
+    cells: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    width: int,
+    transform: Affine,
+    rng: np.random.Generator,
+):
+    """Redraws the points that fell outside the geometry inside their own cell.
+
+    Only the points in cells that cross the edge of the geometry are checked. Every
+    cell has its center in the geometry, so a redraw always has a chance of landing
+    inside. Points still outside after POINT_REDRAW_LIMIT tries go to the cell center.
+
+    geom: shapely.Geometry = The block group geometry in the raster CRS.
+    cells: np.ndarray = Flat cell indexes, one per point.
+    x: np.ndarray = The x coordinates of the points, updated in place.
+    y: np.ndarray = The y coordinates of the points, updated in place.
+    width: int = The number of columns in the raster.
+    transform: Affine = The transform of the raster.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: None
+    """
+    shapely.prepare(geom)
+    unique_cells = np.unique(cells)
+    rows, cols = np.divmod(unique_cells, width)
+    x0, y0 = transform * (cols, rows)
+    x1, y1 = transform * (cols + 1, rows + 1)
+    cell_boxes = shapely.box(
+        np.minimum(x0, x1), np.minimum(y0, y1), np.maximum(x0, x1), np.maximum(y0, y1)
+    )
+    edge_cells = unique_cells[~shapely.contains(geom, cell_boxes)]
+
+    check_idx = np.flatnonzero(np.isin(cells, edge_cells))
+    for _ in range(POINT_REDRAW_LIMIT):
+        check_idx = check_idx[~shapely.contains_xy(geom, x[check_idx], y[check_idx])]
+        if check_idx.size == 0:
+            return
+        x[check_idx], y[check_idx] = points_in_cells(
+            cells[check_idx], width, transform, rng
+        )
+
+    check_idx = check_idx[~shapely.contains_xy(geom, x[check_idx], y[check_idx])]
+    rows, cols = np.divmod(cells[check_idx], width)
+    x[check_idx], y[check_idx] = transform * (cols + 0.5, rows + 0.5)
+
+
+def points_in_geometry(
+    geom: shapely.Geometry, household_count: int, rng: np.random.Generator
+):
+    """Spreads points uniformly over a geometry, without a population distribution.
+
+    geom: shapely.Geometry = The block group geometry.
+    household_count: int = The number of points to generate.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: Arrays of the x and y coordinates of the points.
+    """
+    points = (
+        gpd.GeoSeries(geom)
+        .sample_points(household_count, rng=rng)
+        .explode(ignore_index=True)
+        .values
+    )
+    return shapely.get_x(points), shapely.get_y(points)
+
+
+def sample_points(
+    record,
+    bg_pop_arr: np.ndarray,
+    bg_transform: Affine,
+    rng: np.random.Generator,
+):
+    """Places the households of one block group on its masked population raster.
+
+    The cells of the households are drawn from the population counts, and each
+    household gets a uniformly random offset inside its cell. Cells on the edge of
+    the block group are checked so their points stay inside the block group.
+
+    record: namedtuple = The block group, with geometry and household_count.
+    bg_pop_arr: np.ndarray = The population raster masked and cropped to the block
+    group.
+    bg_transform: Affine = The transform of bg_pop_arr.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: Arrays of the x and y coordinates of the households, or None if the block
+    group has no households.
+    """
+    geom = record.geometry
+    household_count = record.household_count
+    # if we don't have any households in the geometry, return None
+    if household_count < 1:
+        return None
+
+    # if the pop raster has no data, but our synthpop has persons, we randomly
+    # distribution them in the block group without a distribution.
+    if (bg_pop_arr.size == 0) or (np.sum(bg_pop_arr) == 0):
+        return points_in_geometry(geom, household_count, rng)
+
+    width = bg_pop_arr.shape[1]
+    cells = sample_cells(
+        np.flatnonzero(bg_pop_arr > 0), bg_pop_arr, household_count, rng
+    )
+    x, y = points_in_cells(cells, width, bg_transform, rng)
+    keep_points_in_geometry(geom, cells, x, y, width, bg_transform, rng)
+    return x, y
+
+
+def zonal_sample_points(
+    bg_gdf: gpd.GeoDataFrame,
+    pop_arr: np.ndarray,
+    transform: Affine,
+):
+    """Places the households of every block group from one labeled population grid.
+
+    The block groups are burned onto the raster grid once, and the cells of each
+    block group are found with one sort of the label array. Households are spread
+    over the cells with a single multinomial draw per block group, so there are no
+    per block group raster reads or polygon clips.
+
+    bg_gdf: gpd.GeoDataFrame = Block groups in the raster CRS, with household_count.
+    pop_arr: np.ndarray = The population raster for the state.
+    transform: Affine = The transform of the population raster.
+
+    Returns: A dictionary of block group GEOID to the x and y arrays of its households.
+    """
+    label_arr = label_block_groups(bg_gdf, pop_arr.shape, transform)
+    cell_idx, offsets = group_cells_by_label(label_arr, pop_arr, bg_gdf.shape[0])
+    width = pop_arr.shape[1]
+
+    bg_points = {}
+    for i, record in enumerate(bg_gdf.itertuples()):
+        household_count = record.household_count
+        if household_count < 1:
+            continue
+        rng = block_group_rng(record.Index)
+        bg_cells = cell_idx[offsets[i] : offsets[i + 1]]
+        # if the pop raster has no data, but our synthpop has persons, we randomly
+        # distribution them in the block group without a distribution.
+        if bg_cells.size == 0:
+            bg_points[record.Index] = points_in_geometry(
+                record.geometry, household_count, rng
+            )
+            continue
+        cells = sample_cells(bg_cells, pop_arr, household_count, rng)
+        x, y = points_in_cells(cells, width, transform, rng)
+        keep_points_in_geometry(record.geometry, cells, x, y, width, transform, rng)
+        bg_points[record.Index] = x, y
+    return bg_points
+
+
+def county_sample_points(
+    pop_raster_path: str, county_gdf: gpd.GeoDataFrame, cache_dir: Path | None = None
+):
+    """Places the households of the block groups in one county.
+
+    This runs in a worker process, so it opens its own handle to the raster, and only
+    if a block group window is not in the weight cache.
+
+    pop_raster_path: str = The path to the population raster.
+    county_gdf: gpd.GeoDataFrame = The block groups of the county in the raster CRS,
+    with household_count. With a cache, also geom_hash and the cache index columns,
+    which are missing for the block groups that are not cached.
+    cache_dir: Path | None = The weight cache directory of the state, if caching.
+
+    Returns: A dictionary of block group GEOID to the x and y arrays of its households,
+    and a dictionary of the windows that were read from the raster for the cache.
+    """
+    bg_points = {}
+    new_windows = {}
+    weights = None
+    with ExitStack() as stack:
+        src = None
+        for record in county_gdf.itertuples():
+            if cache_dir is not None and pd.notna(record.offset):
+                if weights is None:
+                    weights = np.load(Path(cache_dir) / "weights.npy", mmap_mode="r")
+                bg_pop_arr, bg_transform = read_window(weights, record)
+            else:
+                if src is None:
+                    src = stack.enter_context(rasterio.open(pop_raster_path))
+                # get the population count raster for that block group. Cells are
+                # kept when their center is inside the block group.
+                bg_pop_arr, bg_transform = mask(
+                    src,
+                    shapes=[record.geometry],
+                    crop=True,
+                    nodata=0,
+                    indexes=1,
+                )
+                if cache_dir is not None:
+                    new_windows[record.Index] = (
+                        record.geom_hash,
+                        bg_pop_arr,
+                        bg_transform,
+                    )
+            points = sample_points(
+                record, bg_pop_arr, bg_transform, block_group_rng(record.Index)
+            )
+            if points is not None:
+                bg_points[record.Index] = points
+    return bg_points, new_windows
+
+
+def sample_block_group_points(
+    bg_gdf: gpd.GeoDataFrame,
+    pop_raster_path: Path,
+    cache_dir: Path | None = None,
+    partial_dir: Path | None = None,
+    done: set = frozenset(),
+):
+    """Places the households of every block group with COORDINATE_METHOD.
+
+    The zonal method places every block group from one read of the state raster. The
+    mask method reads the raster for each block group, split by county over
+    COORDINATE_N_JOBS worker processes that each open their own raster handle, and
+    saves every county as a shard of the checkpoint as soon as it is placed.
+
+    bg_gdf: gpd.GeoDataFrame = The block groups in the raster CRS, with
+    household_count, and with a cache the columns from join_cache_index.
+    pop_raster_path: Path = The population raster.
+    cache_dir: Path | None = The weight cache directory of the state, if caching.
+    partial_dir: Path | None = The partial directory from open_checkpoint, if any.
+    done: set = The counties that are finished in the partial directory.
+
+    Returns: A dictionary of block group GEOID to the x and y arrays of its households,
+    and a dictionary of the windows that were read from the raster for the cache.
+    """
+    if COORDINATE_METHOD == "zonal":
+        with rasterio.open(pop_raster_path) as src:
+            bg_points = zonal_sample_points(
+                bg_gdf, src.read(1, masked=True).filled(0), src.transform
+            )
+        return bg_points, {}
+
+    county_groups = [
+        (county_fp, county_gdf)
+        for county_fp, county_gdf in bg_gdf.query("household_count > 0").groupby(
+            "COUNTYFP"
+        )
+        if county_fp not in done
+    ]
+    county_results = Parallel(n_jobs=COORDINATE_N_JOBS, return_as="generator")(
+        delayed(county_sample_points)(pop_raster_path, county_gdf, cache_dir)
+        for _, county_gdf in county_groups
+    )
+    bg_points = {}
+    new_windows = {}
+    # the bar advances as the counties finish, not as they are dispatched.
+    county_results = tqdm(county_results, total=len(county_groups))
+    for (county_fp, _), (points, windows) in zip(county_groups, county_results):
+        save_shard(partial_dir, county_fp, points_to_frame(points))
+        bg_points.update(points)
+        new_windows.update(windows)
+    for county_fp in done:
+        bg_points.update(points_from_frame(load_shard(partial_dir, county_fp)))
+    return bg_points, new_windows
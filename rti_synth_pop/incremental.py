@@ -0,0 +1,148 @@
+# Description: This file contains the per unit input hashes that let IPF, sampling and coordinates recompute only what changed.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# With INCREMENTAL set, each of the stages stores a hash of the inputs of every unit
+# next to its output, in data/interim/incremental/{output name}.parquet:
+#   IPF          <- per block group, its rows of the marginal tables.
+#   sampling     <- per PUMA, the rounded IPF counts of its block groups and the PUMS
+#                   households of the state, which every PUMA can sample from.
+#   coordinates  <- per block group, its household count, its geometry and the
+#                   population raster cells in its bounding box.
+# When the stage runs again, only the units whose hash changed are recomputed, and
+# the results of the other units are taken from the existing output. The hashes only
+# cover the inputs, so delete data/interim/incremental after changing the code of the
+# stages.
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from rti_synth_pop.checkpoint import write_atomic
+from rti_synth_pop.config import incremental_dir
+
+
+# %%
+def combine_hashes(units: np.ndarray, row_hashes: np.ndarray, salt: str = ""):
+    """Hashes the rows of each unit together, in the order of the rows.
+
+    units: np.ndarray = The unit of each row.
+    row_hashes: np.ndarray = The uint64 hash of each row.
+    salt: str = Hashed into every unit, for inputs that every unit depends on.
+
+    Returns: A series of the hex digest of each unit, indexed by the sorted units.
+    """
+    order = np.argsort(units, kind="stable")
+    unique_units, starts = np.unique(units[order], return_index=True)
+    ends = np.append(starts[1:], order.size)
+    row_hashes = np.ascontiguousarray(row_hashes[order])
+    digests = []
+    for start, end in zip(starts, ends):
+        digest = hashlib.blake2b(salt.encode(), digest_size=16)
+        digest.update(row_hashes[start:end].tobytes())
+        digests.append(digest.hexdigest())
+    return pd.Series(digests, index=unique_units, dtype=object)
+
+
+def frame_hashes(df: pd.DataFrame, unit_col: str, salt: str = ""):
+    """Hashes the rows of a dataframe together per unit.
+
+    df: pd.DataFrame = The inputs of all units.
+    unit_col: str = The column with the unit of each row.
+    salt: str = Hashed into every unit, for inputs that every unit depends on.
+
+    Returns: A series of the hex digest of each unit.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return combine_hashes(df[unit_col].to_numpy(), row_hashes, salt)
+
+
+def table_hash(df: pd.DataFrame):
+    """Hashes all rows of a dataframe, for inputs that every unit depends on.
+
+    df: pd.DataFrame = The input.
+
+    Returns: The hex digest of the rows.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def hash_values(*columns, salt: str = ""):
+    """Hashes the values of several columns together per row.
+
+    columns: array like = Columns of the same length.
+    salt: str = Hashed into every row, for inputs that every unit depends on.
+
+    Returns: A list of the hex digest of each row.
+    """
+    return [
+        hashlib.blake2b(
+            "|".join(map(str, (salt,) + row)).encode(), digest_size=16
+        ).hexdigest()
+        for row in zip(*columns)
+    ]
+
+
+def load_unit_hashes(name: str):
+    """Reads the unit hashes of an output, if there are any.
+
+    name: str = The name of the output, usually the stem of its file.
+
+    Returns: A dataframe of the unit hashes indexed by unit, empty if there are none.
+    """
+    path = incremental_dir / f"{name}.parquet"
+    if not path.exists():
+        return pd.DataFrame(columns=["hash"])
+    return pd.read_parquet(path)
+
+
+def save_unit_hashes(name: str, unit_hashes: pd.DataFrame):
+    """Writes the unit hashes of an output, after the output is written.
+
+    name: str = The name of the output, usually the stem of its file.
+    unit_hashes: pd.DataFrame = The hashes indexed by unit, with at least a hash column.
+
+    Returns: None
+    """
+    incremental_dir.mkdir(parents=True, exist_ok=True)
+    write_atomic(incremental_dir / f"{name}.parquet", unit_hashes.to_parquet)
+
+
+def changed_units(new_hashes: pd.Series, old_hashes: pd.Series):
+    """Finds the units that are new or whose hash changed.
+
+    new_hashes: pd.Series = The hashes of the current inputs.
+    old_hashes: pd.Series = The hashes stored with the existing output.
+
+    Returns: An index of the units to recompute.
+    """
+    return new_hashes.index[new_hashes != old_hashes.reindex(new_hashes.index)]
+
+
+def splice_units(
+    old_df: pd.DataFrame,
+    old_units: np.ndarray,
+    new_df: pd.DataFrame,
+    new_units: np.ndarray,
+    order: np.ndarray,
+):
+    """Puts the kept rows of the existing output and the recomputed rows together.
+
+    The rows are ordered by the position of their unit in order, and keep their order
+    within a unit, so the output is the same as if all units were recomputed.
+
+    old_df: pd.DataFrame = The rows of the unchanged units from the existing output.
+    old_units: np.ndarray = The unit of each row of old_df.
+    new_df: pd.DataFrame = The rows of the recomputed units.
+    new_units: np.ndarray = The unit of each row of new_df.
+    order: np.ndarray = The units in the order of the output.
+
+    Returns: A dataframe of all rows.
+    """
+    position = pd.Series(np.arange(len(order)), index=order)
+    units = np.concatenate([np.asarray(old_units), np.asarray(new_units)])
+    df = pd.concat([old_df, new_df])
+    return df.iloc[np.argsort(position.loc[units].to_numpy(), kind="stable")]
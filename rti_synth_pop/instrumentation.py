@@ -0,0 +1,276 @@
+# Description: This file contains the instrumentation that records timings, memory and row counts of the tasks.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# Every task that pytask runs is tracked by the pytask_execute_task hook below, and the
+# hot loops inside the tasks are wrapped with track. Each of them appends one JSON line
+# to the metrics file of the run, data/metrics/run_{RUN_ID}.jsonl, with:
+#   name, status         <- the task function or block, and ok or error
+#   wall_time_s          <- wall clock time
+#   cpu_time_s           <- CPU time of this process, and of its waited-for children
+#   peak_rss_mb          <- the peak memory of the process during the block (Linux),
+#                           or up to the end of the block elsewhere
+#   bytes_read/written   <- disk IO of the process during the block (Linux only)
+#   rows_in/out, bytes_in/out, outputs <- for tasks, from their dependency and product
+#                                          files
+# plus any labels and values the block adds. Set RTI_SYNTH_POP_RUN_ID to group the
+# lines of several processes in one file. With config.PROFILER set, each block is also
+# profiled with cProfile or the py-spy sampling profiler.
+#
+# The hook is registered with pytask through the hook_module option in pyproject.toml,
+# so it only runs for this project and not for every pytask project in the
+# environment. A task function can not be wrapped with a decorator, because pytask
+# unwraps decorated task functions to collect them.
+
+import cProfile
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime
+
+from pytask import PPathNode, hookimpl
+from pytask.tree_util import tree_leaves
+
+from rti_synth_pop.config import METRICS, PROFILER, metrics_dir
+
+RUN_ID = os.environ.get(
+    "RTI_SYNTH_POP_RUN_ID", f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+)
+# the peak memory in MB of each open block, innermost last. A block resets the peak
+# of the process when it starts, so the blocks around it keep their peak here.
+_block_peaks = []
+
+
+# %%
+def _io_bytes():
+    """Reads the bytes this process has read from and written to disk.
+
+    Returns: The read and written bytes, or None and None off Linux.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return int(io["read_bytes"]), int(io["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_mb():
+    """Reads the peak memory of this process since its peak was last reset.
+
+    Returns: The peak resident memory in MB. Off Linux, the peak of the whole life of
+    the process.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _start_peak():
+    """Resets the peak memory of the process at the start of a block.
+
+    Returns: None
+    """
+    current = _peak_rss_mb()
+    _block_peaks[:] = [max(peak, current) for peak in _block_peaks]
+    try:
+        # 5 resets the peak resident memory, VmHWM, to the current memory.
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    _block_peaks.append(0.0)
+
+
+def _end_peak():
+    """Gets the peak memory of the block that ends and passes it to the blocks around.
+
+    Returns: The peak resident memory of the block in MB.
+    """
+    peak = max(_block_peaks.pop(), _peak_rss_mb())
+    _block_peaks[:] = [max(outer, peak) for outer in _block_peaks]
+    return peak
+
+
+def _cpu_times():
+    """Gets the CPU time of this process and of its waited-for children.
+
+    Returns: The CPU seconds of the process and of its children.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time(), children.ru_utime + children.ru_stime
+
+
+def _node_paths(nodes: dict):
+    """Finds the paths of the file nodes of a task.
+
+    nodes: dict = The dependencies or the products of a task.
+
+    Returns: A list of Paths.
+    """
+    return [node.path for node in tree_leaves(nodes) if isinstance(node, PPathNode)]
+
+
+def describe_files(paths):
+    """Sums the sizes and the parquet row counts of files.
+
+    paths: Iterable[Path] = The files.
+
+    Returns: The total bytes and the total rows of the parquet files among them.
+    """
+    # pytask loads this module for every run, also when every task is skipped.
+    from pyarrow import parquet
+
+    n_bytes, n_rows = 0, 0
+    for path in paths:
+        # a partitioned dataset is tracked by its _common_metadata file, so its rows
+        # are in the parquet files next to it.
+        if path.name == "_common_metadata":
+            dataset_bytes, dataset_rows = describe_files(path.parent.rglob("*.parquet"))
+            n_bytes, n_rows = n_bytes + dataset_bytes, n_rows + dataset_rows
+            continue
+        if not path.is_file():
+            continue
+        n_bytes += path.stat().st_size
+        if path.suffix == ".parquet":
+            try:
+                n_rows += parquet.ParquetFile(path).metadata.num_rows
+            except Exception:
+                pass
+    return n_bytes, n_rows
+
+
+def write_metrics(record: dict):
+    """Appends one record to the metrics file of the run.
+
+    record: dict = The values to write.
+
+    Returns: None
+    """
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    with open(metrics_dir / f"run_{RUN_ID}.jsonl", "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def _profile(name: str):
+    """Profiles a block with the profiler set in config.PROFILER.
+
+    name: str = The name of the block, used in the profile file name.
+
+    Returns: None
+    """
+    profile_path = metrics_dir / f"run_{RUN_ID}_{name}"
+    if PROFILER == "cprofile":
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_path.with_suffix(".prof"))
+    elif PROFILER == "py-spy":
+        py_spy = shutil.which("py-spy")
+        if py_spy is None:
+            warnings.warn("PROFILER is py-spy, but py-spy is not installed.")
+            yield
+            return
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        proc = subprocess.Popen(
+            [py_spy, "record", "--pid", str(os.getpid()), "--subprocesses"]
+            + ["--output", str(profile_path.with_suffix(".svg"))],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            yield
+        finally:
+            # py-spy writes its output when it is interrupted.
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
+    else:
+        yield
+
+
+@contextmanager
+def track(name: str, **labels):
+    """Records the time, memory and disk IO of a block to the metrics file.
+
+    The block can add values to the record through the dictionary it gets, for
+    example row counts.
+
+    name: str = The name of the block.
+    labels: Any = Values that identify the block, for example the state or the county.
+
+    Returns: A dictionary that is written with the record.
+    """
+    metrics = {}
+    if not METRICS:
+        yield metrics
+        return
+
+    start = datetime.now()
+    read_start, write_start = _io_bytes()
+    cpu_start, children_cpu_start = _cpu_times()
+    _start_peak()
+    wall_start = time.perf_counter()
+    status = "ok"
+    try:
+        with _profile(name):
+            yield metrics
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        cpu_end, children_cpu_end = _cpu_times()
+        peak_rss = _end_peak()
+        read_end, write_end = _io_bytes()
+        record = {
+            "run_id": RUN_ID,
+            "pid": os.getpid(),
+            "name": name,
+            **labels,
+            "status": status,
+            "start": start.isoformat(timespec="milliseconds"),
+            "wall_time_s": wall_time,
+            "cpu_time_s": cpu_end - cpu_start,
+            "children_cpu_time_s": children_cpu_end - children_cpu_start,
+            "peak_rss_mb": peak_rss,
+        }
+        if read_start is not None:
+            record["bytes_read"] = read_end - read_start
+            record["bytes_written"] = write_end - write_start
+        record.update(metrics)
+        write_metrics(record)
+
+
+@hookimpl(wrapper=True)
+def pytask_execute_task(task):
+    """Tracks the execution of a task with the sizes and rows of its files.
+
+    task: PTask = The task that pytask executes.
+
+    Returns: The result of the task.
+    """
+    name = f"{task.path.stem}::{task.base_name}" if hasattr(task, "path") else task.name
+    with track(name) as metrics:
+        result = yield
+        inputs, outputs = _node_paths(task.depends_on), _node_paths(task.produces)
+        metrics["bytes_in"], metrics["rows_in"] = describe_files(inputs)
+        metrics["bytes_out"], metrics["rows_out"] = describe_files(outputs)
+        metrics["outputs"] = [str(path) for path in outputs]
+    return result
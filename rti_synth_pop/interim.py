@@ -0,0 +1,106 @@
+# Description: This file contains the functions to read and write the interim tables in the configured INTERIM_FORMAT.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The recoded PUMS households (task 3), IPF counts (task 4), sampled serial numbers
+# (task 6) and households (task 7) are only read by the tasks after them. With
+# INTERIM_FORMAT = "arrow" they are written as Arrow IPC files, with the INTERIM_SUFFIX
+# .arrow, and read through a memory map:
+#   uncompressed <- the columns point into the mapped file, so reading costs no
+#                   decoding, and the pages are shared by every process that maps the
+#                   file, for example the workers of a sharded stage.
+#   lz4, zstd    <- the record batches are decompressed into memory on read, which is
+#                   still cheaper than decoding Parquet.
+# Converting to pandas copies the string columns either way, so the stages that work
+# on Arrow tables (task 8) gain the most.
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+
+from rti_synth_pop.config import INTERIM_COMPRESSION, INTERIM_FORMAT
+
+
+# %%
+def write_interim(data: pd.DataFrame | pa.Table, path: Path, index: bool | None = None):
+    """Writes an interim table in INTERIM_FORMAT.
+
+    The format does not come from the suffix of path, so it can be the temporary path
+    of write_atomic.
+
+    data: pd.DataFrame | pa.Table = The table to write.
+    path: Path = The file to write.
+    index: bool | None = Whether to store the index of a dataframe, as in to_parquet.
+
+    Returns: None
+    """
+    if INTERIM_FORMAT == "parquet":
+        if isinstance(data, pd.DataFrame):
+            data.to_parquet(path, index=index)
+        else:
+            parquet.write_table(data, path)
+        return
+    if isinstance(data, pd.DataFrame):
+        data = pa.Table.from_pandas(data, preserve_index=index)
+    options = pa.ipc.IpcWriteOptions(compression=INTERIM_COMPRESSION)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, data.schema, options=options) as writer:
+            writer.write_table(data)
+
+
+def read_interim_table(
+    path: Path, columns: list[str] | None = None, filters: list | None = None
+):
+    """Reads an interim table as Arrow.
+
+    path: Path = The file to read.
+    columns: list[str] | None = The columns to read, or None for all.
+    filters: list | None = Row filters in the form of the parquet filters.
+
+    Returns: A pa.Table.
+    """
+    if INTERIM_FORMAT == "parquet":
+        return parquet.read_table(path, columns=columns, filters=filters)
+    # the buffers of the table keep the mapping alive after the file is closed.
+    with pa.memory_map(str(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+    if filters is not None:
+        table = table.filter(parquet.filters_to_expression(filters))
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def read_interim(
+    path: Path, columns: list[str] | None = None, filters: list | None = None
+):
+    """Reads an interim table as a dataframe.
+
+    path: Path = The file to read.
+    columns: list[str] | None = The columns to read, or None for all.
+    filters: list | None = Row filters in the form of the parquet filters.
+
+    Returns: A pd.DataFrame.
+    """
+    if INTERIM_FORMAT == "parquet":
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    return read_interim_table(path, columns, filters).to_pandas()
+
+
+def count_interim_rows(path: Path):
+    """Counts the rows of an interim table from its metadata, without reading it.
+
+    path: Path = The file to count, written in INTERIM_FORMAT.
+
+    Returns: The number of rows.
+    """
+    if INTERIM_FORMAT == "parquet":
+        return parquet.ParquetFile(path).metadata.num_rows
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        return sum(
+            reader.get_batch(i).num_rows for i in range(reader.num_record_batches)
+        )
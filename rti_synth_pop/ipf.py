@@ -0,0 +1,148 @@
+# Description: This file contains the functions to run IPF on the marginal tables of block groups.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ipfn import ipfn
+from pandas import CategoricalDtype
+from tqdm import tqdm
+
+from rti_synth_pop.checkpoint import load_shard, save_shard
+from rti_synth_pop.incremental import frame_hashes
+
+# the dtypes of the variables of the IPF counts.
+IPF_DTYPES = {
+    "size": CategoricalDtype(ordered=True),
+    "age": CategoricalDtype(ordered=True),
+    "income": CategoricalDtype(ordered=True),
+    "race": CategoricalDtype(),
+    "ethnicity": CategoricalDtype(),
+}
+
+
+# %%
+def read_marginals(input_variables: dict[str, Path], county_fips: str | None = None):
+    """Reads the marginal tables of a state.
+
+    input_variables: dict[str, Path] = A dictionary of all paths to marginal tables.
+    county_fips: str | None = The 5 digit county FIPS to keep the block groups of, or
+    None for all block groups.
+
+    Returns: A dictionary of variable to marginal table, and a dictionary of variable
+    to its category labels.
+    """
+    data_dict = {}
+    variable_label_dict = {}
+    for var, input_path in input_variables.items():
+        df = pd.read_parquet(input_path)
+        # the labels come from the whole state, so every county has the same
+        # categories in the same order.
+        variable_label_dict[var] = df.iloc[:, 1].unique().tolist()
+        if county_fips is not None:
+            df = df.loc[df["GEOID"].str.startswith(county_fips)]
+        data_dict[var] = df
+    return data_dict, variable_label_dict
+
+
+def marginal_hashes(data_dict: dict):
+    """Hashes the rows of the marginal tables of each block group, for INCREMENTAL.
+
+    data_dict: dict = The marginal tables from read_marginals.
+
+    Returns: A series of the hash of each block group GEOID.
+    """
+    rows = pd.concat(
+        [df.assign(table=var) for var, df in data_dict.items()], ignore_index=True
+    )
+    return frame_hashes(rows, "GEOID")
+
+
+def run_ipf(data_dict: dict, variable_label_dict: dict):
+    """Run IPF to estimate combined counts from marginal tables for each block group.
+
+    data_dict: dict = The marginal tables from read_marginals.
+    variable_label_dict: dict = The category labels from read_marginals.
+
+    Returns: A dataframe of the count of each combination of the categories in each
+    block group, without the categorical dtypes. See IPF_DTYPES.
+    """
+    # create array of dims matching the count of categories for each marginal
+    all_dimensions = [len(x) for x in variable_label_dict.values()]
+    dimensions = [[x] for x in range(len(all_dimensions))]
+    marginals = np.full(all_dimensions, fill_value=1)
+
+    # all the data should be identical and consistent, so we can pull the geoids
+    # from just one of the marginal tables.
+    var = list(data_dict)[-1]
+    geoids = data_dict[var].GEOID.unique()
+
+    # NOTE: FOR TESTING ONLY.
+    # TODO: remove ignore warnings later and make sure there isn't something
+    # funky going on.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        result_list = []
+        for geoid in tqdm(geoids):
+            aggregates = []
+            for data in data_dict.values():
+                # TODO: this could be a duckdb query instead of loading the entire
+                # dataframe above. Might be a better solution for parallelization.
+                data_values = data[data.GEOID == geoid].value.values
+                aggregates.append(data_values)
+
+            IPF = ipfn.ipfn(marginals, aggregates, dimensions, convergence_rate=1)
+            IPF.iteration()
+            ipf_result = IPF.iteration()
+            ipf_result = np.array(ipf_result)
+            # this probabalistic round comes from the original code, but it the counts to be off
+            # but a few hundred when summed up over even a small test set.
+            # TODO: revisit the rounding.
+            # ipf_result = np.floor(ipf_result + np.random.random()).astype(int)
+
+            data = xr.DataArray(
+                ipf_result,
+                coords=variable_label_dict,
+                dims=list(variable_label_dict.keys()),
+            )
+            data.name = "count"
+            result_df = data.to_dataframe().reset_index().assign(GEOID=geoid)
+            result_list.append(result_df)
+    return pd.concat(result_list)
+
+
+def run_ipf_by_county(
+    data_dict: dict,
+    variable_label_dict: dict,
+    partial_dir: Path | None = None,
+    done: set = frozenset(),
+):
+    """Run IPF county by county, saving every county as a shard of the checkpoint.
+
+    data_dict: dict = The marginal tables from read_marginals.
+    variable_label_dict: dict = The category labels from read_marginals.
+    partial_dir: Path | None = The partial directory from open_checkpoint, if any.
+    done: set = The counties that are finished in the partial directory.
+
+    Returns: The IPF counts of all block groups, in the same order as run_ipf.
+    """
+    geoids = data_dict[list(data_dict)[-1]]["GEOID"]
+    county_dfs = []
+    for county_fips in sorted(geoids.str[:5].unique()):
+        if county_fips in done:
+            county_dfs.append(load_shard(partial_dir, county_fips))
+            continue
+        county_data = {
+            var: df.loc[df["GEOID"].str.startswith(county_fips)]
+            for var, df in data_dict.items()
+        }
+        county_dfs.append(run_ipf(county_data, variable_label_dict))
+        save_shard(partial_dir, county_fips, county_dfs[-1])
+    if not county_dfs:
+        return pd.DataFrame(columns=list(variable_label_dict) + ["count", "GEOID"])
+    return pd.concat(county_dfs)
@@ -0,0 +1,28 @@
+# Description: This file contains the pytask marks that the task files apply when they are collected.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The marks decorate the task functions, so they run when pytask imports the task
+# files, even for the tasks it skips. This module imports nothing beyond pytask and the
+# config, so collecting the tasks does not load numpy and pandas, which the hashing in
+# incremental.py needs.
+
+from pytask import mark
+
+from rti_synth_pop.config import INCREMENTAL
+
+
+# %%
+def persist_unless_incremental(func):
+    """Marks a task persist, unless INCREMENTAL is set.
+
+    A persisted task is skipped while its outputs exist, even if its inputs changed.
+    With INCREMENTAL, pytask reruns the task when its inputs change, and the task
+    recomputes only the units that changed.
+
+    func: Callable = The task function.
+
+    Returns: The task function, marked persist unless INCREMENTAL is set.
+    """
+    return func if INCREMENTAL else mark.persist(func)
@@ -0,0 +1,291 @@
+# Description: This file contains the functions to write the synthetic population output files.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import shapely
+from pyarrow import parquet
+from pyproj import CRS
+
+from rti_synth_pop.config import (
+    OUTPUT_LAYOUT,
+    OUTPUT_PARTITIONED,
+    OUTPUT_ROW_GROUP_SIZE,
+)
+
+# the PUMS household attributes that copies of a sampled household share.
+PUMS_HOUSEHOLD_COLS = [
+    "serialno",
+    "hh_age",
+    "hh_income",
+    "hh_race",
+    "size",
+    "puma_fips",
+]
+
+# the directory levels of the partitioned output datasets.
+PARTITION_SCHEMA = pa.schema(
+    [("year", pa.int32()), ("state_fips", pa.string()), ("county_fips", pa.string())]
+)
+
+
+# %%
+def to_geoparquet(
+    table: pa.Table, crs: CRS, x_col: str = "lon_4326", y_col: str = "lat_4326"
+):
+    """Adds a WKB point geometry column and GeoParquet metadata to a table.
+
+    The columns are ordered hh_id, GEOID, geometry, coordinates and then the rest, as
+    in the households with geometry file.
+
+    table: pa.Table = The households with their x and y coordinate columns.
+    crs: CRS = The CRS of the coordinates.
+    x_col: str = The name of the x coordinate column.
+    y_col: str = The name of the y coordinate column.
+
+    Returns: A pa.Table that is valid GeoParquet when written.
+    """
+    x = table[x_col].to_numpy()
+    y = table[y_col].to_numpy()
+    geometry = pa.array(shapely.to_wkb(shapely.points(x, y)), type=pa.binary())
+
+    first_cols = ["hh_id", "GEOID", "geometry", x_col, y_col]
+    geo_table = table.append_column("GEOID", table["blkgrp_fips"]).append_column(
+        "geometry", geometry
+    )
+    geo_table = geo_table.select(
+        first_cols + [c for c in table.column_names if c not in first_cols]
+    )
+
+    geo_metadata = {
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {
+            "geometry": {
+                "encoding": "WKB",
+                "geometry_types": ["Point"],
+                "crs": CRS.from_user_input(crs).to_json_dict(),
+                "bbox": [
+                    pc.min(table[x_col]).as_py(),
+                    pc.min(table[y_col]).as_py(),
+                    pc.max(table[x_col]).as_py(),
+                    pc.max(table[y_col]).as_py(),
+                ],
+            }
+        },
+    }
+    return geo_table.replace_schema_metadata({"geo": json.dumps(geo_metadata)})
+
+
+def normalize_households(table: pa.Table):
+    """Splits the households into a narrow fact table and a PUMS household table.
+
+    Copies of the same PUMS household share a serialno_id, so their PUMS attributes
+    are stored once in the PUMS household table instead of on every copy.
+
+    table: pa.Table = The households with serialno_id and their coordinates.
+
+    Returns: The fact table (hh_id, serialno_id, blkgrp_fips, lon_4326, lat_4326) and
+    the PUMS household table with one row per serialno_id.
+    """
+    fact = table.select(["hh_id", "serialno_id", "blkgrp_fips", "lon_4326", "lat_4326"])
+    _, first_rows = np.unique(table["serialno_id"].to_numpy(), return_index=True)
+    pums_households = table.select(
+        ["serialno_id"] + [c for c in PUMS_HOUSEHOLD_COLS if c in table.column_names]
+    ).take(first_rows)
+    return fact, pums_households
+
+
+def partitioned_dataset(dataset_dir: Path):
+    """Opens a Hive partitioned output dataset with the FIPS codes kept as strings.
+
+    Without the partition schema, readers infer the FIPS directory names as integers
+    and drop their leading zeros.
+
+    dataset_dir: Path = The dataset directory, for example data/processed/households.
+
+    Returns: A pyarrow dataset with year, state_fips and county_fips columns.
+    """
+    return ds.dataset(
+        dataset_dir,
+        format="parquet",
+        partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+    )
+
+
+def write_partitioned(table: pa.Table, metadata_path: Path, sort_keys: list[str]):
+    """Writes the table of one state as a dataset partitioned by county_fips.
+
+    The state directory is replaced, and each county is written sorted by sort_keys
+    in row groups of at most OUTPUT_ROW_GROUP_SIZE rows with column statistics, so
+    readers can prune to a county or block group without scanning the state. The
+    year and state_fips are in the directory names, so state_fips is not stored in
+    the files.
+
+    table: pa.Table = The households or persons of the state, with blkgrp_fips or
+    county_fips.
+    metadata_path: Path = The _common_metadata path from partitioned_path.
+    sort_keys: list[str] = The columns to sort the rows of each county by.
+
+    Returns: None
+    """
+    if "county_fips" not in table.column_names:
+        table = table.append_column(
+            "county_fips", pc.utf8_slice_codeunits(table["blkgrp_fips"], 0, 5)
+        )
+    if "state_fips" in table.column_names:
+        table = table.drop_columns(["state_fips"])
+    table = table.take(
+        pc.sort_indices(table, sort_keys=[(c, "ascending") for c in sort_keys])
+    )
+
+    state_dir = metadata_path.parent
+    shutil.rmtree(state_dir, ignore_errors=True)
+    ds.write_dataset(
+        table,
+        state_dir,
+        format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([PARTITION_SCHEMA.field("county_fips")]), flavor="hive"
+        ),
+        basename_template="part-{i}.parquet",
+        max_rows_per_group=OUTPUT_ROW_GROUP_SIZE,
+        min_rows_per_group=min(OUTPUT_ROW_GROUP_SIZE, table.num_rows),
+        file_options=ds.ParquetFileFormat().make_write_options(write_statistics=True),
+    )
+    parquet.write_metadata(table.drop_columns(["county_fips"]).schema, metadata_path)
+
+
+def _parquet_source(path: Path, views_dir: Path):
+    """Gets the DuckDB read_parquet call for a single file or a partitioned dataset.
+
+    path: Path = The parquet file, or the _common_metadata of a partitioned state.
+    views_dir: Path = The directory of the views file, that the path is made relative
+    to.
+
+    Returns: The read_parquet SQL expression.
+    """
+    if path.name == "_common_metadata":
+        dataset_dir = Path(os.path.relpath(path.parent, views_dir)).as_posix()
+        return (
+            f"read_parquet('{dataset_dir}/**/*.parquet', hive_partitioning = true, "
+            "hive_types = {'year': INTEGER, 'state_fips': VARCHAR, "
+            "'county_fips': VARCHAR})"
+        )
+    return f"read_parquet('{Path(os.path.relpath(path, views_dir)).as_posix()}')"
+
+
+def normalized_view_sql(
+    fact_path: Path,
+    pums_households_path: Path,
+    pums_persons_path: Path,
+    views_dir: Path,
+):
+    """Writes the DuckDB views that rebuild the wide outputs from the normalized ones.
+
+    The files are referenced relative to the directory of the views file, so the
+    processed directory can be moved or shared. DuckDB resolves them against its
+    working directory, so run it from the directory of the views file.
+
+    fact_path: Path = The household fact table, or its partitioned dataset.
+    pums_households_path: Path = The PUMS households, one row per serialno_id.
+    pums_persons_path: Path = The PUMS persons, keyed by serialno_id and sporder.
+    views_dir: Path = The directory the views file is written to.
+
+    Returns: The SQL to create the households and persons views.
+    """
+    fact_source = _parquet_source(fact_path, views_dir)
+    return f"""-- the paths are relative to this file, so run DuckDB from its directory.
+CREATE OR REPLACE VIEW households AS
+SELECT
+    f.hh_id,
+    h.hh_age,
+    h.hh_income,
+    h.hh_race,
+    h.size,
+    h.serialno,
+    left(f.blkgrp_fips, 2) AS state_fips,
+    h.puma_fips,
+    left(f.blkgrp_fips, 5) AS county_fips,
+    left(f.blkgrp_fips, length(f.blkgrp_fips) - 2) AS tract_fips,
+    f.blkgrp_fips,
+    f.lon_4326,
+    f.lat_4326
+FROM {fact_source} AS f
+JOIN {_parquet_source(pums_households_path, views_dir)} AS h USING (serialno_id)
+ORDER BY f.hh_id;
+
+CREATE OR REPLACE VIEW persons AS
+SELECT
+    f.hh_id,
+    p.serialno,
+    p.sporder,
+    p.rac1p,
+    p.agep,
+    p.sex,
+    p.relshipp
+FROM {fact_source} AS f
+JOIN {_parquet_source(pums_persons_path, views_dir)} AS p USING (serialno_id)
+ORDER BY f.hh_id, p.sporder;
+"""
+
+
+def write_households(
+    households: pa.Table,
+    lon: np.ndarray,
+    lat: np.ndarray,
+    crs: CRS,
+    output_paths: dict[str, Path],
+    pums_persons_path: Path | None = None,
+):
+    """Writes the households with their coordinates in the configured output layout.
+
+    households: pa.Table = The households from task 7.
+    lon: np.ndarray = The x coordinate of each household.
+    lat: np.ndarray = The y coordinate of each household.
+    crs: CRS = The CRS of the coordinates.
+    output_paths: dict[str, Path] = The output files of task 8.
+    pums_persons_path: Path | None = The PUMS persons table of the normalized layout.
+
+    Returns: None
+    """
+    # both the xy and the GeoParquet outputs are written from this one table.
+    h_sp_w_xy = (
+        households.replace_schema_metadata(None)
+        .append_column("lon_4326", pa.array(lon))
+        .append_column("lat_4326", pa.array(lat))
+    )
+    # the normalized layout writes the PUMS attributes once per serialno_id and
+    # a narrow household table, plus the views that join them back together.
+    if OUTPUT_LAYOUT == "normalized":
+        h_sp_w_xy, pums_households = normalize_households(h_sp_w_xy)
+        parquet.write_table(pums_households, output_paths["pums_households"])
+        output_paths["views"].write_text(
+            normalized_view_sql(
+                output_paths["households"],
+                output_paths["pums_households"],
+                pums_persons_path,
+                output_paths["views"].parent,
+            )
+        )
+    if OUTPUT_PARTITIONED:
+        write_partitioned(
+            h_sp_w_xy,
+            output_paths["households"],
+            sort_keys=["blkgrp_fips", "hh_id"],
+        )
+    else:
+        parquet.write_table(h_sp_w_xy, output_paths["households"])
+
+    parquet.write_table(
+        to_geoparquet(h_sp_w_xy, crs), output_paths["households_w_geom"]
+    )
@@ -0,0 +1,32 @@
+# Description: This file contains the paths of the Hive partitioned output datasets.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# With OUTPUT_PARTITIONED, the households and persons of a state are written to
+# {dataset}/year={year}/state_fips={st_fips}/county_fips={county}/ in the processed
+# directory, and pytask tracks each state by its _common_metadata file. The task
+# parametrizations build these paths, so this module imports nothing beyond pathlib,
+# and collecting the tasks does not load the writers in outputs.py.
+
+from pathlib import Path
+
+
+# %%
+def partitioned_path(dataset: str, processed_data_dir: Path, year: int, st_fips: str):
+    """Gets the metadata file of one state in a Hive partitioned output dataset.
+
+    dataset: str = The name of the dataset, for example "households".
+    processed_data_dir: Path = The processed data directory.
+    year: int = The year of the population.
+    st_fips: str = The state FIPS code.
+
+    Returns: The path of the _common_metadata file in the state directory.
+    """
+    return (
+        processed_data_dir
+        / dataset
+        / f"year={year}"
+        / f"state_fips={st_fips}"
+        / "_common_metadata"
+    )
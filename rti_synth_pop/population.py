@@ -0,0 +1,225 @@
+# Description: This file contains the functions to build the household and person tables of the synthetic population from the sampled PUMS serial numbers.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+
+from rti_synth_pop.config import (
+    HH_ID_STATE_MULTIPLIER,
+    OUTPUT_LAYOUT,
+    OUTPUT_PARTITIONED,
+    category_maps,
+    rename_synpop_h,
+)
+from rti_synth_pop.outputs import write_partitioned
+
+# the columns of the households, in order. The normalized layout adds serialno_id.
+HH_COLS = [
+    "hh_id",
+    "hh_age",
+    "hh_income",
+    "hh_race",
+    "size",
+    "serialno",
+    "state_fips",
+    "puma_fips",
+    "county_fips",
+    "tract_fips",
+    "blkgrp_fips",
+]
+
+
+# %%
+def derive_fips_codes(df: pd.DataFrame):
+    """Derive higher level FIPS codes from block group level FIPS code.
+
+    The slicing runs on Arrow backed strings, so it uses the Arrow compute kernels
+    instead of a Python call per row.
+
+    df: pd.DataFrame = A dataframe with blkgrp_fips column that will be edited in place.
+
+    Returns: None
+    """
+    blkgrp_fips = df["blkgrp_fips"].astype("string[pyarrow]")
+    df["state_fips"] = blkgrp_fips.str.slice(0, 2)
+    df["county_fips"] = blkgrp_fips.str.slice(0, 5)
+    df["tract_fips"] = blkgrp_fips.str.slice(0, -2)
+
+
+def decode_categories(df: pd.DataFrame):
+    """Replace the category labels of the household variables with their bin integers.
+
+    The labels are matched to their bins through the categorical codes, so there is
+    no per row dictionary lookup.
+
+    df: pd.DataFrame = A dataframe with the category_maps columns, edited in place.
+
+    Returns: None
+    """
+    for col, col_map in category_maps.items():
+        labels = [col_map[i] for i in range(len(col_map))]
+        codes = pd.Categorical(df[col], categories=labels).codes
+        if (codes < 0).any():
+            unknown = df.loc[codes < 0, col].unique().tolist()
+            raise ValueError(
+                f"Unknown {col} values in the synthetic population: {unknown}"
+            )
+        df[col] = codes.astype("int64")
+
+
+def expand_persons(hh_serialnos: pa.Array, pums_p_table: pa.Table):
+    """Gathers the PUMS person rows of every sampled household.
+
+    The persons are sorted once by an integer serial number, and an offsets array
+    marks where the persons of each serial number start. Each household expands to
+    its persons with np.repeat and a single Arrow take, so there is no join between
+    the households and the persons.
+
+    hh_serialnos: pa.Array = The serialno of each sampled household.
+    pums_p_table: pa.Table = The PUMS persons, with a serialno column.
+
+    Returns: The household position of each person row and the person table in the
+    same row order.
+    """
+    person_serial_ids, serialnos = pd.factorize(
+        pums_p_table["serialno"].to_numpy(zero_copy_only=False)
+    )
+    person_order = np.argsort(person_serial_ids, kind="stable")
+    offsets = np.zeros(serialnos.size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(person_serial_ids, minlength=serialnos.size), out=offsets[1:])
+
+    hh_serial_ids = pd.Index(serialnos).get_indexer(
+        hh_serialnos.to_numpy(zero_copy_only=False)
+    )
+    if (hh_serial_ids < 0).any():
+        missing = np.unique(
+            hh_serialnos.to_numpy(zero_copy_only=False)[hh_serial_ids < 0]
+        )
+        raise ValueError(f"Sampled households without PUMS persons: {missing.tolist()}")
+
+    starts = offsets[hh_serial_ids]
+    counts = offsets[hh_serial_ids + 1] - starts
+    hh_rows = np.repeat(np.arange(counts.size), counts)
+    person_rows = person_order[
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    ]
+    return hh_rows, pums_p_table.take(person_rows)
+
+
+# %%
+def build_households(all_matches_df: pd.DataFrame, pums_h_df: pd.DataFrame):
+    """Joins the sampled serial numbers to the PUMS households they were drawn from.
+
+    all_matches_df: pd.DataFrame = The sampled serial numbers from task 6.
+    pums_h_df: pd.DataFrame = The recoded PUMS households, from read_pums_households.
+
+    Returns: A dataframe of the HH_COLS of every household, plus serialno_id for the
+    normalized layout, and the serialno of each serialno_id, or None for the wide
+    layout.
+    """
+    # Merge onto the cleaned PUMS to get the complete household variables for
+    # those serialno
+    synthpop_df = all_matches_df.drop(columns=["expansion"]).merge(
+        pums_h_df, on=["SERIALNO"], how="left"
+    )
+
+    # Cast variables as integers using category mapping
+    decode_categories(synthpop_df)
+
+    # set up FIPS code fields and a unique household ID variable. The ID is the
+    # state FIPS times HH_ID_STATE_MULTIPLIER plus the row number, so it is unique
+    # across states.
+    synthpop_df.rename(columns=rename_synpop_h, inplace=True)
+    synthpop_df.reset_index(drop=False, inplace=True)
+    derive_fips_codes(synthpop_df)
+    state_fips = synthpop_df["state_fips"].astype("int64")
+    row_number = synthpop_df["index"].astype("int64")
+    synthpop_df["hh_id"] = state_fips * HH_ID_STATE_MULTIPLIER + row_number
+    hh_cols = list(HH_COLS)
+    # the normalized layout keys the PUMS attributes by an integer serialno_id, so
+    # each sampled PUMS record is stored once however many times it was drawn.
+    serialnos = None
+    if OUTPUT_LAYOUT == "normalized":
+        serialno_ids, serialnos = pd.factorize(synthpop_df["serialno"], sort=True)
+        synthpop_df["serialno_id"] = serialno_ids.astype("int64")
+        hh_cols.append("serialno_id")
+    return synthpop_df[hh_cols], serialnos
+
+
+def build_persons(synthpop_df: pd.DataFrame, serialnos, pums_p_path: Path):
+    """Expands the households to the PUMS persons of their serial numbers.
+
+    synthpop_df: pd.DataFrame = The households from build_households.
+    serialnos: array like | None = The serialno of each serialno_id from
+    build_households, for the normalized layout.
+    pums_p_path: Path = Path to the PUMS person cache from task 3b.
+
+    Returns: A pa.Table of the persons, keyed by hh_id, or by serialno_id for the
+    normalized layout. With OUTPUT_PARTITIONED, the wide layout also has county_fips.
+    """
+    # read only the PUMS persons of the sampled households. The filter is pushed
+    # into the scan of the person cache, which is sorted by serialno.
+    sampled_serialnos = synthpop_df["serialno"].unique().tolist()
+    pums_p_table = parquet.read_table(
+        pums_p_path, filters=[("SERIALNO", "in", sampled_serialnos)]
+    )
+    pums_p_table = pums_p_table.rename_columns(
+        [c.lower() for c in pums_p_table.column_names]
+    )
+
+    # expand the household population to the person-level file to get the
+    # unique persons in the synthetic population. The normalized layout expands
+    # each sampled serialno once instead of each household.
+    # NOTE: hh_id + sporder combine to make a unique person ID in the population
+    if OUTPUT_LAYOUT == "normalized":
+        key_col = "serialno_id"
+        serial_rows, persons = expand_persons(
+            pa.array(serialnos, type=pa.string()), pums_p_table
+        )
+        key = serial_rows.astype("int64")
+    else:
+        key_col = "hh_id"
+        hh_rows, persons = expand_persons(
+            pa.array(synthpop_df["serialno"], type=pa.string()), pums_p_table
+        )
+        key = synthpop_df["hh_id"].to_numpy()[hh_rows]
+        county_fips = synthpop_df["county_fips"].to_numpy()[hh_rows]
+    synthpop_persons = pa.table(
+        {
+            key_col: key,
+            "serialno": persons["serialno"],
+            "sporder": persons["sporder"],
+            "rac1p": persons["rac1p"],
+            "agep": persons["agep"],
+            "sex": persons["sex"],
+            "relshipp": persons["relshipp"],
+        }
+    )
+    if OUTPUT_LAYOUT == "wide" and OUTPUT_PARTITIONED:
+        synthpop_persons = synthpop_persons.append_column(
+            "county_fips", pa.array(county_fips, type=pa.string())
+        )
+    return synthpop_persons
+
+
+def write_persons(synthpop_persons: pa.Table, output_path_persons: Path):
+    """Writes the persons from build_persons.
+
+    synthpop_persons: pa.Table = The persons.
+    output_path_persons: Path = The persons file, or with OUTPUT_PARTITIONED and the
+    wide layout, the metadata file of the partitioned persons dataset.
+
+    Returns: None
+    """
+    if OUTPUT_LAYOUT == "wide" and OUTPUT_PARTITIONED:
+        write_partitioned(
+            synthpop_persons, output_path_persons, sort_keys=["hh_id", "sporder"]
+        )
+    else:
+        parquet.write_table(synthpop_persons, output_path_persons)
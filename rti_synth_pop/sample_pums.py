@@ -3,11 +3,18 @@
 # Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
 # nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
 
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
+from pandas.api.types import CategoricalDtype
 from sklearn.metrics.pairwise import euclidean_distances
+from tqdm import tqdm
 
-from rti_synth_pop.config import label_dict
+from rti_synth_pop.checkpoint import load_shard, save_shard
+from rti_synth_pop.config import age_labels, income_labels, label_dict, size_labels
+from rti_synth_pop.interim import read_interim
 
 
 # %%
@@ -260,3 +267,162 @@ def sample_pums_data(
             num_needed, replace=True, weights=weights, random_state=42
         )[["SERIALNO"]].assign(BG_GEOID=geoid, expansion=expansion)
     return output_records.to_dict("records")
+
+
+def sample_one_puma(
+    puma: int,
+    ipf_count_rounded_df_puma: pd.DataFrame,
+    pums_h_df: pd.DataFrame,
+    scaled_euclidean_df: pd.DataFrame,
+):
+    """For a specific PUMA, sample from the PUMS to fill the households expected by IPF.
+
+    puma: int = The puma FIPS code.
+    ipf_count_rounded_df_puma: pd.Dataframe = The IPF households for that PUMA.
+    pums_h_df: pd.Dataframe = The PUMS household data from the state.
+    scaled_euclidean_df: pd.DataFrame = The most similar PUMA to the PUMA of interest.
+
+    Returns: A list of dictionaries with serial numbers sampled for that PUMA, and their matching criteria.
+    """
+    puma_sample_weights = scaled_euclidean_df.loc[puma].rename("sample_weights")
+    all_results = []
+    for i, row in ipf_count_rounded_df_puma.iterrows():
+        matches = sample_pums_data(
+            row,
+            pums_h_df,
+            puma_sample_weights,
+        )
+        all_results += matches
+    return all_results
+
+
+# %%
+def read_ipf_counts(
+    ipf_path: Path, crosswalk_path: Path, county_fips: str | None = None
+):
+    """Reads the IPF counts of a state, with the PUMA of each block group.
+
+    ipf_path: Path = The path to the IPF counts from task 4.
+    crosswalk_path: Path = The path to the PUMA/block group crosswalk.
+    county_fips: str | None = The 5 digit county FIPS to read the block groups of, or
+    None for all block groups.
+
+    Returns: A dataframe of the IPF counts above zero, with PUMA_GEOID.
+    """
+    filters = None
+    if county_fips is not None:
+        # the GEOIDs of a county sort between its FIPS and the next one.
+        next_fips = f"{int(county_fips) + 1:05d}"
+        filters = [("GEOID", ">=", county_fips), ("GEOID", "<", next_fips)]
+    return ipf_counts_with_puma(
+        read_interim(ipf_path, filters=filters), pd.read_parquet(crosswalk_path)
+    )
+
+
+def ipf_counts_with_puma(ipf_df: pd.DataFrame, crosswalk: pd.DataFrame):
+    """Orders the categories of the IPF counts and adds the PUMA of each block group.
+
+    ipf_df: pd.DataFrame = The IPF counts, as written by task 4 or from
+    run_ipf_by_county.
+    crosswalk: pd.DataFrame = The PUMA/block group crosswalk from task 5.
+
+    Returns: A dataframe of the IPF counts above zero, with PUMA_GEOID.
+    """
+    ipf_count_df = (
+        ipf_df.astype(
+            {
+                "size": CategoricalDtype(size_labels, ordered=True),
+                "age": CategoricalDtype(age_labels, ordered=True),
+                "income": CategoricalDtype(income_labels, ordered=True),
+                "race": CategoricalDtype(),
+                "ethnicity": CategoricalDtype(),
+            }
+        )
+        .query("count > 0")
+        .reset_index(drop=True)
+    )
+    # TODO: set index for faster query?
+    crosswalk = crosswalk.rename(columns={"BG_GEOID": "GEOID"})
+    crosswalk["PUMA_GEOID"] = crosswalk["PUMA_GEOID"].astype(int)
+    return ipf_count_df.merge(crosswalk, on="GEOID", how="left")
+
+
+def read_pums_households(pums_h_path: Path):
+    """Reads the recoded PUMS households of a state to sample from.
+
+    pums_h_path: Path = The path to the cleaned PUMS Household data.
+
+    Returns: A dataframe of the PUMS households.
+    """
+    pums_h_df = read_interim(pums_h_path)
+    pums_h_df["PUMA_GEOID"] = pums_h_df["PUMA_GEOID"].astype(int)
+    return pums_h_df
+
+
+def round_ipf_counts(ipf_count_df: pd.DataFrame):
+    """Rounds the IPF counts to whole households and drops the ones that round to 0.
+
+    ipf_count_df: pd.DataFrame = The IPF counts from read_ipf_counts.
+
+    Returns: A dataframe of the rounded IPF counts.
+    """
+    ipf_count_rounded_df = ipf_count_df.copy()
+    ipf_count_rounded_df["count"] = (ipf_count_df["count"] + 0.1).round().astype(int)
+    return ipf_count_rounded_df.loc[ipf_count_rounded_df["count"] > 0].reset_index(
+        drop=True
+    )
+
+
+def sample_households(
+    ipf_count_rounded_df: pd.DataFrame,
+    pums_h_df: pd.DataFrame,
+    scaled_euclidean_df: pd.DataFrame,
+    n_jobs: int,
+    partial_dir: Path | None = None,
+    done: set = frozenset(),
+):
+    """Samples the PUMS households of every IPF count, split by PUMA over threads.
+
+    Every PUMA is saved as a shard of the checkpoint as soon as it is sampled.
+
+    ipf_count_rounded_df: pd.DataFrame = The rounded IPF counts, with PUMA_GEOID.
+    pums_h_df: pd.DataFrame = The PUMS household data from the state.
+    scaled_euclidean_df: pd.DataFrame = The similarity between the PUMAs of the state.
+    n_jobs: int = The number of threads.
+    partial_dir: Path | None = The partial directory from open_checkpoint, if any.
+    done: set = The PUMAs that are finished in the partial directory.
+
+    Returns: A dataframe of the sampled serial numbers, their block group and how they
+    were matched.
+    """
+    puma_groups = [
+        (str(puma), ipf_count_rounded_df_puma)
+        for puma, ipf_count_rounded_df_puma in ipf_count_rounded_df.groupby(
+            "PUMA_GEOID"
+        )
+    ]
+    todo = [(puma, df) for puma, df in puma_groups if puma not in done]
+    parallel = Parallel(
+        n_jobs=n_jobs, require="sharedmem", prefer="threads", return_as="generator"
+    )
+    sample_output = parallel(
+        delayed(sample_one_puma)(
+            int(puma),
+            ipf_count_rounded_df_puma,
+            pums_h_df,
+            scaled_euclidean_df,
+        )
+        for puma, ipf_count_rounded_df_puma in tqdm(todo)
+    )
+    puma_dfs = {}
+    for (puma, _), res in zip(todo, sample_output):
+        puma_dfs[puma] = pd.DataFrame(res)
+        save_shard(partial_dir, puma, puma_dfs[puma])
+    for puma in done:
+        puma_dfs[puma] = load_shard(partial_dir, puma)
+
+    # the PUMAs are put together in the order they are sampled in without checkpoints.
+    puma_dfs = [puma_dfs[puma] for puma, _ in puma_groups]
+    if not puma_dfs:
+        return pd.DataFrame([])
+    return pd.concat(puma_dfs, ignore_index=True)
@@ -0,0 +1,285 @@
+# Description: This file schedules the states of a national run over the cores and memory of a machine.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The download and preparation tasks (task_1*) are run for all states in STATE_INFO
+# first, in one pytask process. Then the CPU time and memory of each state are estimated
+# per stage from its number of block groups and PUMS household records, and every state
+# is run with all tasks in its own pytask process:
+#   workers     <- the inner pool size of the state (N_JOBS). A state gets enough
+#                  workers to finish in about the time of a perfectly balanced run, so
+#                  big states like CA and TX get many and small states get one.
+#   order       <- the states with the longest estimated run time start first.
+#   packing     <- a state starts as soon as its workers and memory fit in what the
+#                  running states leave of the core and memory budget.
+# Each state runs in its own pytask root in data/scheduler/{st_abbr}, so the pytask
+# lock files and databases of the processes do not collide. The metrics of all the
+# processes go to one data/metrics/run_{run id}.jsonl.
+#
+# Usage:
+#   python -m rti_synth_pop.scheduler --cores 64 --memory-gb 256
+#   python -m rti_synth_pop.scheduler --cores 64 --memory-gb 256 --dry-run   # after the setup tasks
+
+import argparse
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from zipfile import ZipFile
+
+from pyarrow import parquet
+
+from rti_synth_pop.config import (
+    PYTASK_CONFIG,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    data_dir,
+    raw_data_dir,
+)
+
+SCHEDULER_DIR = data_dir / "scheduler"
+
+# CPU seconds and memory in MB of each stage for a state, as a fixed part plus a part
+# per block group and per PUMS household record. Rough fits to the metrics of benchmark
+# runs, refit them from data/metrics when the code changes. parallel is the share of
+# the CPU time that is spread over the inner pool of the stage.
+STAGE_COSTS = {
+    "marginals": {"cpu_s": (2, 0.001, 0), "memory_mb": (50, 0.02, 0), "parallel": 0},
+    "recode": {"cpu_s": (2, 0, 2e-5), "memory_mb": (50, 0, 0.004), "parallel": 0},
+    "ipf": {"cpu_s": (2, 0.012, 0), "memory_mb": (100, 0.6, 0), "parallel": 0},
+    "sampling": {
+        "cpu_s": (5, 0.6, 1e-5),
+        "memory_mb": (100, 0.3, 0.004),
+        "parallel": 0.95,
+    },
+    "derive": {"cpu_s": (2, 0.002, 1e-5), "memory_mb": (50, 0.1, 0.002), "parallel": 0},
+    "coordinates": {
+        "cpu_s": (5, 0.01, 0),
+        "memory_mb": (200, 0.2, 0),
+        "parallel": 0.9,
+    },
+}
+# memory of a pytask process with the pipeline imported, and of each extra worker
+# process of task 8.
+PROCESS_MEMORY_MB = 500
+WORKER_MEMORY_MB = 300
+
+
+# %%
+def count_pums_records(zip_path: Path):
+    """Estimates the number of records in a PUMS csv zip from the start of the csv.
+
+    zip_path: Path = The zipped PUMS csv.
+
+    Returns: The estimated number of records.
+    """
+    with ZipFile(zip_path) as zf:
+        info = next(i for i in zf.infolist() if i.filename.endswith(".csv"))
+        with zf.open(info) as f:
+            head = f.read(2**20)
+    lines = head.splitlines()
+    # the header and the last line, which may be cut off, are not counted.
+    if len(lines) <= 2:
+        return max(len(lines) - 1, 0)
+    bytes_per_record = (len(head) - len(lines[0]) - len(lines[-1])) / (len(lines) - 2)
+    return round((info.file_size - len(lines[0])) / bytes_per_record)
+
+
+def estimate_state(st_abbr: str, st_fips: str):
+    """Estimates the CPU time and memory of each stage of a state.
+
+    st_abbr: str = The state abbreviation.
+    st_fips: str = The state FIPS code.
+
+    Returns: A dictionary with the block group and PUMS counts, and the estimated
+    serial and parallel CPU seconds and peak memory of the state.
+    """
+    n_bg = parquet.ParquetFile(
+        raw_data_dir / f"{st_fips}_{SURVEY}_{YEAR}.parquet"
+    ).metadata.num_rows
+    n_pums = count_pums_records(raw_data_dir / f"csv_h{st_abbr.lower()}_{YEAR}.zip")
+
+    serial_s, parallel_s, stage_memory = 0.0, 0.0, {}
+    for stage, costs in STAGE_COSTS.items():
+        fixed, per_bg, per_pums = costs["cpu_s"]
+        cpu_s = fixed + per_bg * n_bg + per_pums * n_pums
+        serial_s += cpu_s * (1 - costs["parallel"])
+        parallel_s += cpu_s * costs["parallel"]
+        fixed, per_bg, per_pums = costs["memory_mb"]
+        stage_memory[stage] = fixed + per_bg * n_bg + per_pums * n_pums
+    return {
+        "st_abbr": st_abbr,
+        "st_fips": st_fips,
+        "block_groups": n_bg,
+        "pums_records": n_pums,
+        "serial_s": serial_s,
+        "parallel_s": parallel_s,
+        "memory_mb": PROCESS_MEMORY_MB + max(stage_memory.values()),
+    }
+
+
+def plan_states(estimates: list[dict], cores: int):
+    """Chooses the number of workers of each state and the order they start in.
+
+    The target run time is that of a run spread perfectly over all cores. A state gets
+    the fewest workers that bring its own run time down to the target, so the big
+    states do not hold up the end of the run and the small states are packed on one
+    core each.
+
+    estimates: list[dict] = The estimates from estimate_state.
+    cores: int = The core budget.
+
+    Returns: The estimates with workers, wall_s and memory_mb set, longest first.
+    """
+    total_s = sum(e["serial_s"] + e["parallel_s"] for e in estimates)
+    target_s = total_s / cores
+    for e in estimates:
+        # a state can never finish faster than its serial part.
+        room_s = max(target_s - e["serial_s"], target_s / cores)
+        e["workers"] = min(cores, max(1, math.ceil(e["parallel_s"] / room_s)))
+        e["wall_s"] = e["serial_s"] + e["parallel_s"] / e["workers"]
+        e["memory_mb"] += WORKER_MEMORY_MB * (e["workers"] - 1)
+    return sorted(estimates, key=lambda e: e["wall_s"], reverse=True)
+
+
+def run_pytask(states: list[tuple], n_jobs: int, run_name: str, task_files=None):
+    """Starts a pytask process for some states in its own pytask root.
+
+    states: list[tuple] = The (st_abbr, st_fips) of the states to run.
+    n_jobs: int = The inner pool size, N_JOBS, of the process.
+    run_name: str = The name of the pytask root in data/scheduler.
+    task_files: list[Path] | None = The task files to run, all of them if None.
+
+    Returns: The pytask process.
+    """
+    package_dir = Path(__file__).parent
+    run_dir = SCHEDULER_DIR / run_name
+    run_dir.mkdir(parents=True, exist_ok=True)
+    (run_dir / "pyproject.toml").write_text(PYTASK_CONFIG)
+    env = dict(
+        os.environ,
+        RTI_SYNTH_POP_STATES=",".join(f"{abbr}:{fips}" for abbr, fips in states),
+        RTI_SYNTH_POP_N_JOBS=str(n_jobs),
+    )
+    env.setdefault("MPLBACKEND", "Agg")
+    cmd = [sys.executable, "-m", "pytask", "-c", str(run_dir / "pyproject.toml")]
+    cmd += [str(path) for path in (task_files or [package_dir])]
+    with open(run_dir / "pytask.log", "a") as log:
+        return subprocess.Popen(
+            cmd, cwd=package_dir.parent, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+def run_schedule(plan: list[dict], cores: int, memory_mb: float):
+    """Runs the states of the plan, packing them into the core and memory budget.
+
+    A state starts when its workers and memory fit next to the running states. When
+    nothing is running, the next state starts even if it does not fit.
+
+    plan: list[dict] = The states from plan_states.
+    cores: int = The core budget.
+    memory_mb: float = The memory budget in MB.
+
+    Returns: A list of the states that failed.
+    """
+    pending = list(plan)
+    running = {}
+    failed = []
+    while pending or running:
+        free_cores = cores - sum(e["workers"] for e in running.values())
+        free_memory = memory_mb - sum(e["memory_mb"] for e in running.values())
+        for e in list(pending):
+            fits = e["workers"] <= free_cores and e["memory_mb"] <= free_memory
+            if fits or not running:
+                proc = run_pytask(
+                    [(e["st_abbr"], e["st_fips"])], e["workers"], e["st_abbr"]
+                )
+                running[proc] = e
+                pending.remove(e)
+                free_cores -= e["workers"]
+                free_memory -= e["memory_mb"]
+                print(
+                    f"{datetime.now():%H:%M:%S} start  {e['st_abbr']} with "
+                    f"{e['workers']} workers, {e['memory_mb']:,.0f} MB"
+                )
+
+        time.sleep(1)
+        for proc, e in list(running.items()):
+            if proc.poll() is None:
+                continue
+            del running[proc]
+            status = "done  " if proc.returncode == 0 else "FAILED"
+            print(f"{datetime.now():%H:%M:%S} {status} {e['st_abbr']}")
+            if proc.returncode != 0:
+                failed.append(e["st_abbr"])
+    return failed
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Run the states in STATE_INFO in parallel pytask processes."
+    )
+    parser.add_argument("--cores", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--memory-gb",
+        type=float,
+        default=os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30,
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    # all processes write their metrics to the metrics file of the scheduler run.
+    os.environ.setdefault(
+        "RTI_SYNTH_POP_RUN_ID", f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+    )
+
+    if not args.dry_run:
+        setup_files = sorted(Path(__file__).parent.glob("task_1*.py"))
+        proc = run_pytask(STATE_INFO, args.cores, "setup", setup_files)
+        if proc.wait() != 0:
+            log_path = SCHEDULER_DIR / "setup" / "pytask.log"
+            raise RuntimeError(f"the setup tasks failed, see {log_path}")
+    else:
+        # the estimates read the downloaded tables and PUMS files of every state.
+        missing = [
+            path
+            for st_abbr, st_fips in STATE_INFO
+            for path in (
+                raw_data_dir / f"{st_fips}_{SURVEY}_{YEAR}.parquet",
+                raw_data_dir / f"csv_h{st_abbr.lower()}_{YEAR}.zip",
+            )
+            if not path.exists()
+        ]
+        if missing:
+            parser.error(
+                f"--dry-run needs the downloads of the setup tasks (task_1*), but "
+                f"{len(missing)} are missing, for example {missing[0]}. Run the "
+                f"scheduler without --dry-run, or the setup tasks with pytask, first."
+            )
+
+    plan = plan_states(
+        [estimate_state(st_abbr, st_fips) for st_abbr, st_fips in STATE_INFO],
+        args.cores,
+    )
+    for e in plan:
+        print(
+            f"{e['st_abbr']:>3} {e['block_groups']:>7,} bgs {e['pums_records']:>9,} "
+            f"PUMS records {e['workers']:>4} workers {e['memory_mb']:>9,.0f} MB "
+            f"{e['wall_s'] / 60:8.1f} min"
+        )
+    if args.dry_run:
+        return
+
+    failed = run_schedule(plan, args.cores, args.memory_gb * 1024)
+    if failed:
+        print(f"failed states: {', '.join(failed)}, see data/scheduler/*/pytask.log")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# Description: This file runs the IPF, sampling and coordinate stages as county work units on many hosts.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# Each stage is split into one work unit per county of the states in STATE_INFO and
+# run through a work queue in data/queue/{stage} (see work_queue.py), so any number of
+# workers on any hosts that share the data directory can work on it:
+#   publish <- reads the counties of every state from the inputs of the stage and
+#              publishes them as units, with the signature of those inputs, so the
+#              parts of units whose inputs changed are rerun.
+#   worker  <- claims units until the stage is done and writes the part of each unit.
+#   merge   <- puts the parts of each state together into the file that the pytask task
+#              of the stage writes, so the outputs are the same as from pytask, and
+#              pytask skips the stage afterwards.
+# The stages depend on the merged files of the stage before, so they run one after the
+# other: ipf (task 4), then sampling (task 6), then task 7 with pytask, then coordinates
+# (task 8). The preparation tasks before them run with pytask as usual. The coordinates
+# stage does not use the weight cache, and with the zonal method each unit reads only
+# the raster window of its county.
+#
+# Usage:
+#   python -m rti_synth_pop.sharded publish --stage ipf
+#   python -m rti_synth_pop.sharded worker --stage ipf     <- on every host
+#   python -m rti_synth_pop.sharded merge --stage ipf
+# or all three with several worker processes on this machine:
+#   python -m rti_synth_pop.sharded run-local --stage ipf --workers 4
+
+import argparse
+import math
+import os
+import subprocess
+import sys
+from functools import lru_cache, partial
+
+import pandas as pd
+import rasterio
+from rasterio.windows import Window, from_bounds
+
+from rti_synth_pop.checkpoint import input_signature, write_atomic
+from rti_synth_pop.config import (
+    COORDINATE_METHOD,
+    INTERIM_SUFFIX,
+    N_JOBS,
+    SEED,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    data_dir,
+    interim_data_dir,
+    query_dict,
+    vars_list,
+)
+from rti_synth_pop.coordinate_params import generate_params
+from rti_synth_pop.household_points import (
+    county_sample_points,
+    household_coordinates,
+    households_by_block_group,
+    points_from_frame,
+    points_to_frame,
+    read_block_groups,
+    zonal_sample_points,
+)
+from rti_synth_pop.interim import read_interim, read_interim_table, write_interim
+from rti_synth_pop.ipf import IPF_DTYPES, read_marginals, run_ipf
+from rti_synth_pop.outputs import write_households
+from rti_synth_pop.sample_pums import (
+    get_similarity_df,
+    read_ipf_counts,
+    read_pums_households,
+    round_ipf_counts,
+    sample_households,
+)
+from rti_synth_pop.work_queue import (
+    LEASE_TIMEOUT_S,
+    publish,
+    read_parts,
+    run_worker,
+)
+
+QUEUE_DIR = data_dir / "queue"
+STAGES = ["ipf", "sampling", "coordinates"]
+
+
+# %%
+def stage_paths(stage: str, st_abbr: str, st_fips: str):
+    """Gets the input and output paths of a stage for a state, as in its pytask task.
+
+    stage: str = One of STAGES.
+    st_abbr: str = The state abbreviation.
+    st_fips: str = The state FIPS code.
+
+    Returns: A dictionary of the paths.
+    """
+    if stage == "ipf":
+        return {
+            "input_variables": {
+                var: interim_data_dir / f"{st_fips}_{SURVEY}_{YEAR}_{var}.parquet"
+                for var in query_dict
+            },
+            "output_path": interim_data_dir
+            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}",
+        }
+    if stage == "sampling":
+        return {
+            "ipf_path": interim_data_dir
+            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}",
+            "pums_h_path": interim_data_dir
+            / f"csv_h{st_fips}_{YEAR}_recoded{INTERIM_SUFFIX}",
+            "crosswalk_path": interim_data_dir
+            / f"{st_fips}_{YEAR}_pums_2_bg_crosswalk.parquet",
+            "output_path": interim_data_dir
+            / f"{st_fips}_{YEAR}_household_synthpop_serialnos{INTERIM_SUFFIX}",
+        }
+    if stage == "coordinates":
+        return generate_params([(st_abbr, st_fips)])[st_abbr]
+    raise ValueError(f"unknown stage {stage}, expected one of {STAGES}")
+
+
+def state_counties(stage: str, st_abbr: str, st_fips: str):
+    """Finds the counties of a state in the input of a stage.
+
+    stage: str = One of STAGES.
+    st_abbr: str = The state abbreviation.
+    st_fips: str = The state FIPS code.
+
+    Returns: A sorted list of 5 digit county FIPS codes.
+    """
+    paths = stage_paths(stage, st_abbr, st_fips)
+    if stage == "ipf":
+        geoids = pd.read_parquet(
+            list(paths["input_variables"].values())[-1], columns=["GEOID"]
+        )["GEOID"]
+    elif stage == "sampling":
+        geoids = read_interim(paths["ipf_path"], columns=["GEOID"])["GEOID"]
+    else:
+        geoids = read_interim_table(paths["h_sp_path"], columns=["blkgrp_fips"])
+        geoids = geoids["blkgrp_fips"].to_pandas().astype(str).str.zfill(12)
+    return sorted(geoids.str[:5].unique())
+
+
+def stage_signature(stage: str, st_abbr: str, st_fips: str):
+    """Describes the inputs of a stage for a state, so the parts of its units are
+    rerun when they change.
+
+    stage: str = One of STAGES.
+    st_abbr: str = The state abbreviation.
+    st_fips: str = The state FIPS code.
+
+    Returns: The input signature from checkpoint.input_signature.
+    """
+    paths = stage_paths(stage, st_abbr, st_fips)
+    if stage == "ipf":
+        return input_signature(list(paths["input_variables"].values()))
+    if stage == "sampling":
+        return input_signature(
+            [paths["ipf_path"], paths["pums_h_path"], paths["crosswalk_path"]]
+        )
+    return input_signature(
+        [paths["h_sp_path"], paths["bg_geo_path"], paths["pop_raster_path"]],
+        {"method": COORDINATE_METHOD, "seed": SEED},
+    )
+
+
+def publish_stage(stage: str, reset: bool = False):
+    """Publishes a unit for every county of every state in STATE_INFO.
+
+    stage: str = One of STAGES.
+    reset: bool = Whether to delete the queue of the stage, with its parts, first.
+
+    Returns: The number of units.
+    """
+    units = {}
+    for st_abbr, st_fips in STATE_INFO:
+        signature = stage_signature(stage, st_abbr, st_fips)
+        for county_fips in state_counties(stage, st_abbr, st_fips):
+            units[county_fips] = {
+                "st_abbr": st_abbr,
+                "st_fips": st_fips,
+                "county_fips": county_fips,
+                "signature": signature,
+            }
+    publish(QUEUE_DIR / stage, units, reset)
+    return len(units)
+
+
+# %%
+def ipf_unit(unit: dict):
+    """Runs IPF on the block groups of a county.
+
+    unit: dict = The st_abbr, st_fips and county_fips of the unit.
+
+    Returns: The IPF counts of the county, without the categorical dtypes.
+    """
+    paths = stage_paths("ipf", unit["st_abbr"], unit["st_fips"])
+    data_dict, variable_label_dict = read_marginals(
+        paths["input_variables"], unit["county_fips"]
+    )
+    return run_ipf(data_dict, variable_label_dict)
+
+
+@lru_cache(maxsize=4)
+def _pums_pool(pums_h_path):
+    """Reads the PUMS households of a state and the similarity of its PUMAs once per
+    worker, for all the counties of the state it samples.
+
+    pums_h_path: Path = The recoded PUMS households of the state.
+
+    Returns: The PUMS households and the scaled similarity of each pair of PUMAs.
+    """
+    pums_h_df = read_pums_households(pums_h_path)
+    return pums_h_df, get_similarity_df(pums_h_df, vars_list)
+
+
+def sampling_unit(unit: dict):
+    """Samples the PUMS households of the block groups of a county.
+
+    unit: dict = The st_abbr, st_fips and county_fips of the unit.
+
+    Returns: The sampled serial numbers of the county, with PUMA_GEOID for the merge.
+    """
+    paths = stage_paths("sampling", unit["st_abbr"], unit["st_fips"])
+    ipf_count_rounded_df = round_ipf_counts(
+        read_ipf_counts(paths["ipf_path"], paths["crosswalk_path"], unit["county_fips"])
+    )
+    pums_h_df, scaled_euclidean_df = _pums_pool(paths["pums_h_path"])
+    result_df = sample_households(
+        ipf_count_rounded_df, pums_h_df, scaled_euclidean_df, N_JOBS
+    )
+    if result_df.empty:
+        return pd.DataFrame(columns=["SERIALNO", "BG_GEOID", "expansion", "PUMA_GEOID"])
+    bg_puma = ipf_count_rounded_df.drop_duplicates("GEOID").set_index("GEOID")
+    return result_df.assign(PUMA_GEOID=result_df["BG_GEOID"].map(bg_puma["PUMA_GEOID"]))
+
+
+def coordinates_unit(unit: dict):
+    """Places the households of the block groups of a county.
+
+    unit: dict = The st_abbr, st_fips and county_fips of the unit.
+
+    Returns: A dataframe of the GEOID, x and y of every household point, in the order
+    the points of each block group were drawn.
+    """
+    paths = stage_paths("coordinates", unit["st_abbr"], unit["st_fips"])
+    households = read_interim_table(paths["h_sp_path"], columns=["blkgrp_fips"])
+    _, bg_geoids, _, bg_counts = households_by_block_group(households)
+    with rasterio.open(paths["pop_raster_path"]) as src:
+        crs = src.crs
+    bg_gdf = read_block_groups(
+        paths["bg_geo_path"], crs, pd.Series(bg_counts, index=bg_geoids)
+    )
+    county_gdf = bg_gdf.loc[
+        (bg_gdf["COUNTYFP"] == unit["county_fips"][2:])
+        & (bg_gdf["household_count"] > 0)
+    ]
+
+    if COORDINATE_METHOD == "zonal":
+        with rasterio.open(paths["pop_raster_path"]) as src:
+            # the whole cells around the county, so every cell with its center in one
+            # of its block groups is labeled as in the state run.
+            bounds = from_bounds(*county_gdf.total_bounds, transform=src.transform)
+            col_off, row_off = math.floor(bounds.col_off), math.floor(bounds.row_off)
+            window = Window(
+                col_off,
+                row_off,
+                math.ceil(bounds.col_off + bounds.width) - col_off,
+                math.ceil(bounds.row_off + bounds.height) - row_off,
+            ).intersection(Window(0, 0, src.width, src.height))
+            bg_points = zonal_sample_points(
+                county_gdf,
+                src.read(1, window=window, masked=True).filled(0),
+                src.window_transform(window),
+            )
+    else:
+        bg_points, _ = county_sample_points(paths["pop_raster_path"], county_gdf)
+
+    return points_to_frame(bg_points)
+
+
+UNIT_FUNCTIONS = {
+    "ipf": ipf_unit,
+    "sampling": sampling_unit,
+    "coordinates": coordinates_unit,
+}
+
+
+# %%
+def merge_stage(stage: str):
+    """Puts the parts of the units of a stage together into one file per state.
+
+    stage: str = One of STAGES.
+
+    Returns: None
+    """
+    parts = read_parts(QUEUE_DIR / stage)
+    for st_abbr, st_fips in STATE_INFO:
+        paths = stage_paths(stage, st_abbr, st_fips)
+        state_parts = [
+            part for unit_id, part in parts.items() if unit_id.startswith(st_fips)
+        ]
+
+        if stage == "ipf":
+            sp_df = pd.concat(state_parts).astype(IPF_DTYPES)
+            write_atomic(paths["output_path"], partial(write_interim, sp_df))
+
+        elif stage == "sampling":
+            # the state run samples the PUMAs in order, and the block groups of each
+            # PUMA in GEOID order.
+            result_df = (
+                pd.concat(state_parts)
+                .sort_values("PUMA_GEOID", kind="stable")
+                .drop(columns="PUMA_GEOID")
+                .reset_index(drop=True)
+            )
+            write_atomic(paths["output_path"], partial(write_interim, result_df))
+
+        else:
+            # the points of a block group are one run of rows of its county part.
+            bg_points = points_from_frame(pd.concat(state_parts))
+
+            households = read_interim_table(paths["h_sp_path"])
+            lon, lat = household_coordinates(
+                bg_points, *households_by_block_group(households)
+            )
+            with rasterio.open(paths["pop_raster_path"]) as src:
+                crs = src.crs
+            write_households(
+                households,
+                lon,
+                lat,
+                crs,
+                paths["output_paths"],
+                paths.get("pums_persons_path"),
+            )
+        print(f"merged {len(state_parts)} {stage} units of {st_abbr}")
+
+
+def run_local(stage: str, workers: int, n_jobs: int, reset: bool = False):
+    """Publishes, works on and merges a stage with worker processes on this machine.
+
+    stage: str = One of STAGES.
+    workers: int = The number of worker processes.
+    n_jobs: int = The inner pool size, N_JOBS, of each worker.
+    reset: bool = Whether to delete the queue of the stage, with its parts, first.
+
+    Returns: None
+    """
+    print(f"published {publish_stage(stage, reset)} {stage} units")
+    env = dict(os.environ, RTI_SYNTH_POP_N_JOBS=str(n_jobs))
+    cmd = [sys.executable, "-m", "rti_synth_pop.sharded", "worker", "--stage", stage]
+    procs = [subprocess.Popen(cmd, env=env) for _ in range(workers)]
+    failed = [proc.args for proc in procs if proc.wait() != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} workers of {stage} failed")
+    merge_stage(stage)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Run a stage as county work units through a shared queue."
+    )
+    parser.add_argument("command", choices=["publish", "worker", "merge", "run-local"])
+    parser.add_argument("--stage", choices=STAGES, required=True)
+    parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT_S)
+    args = parser.parse_args(argv)
+
+    if args.command == "publish":
+        print(f"published {publish_stage(args.stage, args.reset)} {args.stage} units")
+    elif args.command == "worker":
+        n_done, n_failed = run_worker(
+            QUEUE_DIR / args.stage, UNIT_FUNCTIONS[args.stage], args.lease_timeout
+        )
+        print(f"worker done: {n_done} units finished, {n_failed} failed")
+        if n_failed:
+            sys.exit(1)
+    elif args.command == "merge":
+        merge_stage(args.stage)
+    else:
+        run_local(args.stage, args.workers, args.n_jobs, args.reset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+# Description: This file generates fake but schema-correct raw inputs, so the pipeline can run with no network.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The fixtures replace every download of tasks 1 and 1b, so with them in data/raw the
+# persisted download tasks are skipped and tasks 1c to 8 run offline. For each state
+# in config.STATE_INFO this writes:
+#   {st_fips}_{SURVEY}_{YEAR}.parquet          <- ACS block group table with CENSUS_COLS
+#   csv_h{st}_{YEAR}.zip, csv_p{st}_{YEAR}.zip  <- PUMS households and persons
+#   tl_{YEAR}_{st_fips}_bg.zip                  <- TIGER block group shapefile
+#   tl_{YEAR}_{st_fips}_puma10.zip              <- TIGER PUMA shapefile
+# and once for all states the LandScan zip, the TIGER state shapefile, the state FIPS
+# table, the PUMS data dictionary and the tract to PUMA relationship file.
+#
+# A state is a grid of square block groups. Vertical strips of the grid are PUMAs, runs
+# of up to four block groups in a strip are tracts, and runs of tracts are counties.
+# The households of every block group are drawn first, and both the ACS marginals and
+# the PUMS sample are tabulated from those same households, so the marginals of every
+# variable add up to the same household total.
+#
+# Usage:
+#   python -m rti_synth_pop.synthetic_fixtures --block-groups 50
+#   python -m rti_synth_pop.synthetic_fixtures --block-groups 25000 --households-per-bg 600
+
+import argparse
+import tempfile
+from pathlib import Path
+from zipfile import ZIP_STORED, ZipFile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import rasterio
+import shapely
+import us
+from pyarrow import csv
+from rasterio.transform import from_origin
+
+from rti_synth_pop.config import (
+    CENSUS_COLS,
+    RASTER_PROFILE,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    raw_data_dir,
+    tract_puma_rel_path,
+)
+
+# TIGER is in NAD83 and LandScan USA is a 3 arc second grid in WGS84.
+TIGER_CRS = "EPSG:4269"
+LANDSCAN_CRS = "EPSG:4326"
+LANDSCAN_RES = 1 / 1200
+LANDSCAN_NODATA = -2147483647
+# where the first state's grid starts and the gap between states, in degrees.
+ORIGIN_LON = -120.0
+ORIGIN_LAT = 35.0
+STATE_GAP = 0.5
+
+SIZE_P = [0.28, 0.34, 0.15, 0.13, 0.06, 0.02, 0.02]
+RACE_P = [0.70, 0.12, 0.006, 0.002, 0.002, 0.06, 0.002, 0.05, 0.058]
+# ACS table letter of each RAC1P code for B11001{letter}_001E.
+RACE_TABLE = {1: "A", 2: "B", 3: "C", 4: "C", 5: "C", 6: "D", 7: "E", 8: "F", 9: "G"}
+INCOME_EDGES = [10_000, 15_000, 20_000, 25_000, 30_000, 35_000, 40_000, 45_000]
+INCOME_EDGES += [50_000, 60_000, 75_000, 100_000, 125_000, 150_000, 200_000]
+AGE_EDGES = [25, 35, 45, 55, 60, 65, 75, 85]
+
+
+# %%
+def block_group_grid(
+    st_fips: str,
+    n_block_groups: int,
+    origin: tuple[float, float],
+    bg_size: float,
+    bgs_per_puma: int,
+):
+    """Lays out the block groups, tracts, counties and PUMAs of one state.
+
+    st_fips: str = The state FIPS code.
+    n_block_groups: int = The number of block groups in the state.
+    origin: tuple[float, float] = The lower left corner of the state grid.
+    bg_size: float = The width and height of a block group in degrees.
+    bgs_per_puma: int = About how many block groups go in a PUMA.
+
+    Returns: A GeoDataFrame of the block groups with the TIGER columns and PUMACE10.
+    """
+    n_cols = int(np.ceil(np.sqrt(n_block_groups)))
+    n_rows = int(np.ceil(n_block_groups / n_cols))
+    # at least 4 PUMAs where the grid allows it. With fewer, the PUMA similarity
+    # weights of task 6 are zero for every other PUMA.
+    strip_cols = max(1, min(round(bgs_per_puma / n_rows), n_cols // 4))
+
+    # cells are numbered down each column, so a strip of columns is a run of cells.
+    cols, rows = np.divmod(np.arange(n_block_groups), n_rows)
+    strip = cols // strip_cols
+
+    # tracts are runs of up to four block groups that never cross a PUMA strip.
+    strip_start = np.searchsorted(strip, strip, side="left")
+    pos_in_strip = np.arange(n_block_groups) - strip_start
+    new_tract = (pos_in_strip % 4 == 0).astype(int)
+    tract = np.cumsum(new_tract) - 1
+    county = tract // 50
+    tract_in_county = tract - county * 50
+    blkgrp = pos_in_strip % 4 + 1
+
+    x0 = origin[0] + cols * bg_size
+    y0 = origin[1] + rows * bg_size
+    geometry = shapely.box(x0, y0, x0 + bg_size, y0 + bg_size)
+
+    countyfp = pd.Series(county * 2 + 1).astype(str).str.zfill(3)
+    tractce = pd.Series((tract_in_county + 1) * 100).astype(str).str.zfill(6)
+    blkgrpce = pd.Series(blkgrp).astype(str)
+    pumace = pd.Series((strip + 1) * 100).astype(str).str.zfill(5)
+    return gpd.GeoDataFrame(
+        {
+            "STATEFP": st_fips,
+            "COUNTYFP": countyfp,
+            "TRACTCE": tractce,
+            "BLKGRPCE": blkgrpce,
+            "GEOID": st_fips + countyfp + tractce + blkgrpce,
+            "NAMELSAD": "Block Group " + blkgrpce,
+            "MTFCC": "G5030",
+            "FUNCSTAT": "S",
+            "ALAND": np.int64(1_000_000),
+            "AWATER": np.int64(0),
+            "INTPTLAT": [f"{y:+.7f}" for y in y0 + bg_size / 2],
+            "INTPTLON": [f"{x:+.7f}" for x in x0 + bg_size / 2],
+            "PUMACE10": pumace,
+        },
+        geometry=geometry,
+        crs=TIGER_CRS,
+    )
+
+
+def puma_polygons(bg_gdf: gpd.GeoDataFrame, st_fips: str):
+    """Dissolves the block groups of each PUMA into the TIGER PUMA layer.
+
+    bg_gdf: gpd.GeoDataFrame = The block groups from block_group_grid.
+    st_fips: str = The state FIPS code.
+
+    Returns: A GeoDataFrame of the PUMAs with the TIGER puma10 columns.
+    """
+    puma_gdf = bg_gdf[["PUMACE10", "geometry"]].dissolve("PUMACE10").reset_index()
+    rep_points = puma_gdf.representative_point()
+    return gpd.GeoDataFrame(
+        {
+            "STATEFP10": st_fips,
+            "PUMACE10": puma_gdf["PUMACE10"],
+            "GEOID10": st_fips + puma_gdf["PUMACE10"],
+            "NAMELSAD10": "PUMA " + puma_gdf["PUMACE10"],
+            "MTFCC10": "G6120",
+            "FUNCSTAT10": "S",
+            "ALAND10": np.int64(1_000_000),
+            "AWATER10": np.int64(0),
+            "INTPTLAT10": [f"{y:+.7f}" for y in rep_points.y],
+            "INTPTLON10": [f"{x:+.7f}" for x in rep_points.x],
+        },
+        geometry=puma_gdf.geometry.values,
+        crs=TIGER_CRS,
+    )
+
+
+def draw_households(household_counts: np.ndarray, rng: np.random.Generator):
+    """Draws the attributes of every household in the state.
+
+    Each block group gets its own income level, so the block groups differ enough for
+    the IPF and the PUMA similarity weights to matter.
+
+    household_counts: np.ndarray = The number of households in each block group.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: A dataframe of the households with the block group position (bg_idx),
+    the PUMS household columns, and whether they are a family and owners.
+    """
+    bg_idx = np.repeat(np.arange(household_counts.size), household_counts)
+    n = bg_idx.size
+
+    size = rng.choice(np.arange(1, 8), size=n, p=SIZE_P)
+    big = size == 7
+    size[big] += rng.geometric(0.5, size=big.sum()) - 1
+
+    bg_income = rng.normal(11.0, 0.4, size=household_counts.size)
+    income = np.exp(rng.normal(bg_income[bg_idx], 0.8)).round()
+
+    race = rng.choice(np.arange(1, 10), size=n, p=np.array(RACE_P) / sum(RACE_P))
+    hisp = np.where(rng.random(n) < 0.82, 1, rng.integers(2, 25, size=n))
+
+    return pd.DataFrame(
+        {
+            "bg_idx": bg_idx,
+            "NP": size.astype(np.int32),
+            "HINCP": income.astype(np.int64),
+            "HHLDRAGEP": rng.integers(18, 96, size=n).astype(np.int32),
+            "HHLDRRAC1P": race.astype(np.int32),
+            "HHLDRHISP": hisp.astype(np.int32),
+            "family": (size > 1) & (rng.random(n) < 0.8),
+            "owner": rng.random(n) < 0.65,
+        }
+    )
+
+
+def _count_by_bg(bg_idx: np.ndarray, bins: np.ndarray, n_bg: int, n_bins: int):
+    """Counts the households of every block group in every bin.
+
+    bg_idx: np.ndarray = The block group position of each household.
+    bins: np.ndarray = The bin of each household.
+    n_bg: int = The number of block groups.
+    n_bins: int = The number of bins.
+
+    Returns: An (n_bg, n_bins) array of counts.
+    """
+    flat = np.bincount(bg_idx * n_bins + bins, minlength=n_bg * n_bins)
+    return flat.reshape(n_bg, n_bins)
+
+
+def acs_table(bg_gdf: gpd.GeoDataFrame, households: pd.DataFrame):
+    """Tabulates the households into the ACS block group table task 1 downloads.
+
+    bg_gdf: gpd.GeoDataFrame = The block groups from block_group_grid.
+    households: pd.DataFrame = The households from draw_households.
+
+    Returns: A dataframe with a GEOID index and the config.CENSUS_COLS columns.
+    """
+    n_bg = bg_gdf.shape[0]
+    bg_idx = households["bg_idx"].to_numpy()
+    acs = {}
+
+    total = np.bincount(bg_idx, minlength=n_bg)
+    for table in ["B11001", "B11016", "B19001", "B25007"]:
+        acs[f"{table}_001E"] = total
+
+    # householder race and ethnicity
+    race = households["HHLDRRAC1P"].to_numpy()
+    hispanic = households["HHLDRHISP"].to_numpy() > 1
+    for letter in "ABCDEFG":
+        codes = [code for code, table in RACE_TABLE.items() if table == letter]
+        acs[f"B11001{letter}_001E"] = np.bincount(
+            bg_idx[np.isin(race, codes)], minlength=n_bg
+        )
+    acs["B11001H_001E"] = np.bincount(bg_idx[(race == 1) & ~hispanic], minlength=n_bg)
+    acs["B11001I_001E"] = np.bincount(bg_idx[hispanic], minlength=n_bg)
+
+    # household type by size. Family households have 2 to 7+ people (003 to 008), and
+    # nonfamily households 1 to 7+ (010 to 016).
+    size_bin = np.minimum(households["NP"].to_numpy(), 7) - 1
+    family = households["family"].to_numpy()
+    family_counts = _count_by_bg(bg_idx[family], size_bin[family], n_bg, 7)
+    nonfamily_counts = _count_by_bg(bg_idx[~family], size_bin[~family], n_bg, 7)
+    for i in range(6):
+        acs[f"B11016_{i + 3:03d}E"] = family_counts[:, i + 1]
+    for i in range(7):
+        acs[f"B11016_{i + 10:03d}E"] = nonfamily_counts[:, i]
+
+    # household income in 16 bins (002 to 017)
+    income_bin = np.digitize(households["HINCP"].to_numpy(), INCOME_EDGES)
+    income_counts = _count_by_bg(bg_idx, income_bin, n_bg, 16)
+    for i in range(16):
+        acs[f"B19001_{i + 2:03d}E"] = income_counts[:, i]
+
+    # tenure by age of householder in 9 bins, owners (003 to 011), renters (013 to 021)
+    age_bin = np.digitize(households["HHLDRAGEP"].to_numpy(), AGE_EDGES)
+    owner = households["owner"].to_numpy()
+    owner_counts = _count_by_bg(bg_idx[owner], age_bin[owner], n_bg, 9)
+    renter_counts = _count_by_bg(bg_idx[~owner], age_bin[~owner], n_bg, 9)
+    for i in range(9):
+        acs[f"B25007_{i + 3:03d}E"] = owner_counts[:, i]
+        acs[f"B25007_{i + 13:03d}E"] = renter_counts[:, i]
+
+    return (
+        pd.DataFrame(acs, index=pd.Index(bg_gdf["GEOID"].values, name="GEOID"))
+        .loc[:, CENSUS_COLS]
+        .astype("int64")
+    )
+
+
+def pums_tables(
+    households: pd.DataFrame,
+    bg_gdf: gpd.GeoDataFrame,
+    st_fips: str,
+    sample_rate: float,
+    rng: np.random.Generator,
+):
+    """Samples the PUMS household and person records from the households.
+
+    A few vacant units (NP = 0, with no persons) are added, as in the real PUMS.
+
+    households: pd.DataFrame = The households from draw_households.
+    bg_gdf: gpd.GeoDataFrame = The block groups from block_group_grid.
+    st_fips: str = The state FIPS code.
+    sample_rate: float = The share of the households that are in the PUMS.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: The PUMS household and person tables as pa.Tables.
+    """
+    sample = households.loc[rng.random(households.shape[0]) < sample_rate]
+    n_vacant = max(1, sample.shape[0] // 50)
+    n_h = sample.shape[0] + n_vacant
+    serialno = pa.array(
+        (f"{YEAR}HU" + pd.Series(np.arange(1, n_h + 1)).astype(str).str.zfill(7)),
+        type=pa.string(),
+    )
+    puma = np.concatenate(
+        [
+            bg_gdf["PUMACE10"].to_numpy()[sample["bg_idx"].to_numpy()],
+            rng.choice(bg_gdf["PUMACE10"].unique(), size=n_vacant),
+        ]
+    ).astype(int)
+    occupied = np.arange(n_h) < sample.shape[0]
+
+    def occupied_only(values):
+        return pa.array(
+            np.concatenate([values, np.zeros(n_vacant, dtype=values.dtype)]),
+            mask=~occupied,
+        )
+
+    pums_h = pa.table(
+        {
+            "RT": pa.array(["H"] * n_h),
+            "SERIALNO": serialno,
+            "ST": pa.array(np.full(n_h, int(st_fips))),
+            "PUMA": pa.array(puma),
+            "WGTP": pa.array(np.full(n_h, round(1 / sample_rate))),
+            "NP": pa.array(
+                np.where(occupied, np.append(sample["NP"], [0] * n_vacant), 0)
+            ),
+            "HINCP": occupied_only(sample["HINCP"].to_numpy()),
+            "HHLDRAGEP": occupied_only(sample["HHLDRAGEP"].to_numpy()),
+            "HHLDRRAC1P": occupied_only(sample["HHLDRRAC1P"].to_numpy()),
+            "HHLDRHISP": occupied_only(sample["HHLDRHISP"].to_numpy()),
+        }
+    )
+
+    # every occupied unit expands to NP persons. Person 1 is the householder and
+    # carries the householder columns of the household record.
+    size = sample["NP"].to_numpy()
+    hh_rows = np.repeat(np.arange(size.size), size)
+    n_p = hh_rows.size
+    sporder = np.arange(n_p) - np.repeat(np.cumsum(size) - size, size) + 1
+    head = sporder == 1
+    family = sample["family"].to_numpy()[hh_rows]
+    relshipp = np.where(head, 20, np.where(family, np.where(sporder == 2, 21, 25), 34))
+    agep = np.where(
+        head,
+        sample["HHLDRAGEP"].to_numpy()[hh_rows],
+        np.where(
+            relshipp == 25,
+            rng.integers(0, 25, size=n_p),
+            rng.integers(18, 96, size=n_p),
+        ),
+    )
+    pums_p = pa.table(
+        {
+            "RT": pa.array(["P"] * n_p),
+            "SERIALNO": serialno.take(pa.array(hh_rows)),
+            "SPORDER": pa.array(sporder),
+            "ST": pa.array(np.full(n_p, int(st_fips))),
+            "PUMA": pa.array(puma[hh_rows]),
+            "PWGTP": pa.array(np.full(n_p, round(1 / sample_rate))),
+            "AGEP": pa.array(agep),
+            "SEX": pa.array(rng.integers(1, 3, size=n_p)),
+            "RAC1P": pa.array(sample["HHLDRRAC1P"].to_numpy()[hh_rows]),
+            "HISP": pa.array(sample["HHLDRHISP"].to_numpy()[hh_rows]),
+            "RELSHIPP": pa.array(relshipp),
+        }
+    )
+    return pums_h, pums_p
+
+
+def write_pums_zip(table: pa.Table, zip_path: Path, csv_name: str):
+    """Writes a PUMS table as a csv inside a zip, like the Census PUMS downloads.
+
+    table: pa.Table = The PUMS household or person table.
+    zip_path: Path = The zip to write.
+    csv_name: str = The name of the csv inside the zip.
+
+    Returns: None
+    """
+    with ZipFile(zip_path, "w") as zf, zf.open(csv_name, "w") as f:
+        csv.write_csv(table, f, write_options=csv.WriteOptions(quoting_style="needed"))
+
+
+def write_zipped_shapefile(gdf: gpd.GeoDataFrame, zip_path: Path):
+    """Writes a GeoDataFrame as a zipped shapefile, like the TIGER downloads.
+
+    gdf: gpd.GeoDataFrame = The layer to write.
+    zip_path: Path = The zip to write. The shapefile is named after it.
+
+    Returns: None
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shp_path = Path(tmp_dir) / zip_path.with_suffix(".shp").name
+        gdf.to_file(shp_path, engine="pyogrio")
+        with ZipFile(zip_path, "w") as zf:
+            for path in sorted(Path(tmp_dir).iterdir()):
+                zf.write(path, path.name)
+
+
+def write_landscan_zip(
+    bounds: tuple[float, float, float, float],
+    zip_path: Path,
+    rng: np.random.Generator,
+):
+    """Writes the nested LandScan zip with the conus, ak and hi night rasters.
+
+    The conus raster covers bounds with random population counts. The ak and hi
+    rasters are small empty tiles on the same grid just east of it, so the merge in
+    task 1 works as it does on the real data.
+
+    bounds: tuple[float, float, float, float] = The (west, south, east, north) the
+    conus raster has to cover.
+    zip_path: Path = The LandScan assets zip to write.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: None
+    """
+    west = np.floor(bounds[0] / LANDSCAN_RES) * LANDSCAN_RES - 16 * LANDSCAN_RES
+    north = np.ceil(bounds[3] / LANDSCAN_RES) * LANDSCAN_RES + 16 * LANDSCAN_RES
+    width = int(np.ceil((bounds[2] - west) / LANDSCAN_RES)) + 16
+    height = int(np.ceil((north - bounds[1]) / LANDSCAN_RES)) + 16
+    profile = dict(RASTER_PROFILE, count=1, dtype="int32", crs=LANDSCAN_CRS)
+    profile["nodata"] = LANDSCAN_NODATA
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        tiles = {
+            "conus": (west, north, width, height),
+            "ak": (west + width * LANDSCAN_RES, north, 16, 16),
+            "hi": (west + width * LANDSCAN_RES, north - 16 * LANDSCAN_RES, 16, 16),
+        }
+        for region, (tile_west, tile_north, tile_width, tile_height) in tiles.items():
+            transform = from_origin(tile_west, tile_north, LANDSCAN_RES, LANDSCAN_RES)
+            tif_path = tmp_dir / f"landscan-usa-{YEAR}-{region}-night.tif"
+            with rasterio.open(
+                tif_path,
+                "w",
+                width=tile_width,
+                height=tile_height,
+                transform=transform,
+                **profile,
+            ) as dst:
+                for _, window in dst.block_windows(1):
+                    if region == "conus":
+                        # about a third of the cells are empty, the rest are gamma
+                        # distributed counts.
+                        pop = rng.gamma(0.6, 20.0, size=(window.height, window.width))
+                        pop[rng.random(pop.shape) < 0.35] = 0
+                    else:
+                        pop = np.zeros((window.height, window.width))
+                    dst.write(pop.astype("int32"), 1, window=window)
+
+        inner_zip = tmp_dir / f"landscan-usa-{YEAR}-night.zip"
+        with ZipFile(inner_zip, "w", ZIP_STORED) as zf:
+            for region in tiles:
+                name = f"landscan-usa-{YEAR}-{region}-night.tif"
+                zf.write(tmp_dir / name, name)
+        with ZipFile(zip_path, "w", ZIP_STORED) as zf:
+            zf.write(inner_zip, inner_zip.name)
+
+
+def write_state_fixtures(
+    st_abbr: str,
+    st_fips: str,
+    origin: tuple[float, float],
+    output_dir: Path,
+    n_block_groups: int,
+    households_per_bg: int,
+    bg_size: float,
+    bgs_per_puma: int,
+    pums_sample_rate: float,
+    rng: np.random.Generator,
+):
+    """Writes the ACS, PUMS and TIGER fixtures of one state.
+
+    st_abbr: str = The state abbreviation.
+    st_fips: str = The state FIPS code.
+    origin: tuple[float, float] = The lower left corner of the state grid.
+    output_dir: Path = The raw data directory to write to.
+    n_block_groups: int = The number of block groups in the state.
+    households_per_bg: int = The mean number of households in a block group.
+    bg_size: float = The width and height of a block group in degrees.
+    bgs_per_puma: int = About how many block groups go in a PUMA.
+    pums_sample_rate: float = The share of the households that are in the PUMS.
+    rng: np.random.Generator = The random generator to draw with.
+
+    Returns: The block groups of the state, for the files shared by all states.
+    """
+    bg_gdf = block_group_grid(st_fips, n_block_groups, origin, bg_size, bgs_per_puma)
+    household_counts = rng.integers(
+        households_per_bg // 2, households_per_bg * 3 // 2 + 1, size=n_block_groups
+    )
+    households = draw_households(household_counts, rng)
+
+    acs_table(bg_gdf, households).to_parquet(
+        output_dir / f"{st_fips}_{SURVEY}_{YEAR}.parquet"
+    )
+
+    pums_h, pums_p = pums_tables(households, bg_gdf, st_fips, pums_sample_rate, rng)
+    write_pums_zip(
+        pums_h,
+        output_dir / f"csv_h{st_abbr.lower()}_{YEAR}.zip",
+        f"psam_h{st_fips}.csv",
+    )
+    write_pums_zip(
+        pums_p,
+        output_dir / f"csv_p{st_abbr.lower()}_{YEAR}.zip",
+        f"psam_p{st_fips}.csv",
+    )
+
+    write_zipped_shapefile(
+        bg_gdf.drop(columns=["PUMACE10"]), output_dir / f"tl_{YEAR}_{st_fips}_bg.zip"
+    )
+    write_zipped_shapefile(
+        puma_polygons(bg_gdf, st_fips), output_dir / f"tl_{YEAR}_{st_fips}_puma10.zip"
+    )
+    print(
+        f"{st_abbr}: {n_block_groups:,} block groups, {households.shape[0]:,} "
+        f"households, {pums_h.num_rows:,} PUMS households, {pums_p.num_rows:,} "
+        "PUMS persons"
+    )
+    return bg_gdf
+
+
+def write_fixtures(
+    output_dir: Path = raw_data_dir,
+    n_block_groups: int = 50,
+    households_per_bg: int = 400,
+    bg_size: float = 0.01,
+    bgs_per_puma: int = 150,
+    pums_sample_rate: float = 0.05,
+    seed: int = 0,
+):
+    """Writes the raw input fixtures for every state in config.STATE_INFO.
+
+    output_dir: Path = The raw data directory to write to.
+    n_block_groups: int = The number of block groups in each state.
+    households_per_bg: int = The mean number of households in a block group.
+    bg_size: float = The width and height of a block group in degrees.
+    bgs_per_puma: int = About how many block groups go in a PUMA.
+    pums_sample_rate: float = The share of the households that are in the PUMS.
+    seed: int = The seed of the random draws.
+
+    Returns: None
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    state_width = np.ceil(np.sqrt(n_block_groups)) * bg_size
+
+    bg_gdfs = []
+    for i, (st_abbr, st_fips) in enumerate(STATE_INFO):
+        origin = (ORIGIN_LON + i * (state_width + STATE_GAP), ORIGIN_LAT)
+        bg_gdfs.append(
+            write_state_fixtures(
+                st_abbr,
+                st_fips,
+                origin,
+                output_dir,
+                n_block_groups,
+                households_per_bg,
+                bg_size,
+                bgs_per_puma,
+                pums_sample_rate,
+                rng,
+            )
+        )
+    all_bg_gdf = pd.concat(bg_gdfs, ignore_index=True)
+
+    write_landscan_zip(
+        tuple(all_bg_gdf.total_bounds),
+        output_dir / f"landscan-usa-{YEAR}-night-assets.zip",
+        rng,
+    )
+
+    state_gdf = all_bg_gdf.dissolve("STATEFP").reset_index()
+    state_abbr = dict((st_fips, st_abbr) for st_abbr, st_fips in STATE_INFO)
+    state_names = [us.states.lookup(st_fips).name for st_fips in state_gdf["STATEFP"]]
+    write_zipped_shapefile(
+        gpd.GeoDataFrame(
+            {
+                "STATEFP": state_gdf["STATEFP"],
+                "STUSPS": state_gdf["STATEFP"].map(state_abbr),
+                "NAME": state_names,
+                "GEOID": state_gdf["STATEFP"],
+            },
+            geometry=state_gdf.geometry.values,
+            crs=TIGER_CRS,
+        ),
+        output_dir / f"tl_{YEAR}_us_state.zip",
+    )
+    pd.DataFrame(
+        {
+            "STATE": state_gdf["STATEFP"].map(state_abbr),
+            "STATEFP": state_gdf["STATEFP"],
+            "STATENS": "00000000",
+            "STATE_NAME": state_names,
+        }
+    ).to_parquet(output_dir / "national_state2020.parquet")
+
+    (
+        all_bg_gdf[["STATEFP", "COUNTYFP", "TRACTCE", "PUMACE10"]]
+        .drop_duplicates()
+        .rename(columns={"PUMACE10": "PUMA5CE"})
+        .to_csv(output_dir / tract_puma_rel_path.name, index=False)
+    )
+
+    # only the variables the pipeline reads, in the layout of the Census dictionary.
+    pd.DataFrame(
+        [
+            ["NAME", "SERIALNO", "C", 13, "Housing unit/GQ person serial number"],
+            ["NAME", "PUMA", "C", 5, "Public use microdata area code (PUMA)"],
+            ["NAME", "ST", "C", 2, "State Code based on 2010 Census definitions"],
+            ["NAME", "NP", "N", 2, "Number of persons in this household"],
+            ["NAME", "HINCP", "N", 8, "Household income (past 12 months)"],
+            ["NAME", "HHLDRAGEP", "N", 2, "Age of the householder"],
+            ["NAME", "HHLDRRAC1P", "C", 1, "Recoded detailed race code"],
+            ["NAME", "HHLDRHISP", "C", 2, "Recoded detailed Hispanic origin"],
+            ["NAME", "SPORDER", "N", 2, "Person number"],
+            ["NAME", "AGEP", "N", 2, "Age"],
+            ["NAME", "SEX", "C", 1, "Sex"],
+            ["NAME", "RAC1P", "C", 1, "Recoded detailed race code"],
+            ["NAME", "HISP", "C", 2, "Recoded detailed Hispanic origin"],
+            ["NAME", "RELSHIPP", "C", 2, "Relationship"],
+        ]
+    ).to_csv(
+        output_dir / f"PUMS_Data_Dictionary_{YEAR - 4}-{YEAR}.csv",
+        index=False,
+        header=False,
+    )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Write synthetic raw inputs for the states in config.STATE_INFO."
+    )
+    parser.add_argument("--output-dir", type=Path, default=raw_data_dir)
+    parser.add_argument("--block-groups", type=int, default=50)
+    parser.add_argument("--households-per-bg", type=int, default=400)
+    parser.add_argument("--bg-size", type=float, default=0.01)
+    parser.add_argument("--bgs-per-puma", type=int, default=150)
+    parser.add_argument("--pums-sample-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_fixtures(
+        output_dir=args.output_dir,
+        n_block_groups=args.block_groups,
+        households_per_bg=args.households_per_bg,
+        bg_size=args.bg_size,
+        bgs_per_puma=args.bgs_per_puma,
+        pums_sample_rate=args.pums_sample_rate,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,21 @@
 # https://github.com/RTIInternational/rti_synth_pop
 # nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
 # %%
-import io
 from pathlib import Path
 from typing import Annotated
-from zipfile import ZipFile
 
-from pyarrow import parquet
-import osgeo  # noqa
-import censusdata
-import pandas as pd
 from pytask import Product, mark, task
-from rasterio.merge import merge as rio_merge
-from tqdm import tqdm
 
-from rti_synth_pop.config import CENSUS_COLS, STATE_INFO, SURVEY, YEAR, raw_data_dir
+from rti_synth_pop.config import (
+    CENSUS_COLS,
+    RASTER_MERGE_MEM_LIMIT,
+    RASTER_OVERVIEW_FACTORS,
+    RASTER_PROFILE,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    raw_data_dir,
+)
 
 
 # %%
@@ -50,6 +51,11 @@ for id_, kwargs in _ID_TO_KWARGS.items():
 
         Returns: None
         """
+        # the libraries are only imported when a task runs, so collecting the tasks
+        # does not load them.
+        import censusdata
+        import pandas as pd
+        from tqdm import tqdm
 
         cen_geo_cnty = censusdata.geographies(
             censusdata.censusgeo([("state", str(st_fips)), ("county", "*")]),
@@ -87,8 +93,11 @@ def test_download_state_fips(
     """
     This downloads a table of the full list of state codes and fips if we wanted to run
     the entire country at once. Currently we list the states in config.py we want to do
-    to avoid huge computation.
+    to avoid huge computation. Set NATIONAL_RUN in config.py and use the scheduler to
+    run the entire country.
     """
+    import pandas as pd
+
     st_fips_df = pd.read_table(url, sep="|").assign(
         STATEFP=lambda df: df.STATEFP.astype(str).str.zfill(2)
     )
@@ -116,23 +125,32 @@ def task_merge_landscan(
     input_path: zip folder downloaded from landsan
     output_path: tif file of merged population counts.
     """
+    import osgeo  # noqa
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.merge import merge as rio_merge
+
+    # the rasters are read straight out of the nested zips through GDAL's virtual
+    # file system, so nothing is extracted to disk or buffered in memory. The merge
+    # is written window by window into a tiled, compressed GeoTIFF.
+    inner_zip = f"/vsizip/{input_path}/landscan-usa-{YEAR}-night.zip"
+    file_list = [
+        f"landscan-usa-{YEAR}-conus-night.tif",
+        f"landscan-usa-{YEAR}-ak-night.tif",
+        f"landscan-usa-{YEAR}-hi-night.tif",
+    ]
+    vsi_path_list = [f"/vsizip/{{{inner_zip}}}/{file}" for file in file_list]
+
+    _ = rio_merge(
+        vsi_path_list,
+        dst_path=output_path,
+        dst_kwds=RASTER_PROFILE,
+        mem_limit=RASTER_MERGE_MEM_LIMIT,
+    )
 
-    with ZipFile(input_path) as z1:
-        zfiledata = io.BytesIO(z1.read(f"landscan-usa-{YEAR}-night.zip"))
-        with ZipFile(zfiledata) as z2:
-            file_list = [
-                f"landscan-usa-{YEAR}-conus-night.tif",
-                f"landscan-usa-{YEAR}-ak-night.tif",
-                f"landscan-usa-{YEAR}-hi-night.tif",
-            ]
-            for file in file_list:
-                z2.extract(file, raw_data_dir)
-
-    file_path_list = [raw_data_dir / file for file in file_list]
-
-    _ = rio_merge(file_path_list, dst_path=output_path)
-
-    [file.unlink() for file in file_path_list]
+    # internal overviews for quick previews and coarse reads of the national mosaic.
+    with rasterio.open(output_path, "r+") as dst:
+        dst.build_overviews(RASTER_OVERVIEW_FACTORS, Resampling.average)
 
 
 # %%
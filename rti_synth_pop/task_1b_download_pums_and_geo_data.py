@@ -11,7 +11,14 @@ from typing import Annotated
 
 from pytask import Product, mark, task
 
-from rti_synth_pop.config import STATE_INFO, YEAR, raw_data_dir
+from rti_synth_pop.config import (
+    CROSSWALK_METHOD,
+    STATE_INFO,
+    TRACT_PUMA_REL_URL,
+    YEAR,
+    raw_data_dir,
+    tract_puma_rel_path,
+)
 
 
 # %%
@@ -28,6 +35,12 @@ def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
         "output_path": raw_data_dir / f"tl_{YEAR}_us_state.zip",
     }
 
+    if CROSSWALK_METHOD == "relationship":
+        id_to_kwargs["tract_puma_rel"] = {
+            "input_url": TRACT_PUMA_REL_URL,
+            "output_path": tract_puma_rel_path,
+        }
+
     for st_abbr, st_fips in state_info:
         id_to_kwargs[st_abbr + "_pums-h"] = {
             "input_url": base_pums_url + f"csv_h{st_abbr.lower()}.zip",
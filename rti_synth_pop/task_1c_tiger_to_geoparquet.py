@@ -0,0 +1,82 @@
+# Description: This script converts the TIGER shapefiles to GeoParquet for the later tasks.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software].
+# https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# %%
+from pathlib import Path
+from typing import Annotated
+
+from pytask import Product, task
+
+from rti_synth_pop.config import STATE_INFO, YEAR, interim_data_dir, raw_data_dir
+from rti_synth_pop.marks import persist_unless_incremental
+
+
+# %%
+def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
+    id_to_kwargs = {}
+    for st_abbr, st_fips in state_info:
+        id_to_kwargs[st_abbr + "_bg_geo"] = {
+            "input_path": raw_data_dir / f"tl_{YEAR}_{st_fips}_bg.zip",
+            "columns": ["GEOID", "COUNTYFP"],
+            "pop_raster_path": raw_data_dir / f"landscan-usa-{YEAR}-merged-night.tif",
+            "output_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_bg.parquet",
+        }
+
+        id_to_kwargs[st_abbr + "_puma_geo"] = {
+            "input_path": raw_data_dir / f"tl_{YEAR}_{st_fips}_puma10.zip",
+            "columns": ["GEOID10"],
+            "pop_raster_path": raw_data_dir / f"landscan-usa-{YEAR}-merged-night.tif",
+            "output_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_puma10.parquet",
+        }
+
+    return id_to_kwargs
+
+
+_ID_TO_KWARGS = _create_parametrization(STATE_INFO)
+_ID_TO_KWARGS
+# %%
+for id_, kwargs in _ID_TO_KWARGS.items():
+
+    @persist_unless_incremental
+    @task(id=id_, kwargs=kwargs)
+    def task_tiger_to_geoparquet(
+        input_path: Path,
+        columns: list[str],
+        pop_raster_path: Path,
+        output_path: Annotated[Path, Product],
+    ) -> None:
+        """Convert a zipped TIGER shapefile to GeoParquet in the population raster CRS.
+
+        Only the needed columns are kept. The bounding box (xmin, ymin, xmax, ymax) and
+        a representative point (rep_x, rep_y) of each geometry are stored as plain
+        columns, so later tasks can use them without loading the geometry.
+
+        input_path: Path = The path to the TIGER zip.
+        columns: list[str] = The attribute columns to keep.
+        pop_raster_path: Path = The path to the merged population raster.
+        output_path: Path = path to output GeoParquet file
+
+        Returns: None
+        """
+        import geopandas as gpd
+        import rasterio
+
+        with rasterio.open(pop_raster_path) as src:
+            raster_crs = src.crs
+
+        gdf = gpd.read_file(
+            input_path, columns=columns, engine="pyogrio", use_arrow=True
+        ).to_crs(raster_crs)
+        bounds = gdf.bounds
+        rep_points = gdf.representative_point()
+        gdf.assign(
+            xmin=bounds["minx"],
+            ymin=bounds["miny"],
+            xmax=bounds["maxx"],
+            ymax=bounds["maxy"],
+            rep_x=rep_points.x,
+            rep_y=rep_points.y,
+        ).to_parquet(output_path, index=False)
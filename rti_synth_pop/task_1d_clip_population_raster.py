@@ -0,0 +1,102 @@
+# Description: This script clips the national population raster to each state.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software].
+# https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# %%
+import math
+from pathlib import Path
+from typing import Annotated
+
+from pytask import Product, task
+
+from rti_synth_pop.config import (
+    RASTER_CLIP_BUFFER_CELLS,
+    RASTER_PROFILE,
+    STATE_INFO,
+    YEAR,
+    interim_data_dir,
+    raw_data_dir,
+)
+from rti_synth_pop.marks import persist_unless_incremental
+
+
+# %%
+def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
+    id_to_kwargs = {}
+    for st_abbr, st_fips in state_info:
+        id_to_kwargs[st_abbr] = {
+            "bg_geo_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_bg.parquet",
+            "pop_raster_path": raw_data_dir / f"landscan-usa-{YEAR}-merged-night.tif",
+            "output_path": interim_data_dir / f"{st_fips}_{YEAR}_pop_raster.tif",
+        }
+
+    return id_to_kwargs
+
+
+_ID_TO_KWARGS = _create_parametrization(STATE_INFO)
+_ID_TO_KWARGS
+# %%
+for id_, kwargs in _ID_TO_KWARGS.items():
+
+    @persist_unless_incremental
+    @task(id=id_, kwargs=kwargs)
+    def task_clip_population_raster(
+        bg_geo_path: Path,
+        pop_raster_path: Path,
+        output_path: Annotated[Path, Product],
+    ) -> None:
+        """Clip the national population raster to the block groups of a state.
+
+        The clip is the bounding box of all the block groups in the state, padded by a
+        few cells so edge block groups have all the cells they touch.
+
+        bg_geo_path: Path = The path to the census block group GeoParquet, in the
+        population raster CRS.
+        pop_raster_path: Path = The path to the merged population raster.
+        output_path: Path = path to output tif file of the state population counts.
+
+        Returns: None
+        """
+        import pandas as pd
+        import rasterio
+        from rasterio.windows import Window
+
+        # the block group bounding boxes are stored in the raster CRS, so the state
+        # bounds come from them without loading any geometry.
+        bg_bounds = pd.read_parquet(
+            bg_geo_path, columns=["xmin", "ymin", "xmax", "ymax"]
+        )
+        xmin, ymin = bg_bounds[["xmin", "ymin"]].min()
+        xmax, ymax = bg_bounds[["xmax", "ymax"]].max()
+        with rasterio.open(pop_raster_path) as src:
+            row_start, col_start = src.index(xmin, ymax, op=math.floor)
+            row_stop, col_stop = src.index(xmax, ymin, op=math.ceil)
+            row_start = max(row_start - RASTER_CLIP_BUFFER_CELLS, 0)
+            col_start = max(col_start - RASTER_CLIP_BUFFER_CELLS, 0)
+            row_stop = min(row_stop + RASTER_CLIP_BUFFER_CELLS, src.height)
+            col_stop = min(col_stop + RASTER_CLIP_BUFFER_CELLS, src.width)
+            window = Window.from_slices((row_start, row_stop), (col_start, col_stop))
+
+            profile = src.profile | RASTER_PROFILE
+            profile.update(
+                width=window.width,
+                height=window.height,
+                transform=src.window_transform(window),
+            )
+            # copy the clip over in strips of blocks so a large state is never held
+            # in memory all at once.
+            strip_height = RASTER_PROFILE["blockysize"] * 8
+            with rasterio.open(output_path, "w", **profile) as dst:
+                for row_off in range(0, window.height, strip_height):
+                    strip = Window(
+                        0,
+                        row_off,
+                        window.width,
+                        min(strip_height, window.height - row_off),
+                    )
+                    src_strip = Window(
+                        col_start, row_start + row_off, strip.width, strip.height
+                    )
+                    dst.write(src.read(1, window=src_strip), 1, window=strip)
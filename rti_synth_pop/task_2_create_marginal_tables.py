@@ -9,8 +9,6 @@
 from pathlib import Path
 from typing import Annotated
 
-import duckdb
-from pyprojroot import here
 from pytask import Product, mark, task
 
 from rti_synth_pop.config import (
@@ -59,6 +57,8 @@ for id_, kwargs in _ID_TO_KWARGS.items():
 
         Returns: None
         """
+        import duckdb
+
         the_query = query + f" FROM '{input_path}'"
         df = duckdb.execute(the_query).df().melt(id_vars="GEOID")
         df.to_parquet(output_path)
@@ -9,10 +9,10 @@ from pathlib import Path
 from typing import Annotated
 from zipfile import ZipFile
 
-import pandas as pd
-from pytask import Product, mark, task
+from pytask import Product, task
 
 from rti_synth_pop.config import (
+    INTERIM_SUFFIX,
     STATE_INFO,
     YEAR,
     age_map,
@@ -23,6 +23,7 @@ from rti_synth_pop.config import (
     race_map,
     raw_data_dir,
 )
+from rti_synth_pop.marks import persist_unless_incremental
 
 # TODO: turn this into a task
 # fold all this information into the larger dictionary in the config file.
@@ -42,7 +43,8 @@ def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
         id_to_kwargs[st_abbr] = {
             "input_path": raw_data_dir / f"csv_h{st_abbr.lower()}_{YEAR}.zip",
             "input_persons_path": raw_data_dir / f"csv_p{st_abbr.lower()}_{YEAR}.zip",
-            "output_path": interim_data_dir / f"csv_h{st_fips}_{YEAR}_recoded.parquet",
+            "output_path": interim_data_dir
+            / f"csv_h{st_fips}_{YEAR}_recoded{INTERIM_SUFFIX}",
         }
 
     return id_to_kwargs
@@ -53,7 +55,7 @@ _ID_TO_KWARGS
 # %%
 for id_, kwargs in _ID_TO_KWARGS.items():
 
-    @mark.persist
+    @persist_unless_incremental
     @task(id=id_, kwargs=kwargs)
     def task_recode_pums_data(
         input_path: Path,
@@ -68,6 +70,9 @@ for id_, kwargs in _ID_TO_KWARGS.items():
 
         Returns: None
         """
+        import pandas as pd
+
+        from rti_synth_pop.interim import write_interim
 
         # read in the raw PUMS household data
         # subset to the columns we need for IPF and selection
@@ -157,4 +162,4 @@ for id_, kwargs in _ID_TO_KWARGS.items():
             # fixes that before the write.
             .astype({"SERIALNO": str})
         )
-        pums_recode.to_parquet(output_path)
+        write_interim(pums_recode, output_path)
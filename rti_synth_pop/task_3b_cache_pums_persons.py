@@ -0,0 +1,81 @@
+# Description: This script converts the PUMS person csvs to a columnar cache for task 7.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software].
+# https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# %%
+from pathlib import Path
+from typing import Annotated
+from zipfile import ZipFile
+
+from pytask import Product, task
+
+from rti_synth_pop.config import (
+    PERSON_CACHE_ROW_GROUP_SIZE,
+    STATE_INFO,
+    YEAR,
+    interim_data_dir,
+    raw_data_dir,
+)
+from rti_synth_pop.marks import persist_unless_incremental
+
+PERSON_COLUMNS = ["SERIALNO", "SPORDER", "RAC1P", "HISP", "AGEP", "SEX", "RELSHIPP"]
+
+
+# %%
+def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
+    id_to_kwargs = {}
+    for st_abbr, st_fips in state_info:
+        id_to_kwargs[st_abbr] = {
+            "input_path": raw_data_dir / f"csv_p{st_abbr.lower()}_{YEAR}.zip",
+            "output_path": interim_data_dir / f"csv_p{st_fips}_{YEAR}.parquet",
+        }
+
+    return id_to_kwargs
+
+
+_ID_TO_KWARGS = _create_parametrization(STATE_INFO)
+_ID_TO_KWARGS
+# %%
+for id_, kwargs in _ID_TO_KWARGS.items():
+
+    @persist_unless_incremental
+    @task(id=id_, kwargs=kwargs)
+    def task_cache_pums_persons(
+        input_path: Path,
+        output_path: Annotated[Path, Product],
+    ) -> None:
+        """Write the PUMS person columns used by task 7 to parquet, sorted by SERIALNO.
+
+        The sort keeps the persons of a serial number together and gives every row
+        group a narrow SERIALNO range, so a read filtered to the sampled serial numbers
+        can skip the row groups it does not need.
+
+        input_path: Path = The path to the PUMS Person zip
+        output_path: Path = path to output parquet file
+
+        Returns: None
+        """
+        import pyarrow as pa
+        from pyarrow import csv, parquet
+
+        with ZipFile(input_path) as zf:
+            pums_p_table = pa.concat_tables(
+                [
+                    csv.read_csv(
+                        zf.open(i),
+                        convert_options=csv.ConvertOptions(
+                            include_columns=PERSON_COLUMNS,
+                            column_types={"SERIALNO": pa.string()},
+                        ),
+                    )
+                    for i in zf.namelist()
+                    if i.endswith(".csv")
+                ]
+            )
+        parquet.write_table(
+            pums_p_table.sort_by([("SERIALNO", "ascending"), ("SPORDER", "ascending")]),
+            output_path,
+            row_group_size=PERSON_CACHE_ROW_GROUP_SIZE,
+        )
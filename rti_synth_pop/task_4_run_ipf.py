@@ -6,19 +6,24 @@
 # nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
 
 # %%
-import warnings
+from functools import partial
 from pathlib import Path
 from typing import Annotated
 
-import numpy as np
-import pandas as pd
-import xarray as xr
-from ipfn import ipfn
-from pandas import CategoricalDtype
-from pytask import Product, mark, task
-from tqdm import tqdm
+from pytask import Product, task
 
-from rti_synth_pop.config import STATE_INFO, SURVEY, YEAR, interim_data_dir, query_dict
+from rti_synth_pop.config import (
+    FUSED,
+    INCREMENTAL,
+    INTERIM_SUFFIX,
+    STATE_INFO,
+    SURVEY,
+    YEAR,
+    interim_data_dir,
+    query_dict,
+)
+from rti_synth_pop.instrumentation import track
+from rti_synth_pop.marks import persist_unless_incremental
 
 
 # %%
@@ -36,19 +41,20 @@ def _create_parametrization(
         id_to_kwargs[st_abbr] = {
             "input_variables": input_var_paths,
             "output_path": interim_data_dir
-            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts.parquet",
+            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}",
         }
 
     return id_to_kwargs
 
 
-_ID_TO_KWARGS = _create_parametrization(STATE_INFO, query_dict)
+# with FUSED, the task of task_4_to_8_fused.py runs IPF instead.
+_ID_TO_KWARGS = {} if FUSED else _create_parametrization(STATE_INFO, query_dict)
 _ID_TO_KWARGS
 # %%
 
 for id_, kwargs in _ID_TO_KWARGS.items():
 
-    @mark.persist
+    @persist_unless_incremental
     @task(id=id_, kwargs=kwargs)
     def task_run_ipf(
         input_variables: dict[str, Path], output_path: Annotated[Path, Product]
@@ -60,60 +66,56 @@ for id_, kwargs in _ID_TO_KWARGS.items():
 
         Returns: None
         """
-        data_dict = {}
-        variable_label_dict = {}
-        for var, input_path in input_variables.items():
-            df = pd.read_parquet(input_path)
-            data_dict[var] = df
-            variable_label_dict[var] = df.iloc[:, 1].unique().tolist()
-
-        # create array of dims matching the count of categories for each marginal
-        all_dimensions = [len(x) for x in variable_label_dict.values()]
-        dimensions = [[x] for x in range(len(all_dimensions))]
-        marginals = np.full(all_dimensions, fill_value=1)
-
-        # all the data should be identical and consistent, so we can pull the geoids
-        # from just one of the marginal tables.
-        geoids = data_dict[var].GEOID.unique()
-
-        # NOTE: FOR TESTING ONLY.
-        # TODO: remove ignore warnings later and make sure there isn't something
-        # funky going on.
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            result_list = []
-            for geoid in tqdm(geoids):
-                aggregates = []
-                for data in data_dict.values():
-                    # TODO: this could be a duckdb query instead of loading the entire
-                    # dataframe above. Might be a better solution for parallelization.
-                    data_values = data[data.GEOID == geoid].value.values
-                    aggregates.append(data_values)
-
-                IPF = ipfn.ipfn(marginals, aggregates, dimensions, convergence_rate=1)
-                IPF.iteration()
-                ipf_result = IPF.iteration()
-                ipf_result = np.array(ipf_result)
-                # this probabalistic round comes from the original code, but it the counts to be off
-                # but a few hundred when summed up over even a small test set.
-                # TODO: revisit the rounding.
-                # ipf_result = np.floor(ipf_result + np.random.random()).astype(int)
-
-                data = xr.DataArray(
-                    ipf_result,
-                    coords=variable_label_dict,
-                    dims=list(variable_label_dict.keys()),
-                )
-                data.name = "count"
-                result_df = data.to_dataframe().reset_index().assign(GEOID=geoid)
-                result_list.append(result_df)
-        sp_df = pd.concat(result_list).astype(
-            {
-                "size": CategoricalDtype(ordered=True),
-                "age": CategoricalDtype(ordered=True),
-                "income": CategoricalDtype(ordered=True),
-                "race": CategoricalDtype(),
-                "ethnicity": CategoricalDtype(),
+        import pandas as pd
+
+        from rti_synth_pop.checkpoint import finalize, open_checkpoint
+        from rti_synth_pop.incremental import (
+            changed_units,
+            load_unit_hashes,
+            save_unit_hashes,
+            splice_units,
+        )
+        from rti_synth_pop.interim import read_interim, write_interim
+        from rti_synth_pop.ipf import (
+            IPF_DTYPES,
+            marginal_hashes,
+            read_marginals,
+            run_ipf_by_county,
+        )
+
+        data_dict, variable_label_dict = read_marginals(input_variables)
+        geoids = data_dict[list(data_dict)[-1]].GEOID.unique()
+        # with INCREMENTAL, only the block groups whose marginals changed are run, and
+        # the others are kept from the existing output.
+        kept = []
+        if INCREMENTAL:
+            unit_hashes = marginal_hashes(data_dict)
+            old_hashes = pd.Series(dtype=object)
+            if output_path.exists():
+                old_hashes = load_unit_hashes(output_path.stem)["hash"]
+            changed = changed_units(unit_hashes, old_hashes)
+            kept = unit_hashes.index.difference(changed)
+            data_dict = {
+                var: df.loc[df["GEOID"].isin(changed)] for var, df in data_dict.items()
             }
+
+        # the finished counties are checkpointed, so a rerun after a crash resumes.
+        partial_dir, done = open_checkpoint(
+            output_path.stem, list(input_variables.values())
+        )
+        with track("ipf_loop", state_fips=output_path.name.split("_")[0]) as metrics:
+            metrics["block_groups"] = len(geoids)
+            metrics["resumed_shards"] = len(done)
+            metrics["kept_units"] = len(kept)
+            sp_df = run_ipf_by_county(data_dict, variable_label_dict, partial_dir, done)
+
+        if len(kept):
+            old_df = read_interim(
+                output_path, filters=[("GEOID", "in", list(kept))]
+            ).astype({var: object for var in IPF_DTYPES})
+            sp_df = splice_units(old_df, old_df["GEOID"], sp_df, sp_df["GEOID"], geoids)
+        finalize(
+            partial_dir, output_path, partial(write_interim, sp_df.astype(IPF_DTYPES))
         )
-        sp_df.to_parquet(output_path)
+        if INCREMENTAL:
+            save_unit_hashes(output_path.stem, unit_hashes.to_frame("hash"))
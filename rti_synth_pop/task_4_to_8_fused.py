@@ -0,0 +1,265 @@
+# Description: This script runs IPF, the sampling, the population files and the
+# coordinates of a state in one process, with FUSED.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software].
+# https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# %%
+from functools import partial
+from pathlib import Path
+from typing import Annotated
+
+from pytask import Product, task
+
+from rti_synth_pop.config import (
+    COORDINATE_METHOD,
+    FUSED,
+    FUSED_WRITE_INTERIM,
+    INTERIM_SUFFIX,
+    N_JOBS,
+    OUTPUT_LAYOUT,
+    OUTPUT_PARTITIONED,
+    SEED,
+    STATE_INFO,
+    SURVEY,
+    WEIGHT_CACHE,
+    YEAR,
+    interim_data_dir,
+    processed_data_dir,
+    query_dict,
+    vars_list,
+)
+from rti_synth_pop.coordinate_params import generate_params
+from rti_synth_pop.instrumentation import track
+from rti_synth_pop.marks import persist_unless_incremental
+from rti_synth_pop.partitions import partitioned_path
+
+
+# %%
+def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
+    coordinate_params = generate_params(state_info)
+    id_to_kwargs = {}
+    for st_abbr, st_fips in state_info:
+        id_to_kwargs[st_abbr] = {
+            "input_variables": {
+                var: interim_data_dir / f"{st_fips}_{SURVEY}_{YEAR}_{var}.parquet"
+                for var in query_dict
+            },
+            "pums_h_path": interim_data_dir
+            / f"csv_h{st_fips}_{YEAR}_recoded{INTERIM_SUFFIX}",
+            "crosswalk_path": interim_data_dir
+            / f"{st_fips}_{YEAR}_pums_2_bg_crosswalk.parquet",
+            "pums_p_path": interim_data_dir / f"csv_p{st_fips}_{YEAR}.parquet",
+            "bg_geo_path": coordinate_params[st_abbr]["bg_geo_path"],
+            "pop_raster_path": coordinate_params[st_abbr]["pop_raster_path"],
+            "weight_cache_dir": coordinate_params[st_abbr]["weight_cache_dir"],
+            "output_path_persons": processed_data_dir
+            / f"{st_fips}_{YEAR}_persons.parquet",
+            "output_paths": dict(coordinate_params[st_abbr]["output_paths"]),
+        }
+        if OUTPUT_LAYOUT == "normalized":
+            id_to_kwargs[st_abbr]["output_path_persons"] = coordinate_params[st_abbr][
+                "pums_persons_path"
+            ]
+        elif OUTPUT_PARTITIONED:
+            id_to_kwargs[st_abbr]["output_path_persons"] = partitioned_path(
+                "persons", processed_data_dir, YEAR, st_fips
+            )
+        # the files tasks 4, 6 and 7 write, only written here for debugging.
+        if FUSED_WRITE_INTERIM:
+            id_to_kwargs[st_abbr]["output_paths"]["interim"] = {
+                "ipf": interim_data_dir
+                / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}",
+                "serialnos": interim_data_dir
+                / f"{st_fips}_{YEAR}_household_synthpop_serialnos{INTERIM_SUFFIX}",
+                "households": interim_data_dir
+                / f"{st_fips}_{YEAR}_households{INTERIM_SUFFIX}",
+            }
+
+    return id_to_kwargs
+
+
+_ID_TO_KWARGS = _create_parametrization(STATE_INFO) if FUSED else {}
+_ID_TO_KWARGS
+# %%
+
+for id_, kwargs in _ID_TO_KWARGS.items():
+
+    @persist_unless_incremental
+    @task(id=id_, kwargs=kwargs)
+    def task_fused_population(
+        input_variables: dict[str, Path],
+        pums_h_path: Path,
+        crosswalk_path: Path,
+        pums_p_path: Path,
+        bg_geo_path: Path,
+        pop_raster_path: Path,
+        weight_cache_dir: str,
+        output_path_persons: Annotated[Path, Product],
+        output_paths: Annotated[dict[str, Path], Product],
+    ) -> None:
+        """Run tasks 4 to 8 for a state, passing the tables between them in memory.
+
+        input_variables: dict[str, Path] = A dictionary of all paths to marginal tables.
+        pums_h_path: Path = The path to the cleaned PUMS Household data.
+        crosswalk_path: Path = The path to the PUMA/block group crosswalk.
+        pums_p_path: Path = Path to the PUMS person cache from task 3b.
+        bg_geo_path: Path = The path to the census block group GeoParquet.
+        pop_raster_path: Path = The path to the population raster of the state.
+        weight_cache_dir: str = The weight cache directory of the state.
+        output_path_persons: Annotated[Path, Product] = The persons output of task 7.
+        output_paths: Annotated[dict[str, Path], Product] = The outputs of task 8, and
+        with FUSED_WRITE_INTERIM the interim files of tasks 4, 6 and 7 under interim.
+
+        Returns: None
+        """
+        import pandas as pd
+        import pyarrow as pa
+        import rasterio
+
+        from rti_synth_pop.checkpoint import (
+            close_checkpoint,
+            open_checkpoint,
+            write_atomic,
+        )
+        from rti_synth_pop.household_points import (
+            household_coordinates,
+            households_by_block_group,
+            read_block_groups,
+            sample_block_group_points,
+        )
+        from rti_synth_pop.interim import write_interim
+        from rti_synth_pop.ipf import IPF_DTYPES, read_marginals, run_ipf_by_county
+        from rti_synth_pop.outputs import write_households
+        from rti_synth_pop.population import (
+            build_households,
+            build_persons,
+            write_persons,
+        )
+        from rti_synth_pop.sample_pums import (
+            get_similarity_df,
+            ipf_counts_with_puma,
+            read_pums_households,
+            round_ipf_counts,
+            sample_households,
+        )
+        from rti_synth_pop.weight_cache import (
+            join_cache_index,
+            raster_signature,
+            write_cache,
+        )
+
+        st_fips = crosswalk_path.name.split("_")[0]
+        interim_paths = output_paths.get("interim", {})
+        # every stage checkpoints its shards as in its own task. The shards depend on
+        # all the inputs of the stages before, since their outputs are not files.
+        ipf_inputs = list(input_variables.values())
+        sampling_inputs = ipf_inputs + [pums_h_path, crosswalk_path]
+        partial_dirs = []
+
+        # %%
+        # IPF, as in task 4.
+        data_dict, variable_label_dict = read_marginals(input_variables)
+        partial_dir, done = open_checkpoint(f"{st_fips}_{YEAR}_fused_ipf", ipf_inputs)
+        partial_dirs.append(partial_dir)
+        with track("ipf_loop", state_fips=st_fips) as metrics:
+            metrics["block_groups"] = data_dict[list(data_dict)[-1]].GEOID.nunique()
+            metrics["resumed_shards"] = len(done)
+            ipf_df = run_ipf_by_county(
+                data_dict, variable_label_dict, partial_dir, done
+            ).astype(IPF_DTYPES)
+        if interim_paths:
+            write_atomic(interim_paths["ipf"], partial(write_interim, ipf_df))
+
+        # %%
+        # the sampling, as in task 6. The PUMS households are read once for the
+        # sampling and the population files.
+        ipf_count_rounded_df = round_ipf_counts(
+            ipf_counts_with_puma(ipf_df, pd.read_parquet(crosswalk_path))
+        )
+        del ipf_df
+        pums_h_df = read_pums_households(pums_h_path)
+        scaled_euclidean_df = get_similarity_df(pums_h_df, vars_list)
+        partial_dir, done = open_checkpoint(
+            f"{st_fips}_{YEAR}_fused_sampling", sampling_inputs
+        )
+        partial_dirs.append(partial_dir)
+        with track("sample_pumas", state_fips=st_fips) as metrics:
+            metrics["pumas"] = ipf_count_rounded_df["PUMA_GEOID"].nunique()
+            metrics["resumed_shards"] = len(done)
+            result_df = sample_households(
+                ipf_count_rounded_df,
+                pums_h_df,
+                scaled_euclidean_df,
+                N_JOBS,
+                partial_dir,
+                done,
+            )
+            metrics["households"] = result_df.shape[0]
+        if interim_paths:
+            write_atomic(interim_paths["serialnos"], partial(write_interim, result_df))
+
+        # %%
+        # the population files, as in task 7.
+        with track("derive_population", state_fips=st_fips) as metrics:
+            synthpop_df, serialnos = build_households(result_df, pums_h_df)
+            write_persons(
+                build_persons(synthpop_df, serialnos, pums_p_path), output_path_persons
+            )
+            metrics["households"] = synthpop_df.shape[0]
+        households = pa.Table.from_pandas(synthpop_df, preserve_index=False)
+        del result_df, synthpop_df
+        if interim_paths:
+            write_interim(households, interim_paths["households"])
+
+        # %%
+        # the coordinates, as in task 8.
+        with rasterio.open(pop_raster_path) as src:
+            crs = src.crs
+        raster_hash = raster_signature(pop_raster_path)
+        hh_order, bg_geoids, bg_starts, bg_counts = households_by_block_group(
+            households
+        )
+        bg_gdf = read_block_groups(
+            bg_geo_path, crs, pd.Series(bg_counts, index=bg_geoids)
+        )
+        with track(
+            "place_households", state_fips=st_fips, method=COORDINATE_METHOD
+        ) as metrics:
+            metrics["block_groups"] = int((bg_gdf["household_count"] > 0).sum())
+            metrics["households"] = int(hh_order.size)
+            partial_dir, done = None, set()
+            cache_dir, cache_index = None, None
+            if COORDINATE_METHOD == "mask":
+                if WEIGHT_CACHE:
+                    cache_dir = Path(weight_cache_dir)
+                    bg_gdf, cache_index = join_cache_index(
+                        bg_gdf, raster_hash, cache_dir
+                    )
+                partial_dir, done = open_checkpoint(
+                    f"{st_fips}_{YEAR}_fused_coordinates",
+                    sampling_inputs + [bg_geo_path, pop_raster_path],
+                    {"method": COORDINATE_METHOD, "seed": SEED},
+                )
+                partial_dirs.append(partial_dir)
+                metrics["resumed_shards"] = len(done)
+            bg_points, new_windows = sample_block_group_points(
+                bg_gdf, pop_raster_path, cache_dir, partial_dir, done
+            )
+            if cache_dir is not None:
+                write_cache(cache_dir, raster_hash, cache_index, new_windows)
+            lon, lat = household_coordinates(
+                bg_points, hh_order, bg_geoids, bg_starts, bg_counts
+            )
+
+        write_households(
+            households,
+            lon,
+            lat,
+            bg_gdf.crs,
+            output_paths,
+            output_path_persons if OUTPUT_LAYOUT == "normalized" else None,
+        )
+        for partial_dir in partial_dirs:
+            close_checkpoint(partial_dir)
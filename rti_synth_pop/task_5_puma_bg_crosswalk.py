@@ -8,11 +8,16 @@
 from pathlib import Path
 from typing import Annotated
 
-import geopandas as gpd
-import pandas as pd
-from pytask import Product, mark, task
+from pytask import Product, task
 
-from rti_synth_pop.config import STATE_INFO, YEAR, interim_data_dir, raw_data_dir
+from rti_synth_pop.config import (
+    CROSSWALK_METHOD,
+    STATE_INFO,
+    YEAR,
+    interim_data_dir,
+    tract_puma_rel_path,
+)
+from rti_synth_pop.marks import persist_unless_incremental
 
 
 # %%
@@ -20,8 +25,11 @@ def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
     id_to_kwargs = {}
     for st_abbr, st_fips in state_info:
         id_to_kwargs[st_abbr + "_pums_bg_crosswalk"] = {
-            "input_pums_path": raw_data_dir / f"tl_{YEAR}_{st_fips}_puma10.zip",
-            "input_bg_path": raw_data_dir / f"tl_{YEAR}_{st_fips}_bg.zip",
+            "input_pums_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_puma10.parquet",
+            "input_bg_path": interim_data_dir / f"tl_{YEAR}_{st_fips}_bg.parquet",
+            "input_rel_path": (
+                tract_puma_rel_path if CROSSWALK_METHOD == "relationship" else None
+            ),
             "output_path": interim_data_dir
             / f"{st_fips}_{YEAR}_pums_2_bg_crosswalk.parquet",
         }
@@ -34,41 +42,87 @@ _ID_TO_KWARGS
 
 for id_, kwargs in _ID_TO_KWARGS.items():
 
-    @mark.persist
+    @persist_unless_incremental
     @task(id=id_, kwargs=kwargs)
     def task_pums_bg_crosswalk(
         input_pums_path: Path,
         input_bg_path: Path,
+        input_rel_path: Path | None,
         output_path: Annotated[Path, Product],
     ) -> None:
         """Identify which PUMA each block group falls into
 
-        input_pums_path: Path = The path to the PUMS geographic data.
-        input_bg_path: Path = The path to the census block group geographic data.
+        input_pums_path: Path = The path to the PUMA GeoParquet.
+        input_bg_path: Path = The path to the census block group GeoParquet.
+        input_rel_path: Path | None = The path to the Census tract to PUMA relationship
+        file, or None to only use the spatial join.
         output_path: Path = path to output parquet file
 
         Returns: None
         """
+        import geopandas as gpd
+        import pandas as pd
+
         # %%
-        puma_gdf = gpd.read_file(input_pums_path)
-        bg_gdf = gpd.read_file(input_bg_path)
-        # NOTE: setting the geometry as the representative points ensures that we get a
-        # block group to one puma relationship. Inexact polygons give us many
-        # pumas for a single block group. Representative point gives us a point that
-        # falls within the polygon, and the sjoin gives us results for all block groups.
-        # TODO: this should futher be tested. Currently I've worked this out for NC.
-        bg_gdf["geometry"] = bg_gdf.representative_point()
-        # %%
-        crosswalk = (
-            puma_gdf[["GEOID10", "geometry"]]
-            .sjoin(bg_gdf[["GEOID", "geometry"]])
-            .rename(columns={"GEOID10": "PUMA_GEOID", "GEOID": "BG_GEOID"})
-            .drop(columns=["geometry", "index_right"])
-        )
-
-        bg_all_ones = (crosswalk["BG_GEOID"].value_counts() == 1).all()
-        all_geoids_in_result = bg_gdf["GEOID"].isin(crosswalk["BG_GEOID"]).all()
-        if not all([bg_all_ones, all_geoids_in_result]):
-            Warning("NOT ALL BLOCK GROUPS HAVE RESULTS IN CROSSWALK")
+        bg_df = pd.read_parquet(input_bg_path, columns=["GEOID", "rep_x", "rep_y"])
+        crosswalk_list = []
+
+        # with the tract relationship file, the PUMA of a block group is the PUMA of
+        # its tract, found from the first 11 digits of the block group GEOID.
+        if input_rel_path is not None:
+            rel_df = pd.read_csv(input_rel_path, dtype=str).assign(
+                TRACT_GEOID=lambda df: df["STATEFP"] + df["COUNTYFP"] + df["TRACTCE"],
+                PUMA_GEOID=lambda df: df["STATEFP"] + df["PUMA5CE"],
+            )
+            tract_crosswalk = (
+                bg_df[["GEOID"]]
+                .assign(TRACT_GEOID=lambda df: df["GEOID"].str[:11])
+                .merge(rel_df[["TRACT_GEOID", "PUMA_GEOID"]], on="TRACT_GEOID")
+                .rename(columns={"GEOID": "BG_GEOID"})
+                .loc[:, ["PUMA_GEOID", "BG_GEOID"]]
+            )
+            crosswalk_list.append(tract_crosswalk)
+            bg_df = bg_df.loc[~bg_df["GEOID"].isin(tract_crosswalk["BG_GEOID"])]
+
+        # block groups in tracts the relationship file does not have, or all of them
+        # without the file, are placed in a PUMA with a spatial join.
+        if bg_df.shape[0] > 0:
+            puma_gdf = gpd.read_parquet(
+                input_pums_path, columns=["GEOID10", "geometry"]
+            )
+            # NOTE: setting the geometry as the representative points ensures that we
+            # get a block group to one puma relationship. Inexact polygons give us many
+            # pumas for a single block group. Representative point gives us a point
+            # that falls within the polygon, and the sjoin gives us results for all
+            # block groups. The representative points are precomputed in the
+            # GeoParquet, so the block group polygons are never loaded.
+            bg_gdf = gpd.GeoDataFrame(
+                bg_df[["GEOID"]],
+                geometry=gpd.points_from_xy(bg_df["rep_x"], bg_df["rep_y"]),
+                crs=puma_gdf.crs,
+            )
+            spatial_crosswalk = (
+                puma_gdf[["GEOID10", "geometry"]]
+                .sjoin(bg_gdf[["GEOID", "geometry"]])
+                .rename(columns={"GEOID10": "PUMA_GEOID", "GEOID": "BG_GEOID"})
+                .drop(columns=["geometry", "index_right"])
+            )
+            crosswalk_list.append(spatial_crosswalk)
+
+        crosswalk = pd.concat(crosswalk_list, ignore_index=True)
+
+        # every block group must be in exactly one PUMA, or the sampling would drop
+        # or duplicate its households.
+        all_bg_geoids = pd.read_parquet(input_bg_path, columns=["GEOID"])["GEOID"]
+        bg_counts = crosswalk["BG_GEOID"].value_counts()
+        multiple_pumas = bg_counts.index[bg_counts > 1].tolist()
+        missing = all_bg_geoids.loc[~all_bg_geoids.isin(crosswalk["BG_GEOID"])].tolist()
+        if multiple_pumas or missing:
+            raise ValueError(
+                "The PUMA to block group crosswalk is inconsistent. "
+                f"{len(missing)} block groups have no PUMA: {missing[:10]}. "
+                f"{len(multiple_pumas)} block groups are in more than one PUMA: "
+                f"{multiple_pumas[:10]}."
+            )
 
         crosswalk.to_parquet(output_path)
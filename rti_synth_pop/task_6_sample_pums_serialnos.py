@@ -8,58 +8,26 @@
 # %load_ext autoreload
 # %autoreload 2
 
+from functools import partial
 from pathlib import Path
 from typing import Annotated
 
-import numpy as np
-import pandas as pd
-from joblib import Parallel, delayed
-from pandas.api.types import CategoricalDtype
-from pytask import Product, mark, task
-from tqdm import tqdm
+from pytask import Product, task
 
 from rti_synth_pop.config import (
+    FUSED,
+    INCREMENTAL,
+    INTERIM_SUFFIX,
+    N_JOBS,
     STATE_INFO,
     SURVEY,
     YEAR,
-    age_labels,
-    income_labels,
     interim_data_dir,
     raw_data_dir,
-    size_labels,
     vars_list,
 )
-from rti_synth_pop.sample_pums import get_similarity_df, sample_pums_data
-
-parallel = Parallel(n_jobs=100, require="sharedmem", prefer="threads")
-
-
-# %%
-def sample_one_puma(
-    puma: int,
-    ipf_count_rounded_df_puma: pd.DataFrame,
-    pums_h_df: pd.DataFrame,
-    scaled_euclidean_df: pd.DataFrame,
-):
-    """For a specific PUMA, sample from the PUMS to fill the households expected by IPF.
-
-    puma: int = The puma FIPS code.
-    ipf_count_rounded_df_puma: pd.Dataframe = The IPF households for that PUMA.
-    pums_h_df: pd.Dataframe = The PUMS household data from the state.
-    scaled_euclidean_df: pd.DataFrame = The most similar PUMA to the PUMA of interest.
-
-    Returns: A list of dictionaries with serial numbers sampled for that PUMA, and their matching criteria.
-    """
-    puma_sample_weights = scaled_euclidean_df.loc[puma].rename("sample_weights")
-    all_results = []
-    for i, row in ipf_count_rounded_df_puma.iterrows():
-        matches = sample_pums_data(
-            row,
-            pums_h_df,
-            puma_sample_weights,
-        )
-        all_results += matches
-    return all_results
+from rti_synth_pop.instrumentation import track
+from rti_synth_pop.marks import persist_unless_incremental
 
 
 # %%
@@ -68,25 +36,27 @@ def _create_parametrization(state_info: list[str]) -> dict[str, str | Path]:
     for st_abbr, st_fips in state_info:
         id_to_kwargs[st_abbr] = {
             "ipf_path": interim_data_dir
-            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts.parquet",
-            "pums_h_path": interim_data_dir / f"csv_h{st_fips}_{YEAR}_recoded.parquet",
+            / f"{st_fips}_{SURVEY}_{YEAR}_IPF_counts{INTERIM_SUFFIX}",
+            "pums_h_path": interim_data_dir
+            / f"csv_h{st_fips}_{YEAR}_recoded{INTERIM_SUFFIX}",
             "crosswalk_path": interim_data_dir
             / f"{st_fips}_{YEAR}_pums_2_bg_crosswalk.parquet",
             # "raw_pums_path": raw_data_dir / f"csv_h{st_abbr.lower()}_{YEAR}.zip",
             "output_path": interim_data_dir
-            / f"{st_fips}_{YEAR}_household_synthpop_serialnos.parquet",
+            / f"{st_fips}_{YEAR}_household_synthpop_serialnos{INTERIM_SUFFIX}",
             "census_path": raw_data_dir / f"{st_fips}_{SURVEY}_{YEAR}.parquet",
         }
 
     return id_to_kwargs
 
 
-_ID_TO_KWARGS = _create_parametrization(STATE_INFO)
+# with FUSED, the task of task_4_to_8_fused.py samples the households instead.
+_ID_TO_KWARGS = {} if FUSED else _create_parametrization(STATE_INFO)
 _ID_TO_KWARGS
 # %%
 for id_, kwargs in _ID_TO_KWARGS.items():
 
-    @mark.persist
+    @persist_unless_incremental
     @task(id=id_, kwargs=kwargs)
     def task_sample_pumsh(
         ipf_path: Path,
@@ -105,35 +75,33 @@ for id_, kwargs in _ID_TO_KWARGS.items():
 
         Returns: None
         """
-        # %%
-        ipf_count_df = (
-            pd.read_parquet(ipf_path)
-            .astype(
-                {
-                    "size": CategoricalDtype(ordered=True),
-                    "age": CategoricalDtype(ordered=True),
-                    "income": CategoricalDtype(ordered=True),
-                    "race": CategoricalDtype(),
-                    "ethnicity": CategoricalDtype(),
-                }
-            )
-            .query("count > 0")
-            .assign(
-                size=lambda df: df["size"].cat.reorder_categories(size_labels),
-                age=lambda df: df["age"].cat.reorder_categories(age_labels),
-                income=lambda df: df["income"].cat.reorder_categories(income_labels),
-            )
-            .reset_index(drop=True)
+        # the libraries, and sample_pums with scikit-learn, are only imported when the
+        # task runs.
+        import numpy as np
+        import pandas as pd
+
+        from rti_synth_pop.checkpoint import finalize, open_checkpoint
+        from rti_synth_pop.incremental import (
+            changed_units,
+            frame_hashes,
+            load_unit_hashes,
+            save_unit_hashes,
+            splice_units,
+            table_hash,
         )
-        pums_h_df = pd.read_parquet(pums_h_path)
-        pums_h_df["PUMA_GEOID"] = pums_h_df["PUMA_GEOID"].astype(int)
-        # TODO: set index for faster query?
-        crosswalk = pd.read_parquet(crosswalk_path).rename(
-            columns={"BG_GEOID": "GEOID"}
+        from rti_synth_pop.interim import read_interim, write_interim
+        from rti_synth_pop.sample_pums import (
+            get_similarity_df,
+            read_ipf_counts,
+            read_pums_households,
+            round_ipf_counts,
+            sample_households,
         )
-        crosswalk["PUMA_GEOID"] = crosswalk["PUMA_GEOID"].astype(int)
+
+        # %%
+        ipf_count_df = read_ipf_counts(ipf_path, crosswalk_path)
+        pums_h_df = read_pums_households(pums_h_path)
         # geoids = census_df.index.tolist()
-        ipf_count_df = ipf_count_df.merge(crosswalk, on="GEOID", how="left")
 
         # %%
         scaled_euclidean_df = get_similarity_df(pums_h_df, vars_list)
@@ -146,37 +114,70 @@ for id_, kwargs in _ID_TO_KWARGS.items():
             np.floor(ipf_count_df["count"] + np.random.random()).astype(int).sum()
         )
         reg_rounded_pop = ipf_count_df["count"].round().sum().astype(int)
-        print(f"ref pop:\t\t{total_ref_pop:,}")
-        print(f"ipf pop:\t\t{sp_pop:,}")
-        print(f"prob rounded pop:\t{prob_rounded_pop:,}")
-        print(f"reg rounded pop:\t{reg_rounded_pop:,}")
-
-        ipf_count_rounded_df = ipf_count_df.copy()
-        ipf_count_rounded_df["count"] = (
-            (ipf_count_df["count"] + 0.1).round().astype(int)
-        )
-        ipf_count_rounded_df = ipf_count_rounded_df.loc[
-            ipf_count_rounded_df["count"] > 0
-        ].reset_index(drop=True)
+
+        ipf_count_rounded_df = round_ipf_counts(ipf_count_df)
+        pumas = np.sort(ipf_count_rounded_df["PUMA_GEOID"].unique())
+        bg_puma = ipf_count_rounded_df.drop_duplicates("GEOID").set_index("GEOID")[
+            "PUMA_GEOID"
+        ]
+        # with INCREMENTAL, only the PUMAs whose IPF counts changed are sampled, and
+        # the others are kept from the existing output. Every PUMA can sample from the
+        # PUMS households of the whole state, so a change to those resamples all.
+        kept = []
+        if INCREMENTAL:
+            unit_hashes = frame_hashes(
+                ipf_count_rounded_df, "PUMA_GEOID", salt=table_hash(pums_h_df)
+            )
+            old_hashes = pd.Series(dtype=object)
+            if output_path.exists():
+                old_hashes = load_unit_hashes(output_path.stem)["hash"]
+            changed = changed_units(unit_hashes, old_hashes)
+            kept = unit_hashes.index.difference(changed)
+            ipf_count_rounded_df = ipf_count_rounded_df.loc[
+                ipf_count_rounded_df["PUMA_GEOID"].isin(changed)
+            ]
         # %%
         # TODO: do the income adjustment
-        total_puma = len(ipf_count_rounded_df["PUMA_GEOID"].unique())
-
-        # Split by PUMA and run through the sampling function
-        sample_output = parallel(
-            delayed(sample_one_puma)(
-                puma,
-                ipf_count_rounded_df_puma,
+        total_puma = pumas.size
+
+        # Split by PUMA and run through the sampling function. The population totals
+        # are recorded with the metrics of the sampling.
+        st_fips = output_path.name.split("_")[0]
+        # the finished PUMAs are checkpointed, so a rerun after a crash resumes.
+        partial_dir, done = open_checkpoint(
+            output_path.stem, [ipf_path, pums_h_path, crosswalk_path]
+        )
+        with track("sample_pumas", state_fips=st_fips) as metrics:
+            metrics.update(
+                ref_pop=int(total_ref_pop),
+                ipf_pop=int(sp_pop),
+                prob_rounded_pop=int(prob_rounded_pop),
+                reg_rounded_pop=int(reg_rounded_pop),
+                pumas=total_puma,
+                resumed_shards=len(done),
+                kept_units=len(kept),
+            )
+            result_df = sample_households(
+                ipf_count_rounded_df,
                 pums_h_df,
                 scaled_euclidean_df,
+                N_JOBS,
+                partial_dir,
+                done,
             )
-            for puma, ipf_count_rounded_df_puma in tqdm(
-                ipf_count_rounded_df.groupby("PUMA_GEOID"), total=total_puma
-            )
-        )
-        result_list = []
-        for res in sample_output:
-            result_list += res
-
-        result_df = pd.DataFrame(result_list)
-        result_df.to_parquet(output_path)
+            if len(kept):
+                old_df = read_interim(output_path)
+                old_units = old_df["BG_GEOID"].map(bg_puma)
+                old_df = old_df.loc[old_units.isin(kept)]
+                result_df = splice_units(
+                    old_df,
+                    old_units.loc[old_df.index],
+                    result_df,
+                    result_df["BG_GEOID"].map(bg_puma) if len(result_df) else [],
+                    pumas,
+                ).reset_index(drop=True)
+            metrics["households"] = result_df.shape[0]
+
+        finalize(partial_dir, output_path, partial(write_interim, result_df))
+        if INCREMENTAL:
+            save_unit_hashes(output_path.stem, unit_hashes.to_frame("hash"))
@@ -0,0 +1,196 @@
+# Description: This file contains the functions for the on-disk cache of block group population weight windows.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# The cache holds the masked and cropped population raster of every block group of a
+# state, so reruns of task 8 can skip the raster reads. It is one directory per state:
+#   weights.npy     <- the flattened windows of all block groups, one after another.
+#                      Read with mmap, so a worker only pages in the windows it uses.
+#   index.parquet   <- GEOID, geometry hash, offset and shape into weights.npy and the
+#                      affine transform of each window.
+#   raster_hash     <- signature of the raster the windows were read from: the size and
+#                      modification time of its file and its profile, so checking it
+#                      does not read the raster.
+# A window is used only when the raster signature and the geometry hash both match.
+
+import hashlib
+import json
+import math
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.windows import from_bounds
+
+TRANSFORM_COLS = ["t_a", "t_b", "t_c", "t_d", "t_e", "t_f"]
+
+
+# %%
+def raster_signature(pop_raster_path: Path):
+    """Describes a raster cheaply, without reading its cells.
+
+    The signature changes when the raster is written again, for example by task 1d,
+    so a cache keyed on it is thrown away with the raster it was built from.
+
+    pop_raster_path: Path = The population raster.
+
+    Returns: The hex digest of the size and modification time of the file and the
+    profile of the raster.
+    """
+    stat = Path(pop_raster_path).stat()
+    with rasterio.open(pop_raster_path) as src:
+        profile = src.profile
+    signature = json.dumps(
+        [stat.st_size, stat.st_mtime_ns, dict(profile)], default=str, sort_keys=True
+    )
+    return hashlib.sha256(signature.encode()).hexdigest()
+
+
+def geometry_hashes(geoms):
+    """Hashes the WKB of each geometry.
+
+    geoms: array like = The shapely geometries.
+
+    Returns: A list of the hex digests of the geometries.
+    """
+    return [hashlib.sha1(wkb).hexdigest() for wkb in shapely.to_wkb(geoms)]
+
+
+def window_hashes(pop_raster_path: Path, geoms):
+    """Hashes the population raster cells in the bounding box of each geometry.
+
+    The raster is read once, so this is only worth it when most of the windows are
+    needed.
+
+    pop_raster_path: Path = The population raster.
+    geoms: array like = The shapely geometries, in the raster CRS.
+
+    Returns: A list of the hex digests of the windows.
+    """
+    with rasterio.open(pop_raster_path) as src:
+        pop_arr = src.read(1, masked=True).filled(0)
+        transform = src.transform
+    digests = []
+    for geom in geoms:
+        window = from_bounds(*geom.bounds, transform=transform)
+        row_start = max(math.floor(window.row_off), 0)
+        col_start = max(math.floor(window.col_off), 0)
+        row_end = min(math.ceil(window.row_off + window.height), pop_arr.shape[0])
+        col_end = min(math.ceil(window.col_off + window.width), pop_arr.shape[1])
+        digest = hashlib.sha1(
+            np.array([row_start, col_start, row_end, col_end]).tobytes()
+        )
+        digest.update(
+            np.ascontiguousarray(pop_arr[row_start:row_end, col_start:col_end])
+        )
+        digests.append(digest.hexdigest())
+    return digests
+
+
+def load_cache_index(cache_dir: Path, raster_hash: str):
+    """Reads the index of the cache, if it was built from the same raster.
+
+    cache_dir: Path = The cache directory of the state.
+    raster_hash: str = The signature of the current population raster.
+
+    Returns: The index as a dataframe with a GEOID index, empty if there is no usable
+    cache.
+    """
+    empty = pd.DataFrame(
+        columns=["geom_hash", "offset", "height", "width"] + TRANSFORM_COLS
+    ).rename_axis("GEOID")
+    if not (cache_dir / "raster_hash").exists():
+        return empty
+    if (cache_dir / "raster_hash").read_text() != raster_hash:
+        return empty
+    return pd.read_parquet(cache_dir / "index.parquet")
+
+
+def join_cache_index(bg_gdf, raster_hash: str, cache_dir: Path):
+    """Adds the cache index entries that are still valid to the block groups.
+
+    A cached window is only used if the raster and the block group geometry are
+    unchanged since it was stored.
+
+    bg_gdf: gpd.GeoDataFrame = The block groups in the raster CRS.
+    raster_hash: str = The raster_signature of the population raster.
+    cache_dir: Path = The cache directory of the state.
+
+    Returns: The block groups with geom_hash and the index columns, which are missing
+    for the block groups that are not cached, and the valid index entries.
+    """
+    bg_gdf = bg_gdf.assign(geom_hash=geometry_hashes(bg_gdf.geometry.values))
+    cache_index = load_cache_index(cache_dir, raster_hash)
+    cache_index = cache_index.loc[
+        cache_index.index.isin(bg_gdf.index)
+        & (cache_index["geom_hash"] == bg_gdf["geom_hash"].reindex(cache_index.index))
+    ]
+    return bg_gdf.join(cache_index.drop(columns="geom_hash")), cache_index
+
+
+def read_window(weights: np.ndarray, entry):
+    """Gets the window of one block group out of the cache.
+
+    weights: np.ndarray = The memory-mapped weights.npy of the cache.
+    entry: namedtuple = The index entry of the block group.
+
+    Returns: The window array and its transform.
+    """
+    offset, height, width = int(entry.offset), int(entry.height), int(entry.width)
+    arr = weights[offset : offset + height * width].reshape(height, width)
+    transform = Affine(*[getattr(entry, c) for c in TRANSFORM_COLS])
+    return np.asarray(arr), transform
+
+
+def write_cache(
+    cache_dir: Path,
+    raster_hash: str,
+    index: pd.DataFrame,
+    windows: dict,
+):
+    """Writes the cache of a state from the windows that are still valid plus new ones.
+
+    The new cache is written next to the old one and swapped in at the end, so a
+    crash never leaves a half written cache behind.
+
+    cache_dir: Path = The cache directory of the state.
+    raster_hash: str = The signature of the population raster the windows came from.
+    index: pd.DataFrame = The index entries of the windows that are still valid.
+    windows: dict = GEOID to (geometry hash, window array, transform) of new windows.
+
+    Returns: None
+    """
+    if not windows:
+        return
+    old_weights = (
+        np.load(cache_dir / "weights.npy", mmap_mode="r") if index.shape[0] else None
+    )
+    arrays, records = [], []
+    offset = 0
+    for entry in index.itertuples():
+        arr, transform = read_window(old_weights, entry)
+        windows.setdefault(entry.Index, (entry.geom_hash, arr, transform))
+    for geoid, (geom_hash, arr, transform) in windows.items():
+        arrays.append(arr.ravel())
+        records.append(
+            [geoid, geom_hash, offset, arr.shape[0], arr.shape[1]] + list(transform)[:6]
+        )
+        offset += arr.size
+
+    tmp_dir = cache_dir.with_name(cache_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / "weights.npy", np.concatenate(arrays))
+    pd.DataFrame(
+        records,
+        columns=["GEOID", "geom_hash", "offset", "height", "width"] + TRANSFORM_COLS,
+    ).set_index("GEOID").to_parquet(tmp_dir / "index.parquet")
+    (tmp_dir / "raster_hash").write_text(raster_hash)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tmp_dir.rename(cache_dir)
@@ -0,0 +1,284 @@
+# Description: This file contains a work queue on a shared filesystem, for running work units on many hosts.
+# CC BY-NC-SA 4.0
+# Kruskamp, N., Kery, C., & Rineer, J. rti_synth_pop [Computer software]. https://github.com/RTIInternational/rti_synth_pop
+# nkruskamp@rti.org , ckery@rti.org, jrin@rti.org
+
+# A queue is a directory that every worker can reach, for example on NFS:
+#   units/{unit_id}.json    <- the published work units.
+#   leases/{unit_id}.lease  <- the worker that works on a unit. It is created with
+#                              O_EXCL, so only one worker gets it, and touched by the
+#                              worker as a heartbeat while it works.
+#   parts/{unit_id}.parquet <- the output of a finished unit. It is written to a
+#                              temporary file and renamed into place, so a part is
+#                              either complete or missing.
+#   errors/{unit_id}.txt    <- the traceback of a unit that failed. Publishing the
+#                              units again clears the errors, so they are retried.
+# A unit description carries the signature of the inputs it was published from. When
+# the units are published again and the description of a unit changed, for example
+# because the stage before was merged again, its part is stale and is deleted, and
+# units that are not published any more are deleted with their parts.
+# A lease that has not been touched for the lease timeout belongs to a worker that died,
+# and another worker takes it over. Two workers that take over the same stale lease at
+# the same moment can both run the unit, which only costs time: the units are
+# deterministic and the second part replaces the first whole.
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from rti_synth_pop.checkpoint import write_atomic
+from rti_synth_pop.instrumentation import track
+
+# seconds after the last heartbeat that a lease is taken to be stale.
+LEASE_TIMEOUT_S = 600
+
+
+# %%
+def worker_id():
+    """Identifies this worker process across hosts.
+
+    Returns: The host name and process id, as "host:pid".
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish(queue_dir: Path, units: dict[str, dict], reset: bool = False):
+    """Publishes work units to a queue.
+
+    Units that are already published with the same description are kept, with their
+    parts, so publishing again only adds new units, reruns the units whose inputs
+    changed and retries the ones that failed.
+
+    queue_dir: Path = The queue directory.
+    units: dict[str, dict] = Unit id to the JSON serializable description of the unit.
+    reset: bool = Whether to delete the queue, with its parts, first.
+
+    Returns: None
+    """
+    if reset:
+        shutil.rmtree(queue_dir, ignore_errors=True)
+    for sub_dir in ["units", "leases", "parts", "errors"]:
+        (queue_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+    for error_path in (queue_dir / "errors").glob("*.txt"):
+        error_path.unlink(missing_ok=True)
+    for unit_path in (queue_dir / "units").glob("*.json"):
+        if unit_path.stem not in units:
+            part_path(queue_dir, unit_path.stem).unlink(missing_ok=True)
+            unit_path.unlink()
+    for unit_id, unit in units.items():
+        unit_path = queue_dir / "units" / f"{unit_id}.json"
+        if unit_path.exists() and json.loads(unit_path.read_text()) == unit:
+            continue
+        # a new unit, or one whose inputs changed, so any part it has is stale.
+        part_path(queue_dir, unit_id).unlink(missing_ok=True)
+        write_atomic(unit_path, lambda p: p.write_text(json.dumps(unit)))
+
+
+def unit_ids(queue_dir: Path):
+    """Lists the published units of a queue.
+
+    queue_dir: Path = The queue directory.
+
+    Returns: The unit ids, in sorted order.
+    """
+    return sorted(path.stem for path in (queue_dir / "units").glob("*.json"))
+
+
+def read_unit(queue_dir: Path, unit_id: str):
+    """Reads the description of a unit.
+
+    queue_dir: Path = The queue directory.
+    unit_id: str = The unit to read.
+
+    Returns: The dictionary the unit was published with.
+    """
+    return json.loads((queue_dir / "units" / f"{unit_id}.json").read_text())
+
+
+def part_path(queue_dir: Path, unit_id: str):
+    """Gets the path of the part that a unit writes.
+
+    queue_dir: Path = The queue directory.
+    unit_id: str = The unit of the part.
+
+    Returns: The path of the parquet file of the part.
+    """
+    return queue_dir / "parts" / f"{unit_id}.parquet"
+
+
+def queue_status(queue_dir: Path):
+    """Sorts the units of a queue by their state.
+
+    queue_dir: Path = The queue directory.
+
+    Returns: A dictionary of done, failed, leased and pending to lists of unit ids.
+    """
+    status = {"done": [], "failed": [], "leased": [], "pending": []}
+    for unit_id in unit_ids(queue_dir):
+        if part_path(queue_dir, unit_id).exists():
+            status["done"].append(unit_id)
+        elif (queue_dir / "errors" / f"{unit_id}.txt").exists():
+            status["failed"].append(unit_id)
+        elif (queue_dir / "leases" / f"{unit_id}.lease").exists():
+            status["leased"].append(unit_id)
+        else:
+            status["pending"].append(unit_id)
+    return status
+
+
+def claim(queue_dir: Path, unit_id: str, lease_timeout: float = LEASE_TIMEOUT_S):
+    """Tries to take the lease of a unit.
+
+    queue_dir: Path = The queue directory.
+    unit_id: str = The unit to claim.
+    lease_timeout: float = The seconds without a heartbeat after which a lease is stale.
+
+    Returns: True if this worker holds the lease now.
+    """
+    lease_path = queue_dir / "leases" / f"{unit_id}.lease"
+    for _ in range(2):
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - lease_path.stat().st_mtime
+            except FileNotFoundError:
+                # the lease was released between the two calls, try again.
+                continue
+            if age < lease_timeout:
+                return False
+            # the worker of the lease stopped its heartbeat. Only one worker can rename
+            # the stale lease away, and that one tries to take the unit.
+            stale_path = lease_path.with_name(
+                f"{lease_path.name}.{worker_id().replace(':', '.')}.stale"
+            )
+            try:
+                os.rename(lease_path, stale_path)
+            except FileNotFoundError:
+                return False
+            stale_path.unlink()
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps({"worker": worker_id(), "claimed": time.time()}))
+        return True
+    return False
+
+
+def release(queue_dir: Path, unit_id: str):
+    """Gives up the lease of a unit, so other workers can claim it.
+
+    queue_dir: Path = The queue directory.
+    unit_id: str = The unit to release.
+
+    Returns: None
+    """
+    (queue_dir / "leases" / f"{unit_id}.lease").unlink(missing_ok=True)
+
+
+@contextmanager
+def heartbeat(lease_path: Path, interval: float):
+    """Touches a lease every interval seconds while the block runs.
+
+    lease_path: Path = The lease file.
+    interval: float = The seconds between heartbeats.
+
+    Returns: None
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(lease_path)
+            except FileNotFoundError:
+                pass
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_worker(
+    queue_dir: Path,
+    process_unit: Callable[[dict], pd.DataFrame],
+    lease_timeout: float = LEASE_TIMEOUT_S,
+    poll_s: float = 5,
+):
+    """Claims and runs the units of a queue until every unit is done or failed.
+
+    While other workers hold the leases of the units that are left, the worker waits
+    for them, so it can take over the units of workers that die.
+
+    queue_dir: Path = The queue directory.
+    process_unit: Callable[[dict], pd.DataFrame] = Runs a unit from its description
+    and returns its part.
+    lease_timeout: float = The seconds without a heartbeat after which a lease is stale.
+    poll_s: float = The seconds to wait before looking for claimable units again.
+
+    Returns: The number of units this worker finished and the number that failed.
+    """
+    n_done, n_failed = 0, 0
+    while True:
+        status = queue_status(queue_dir)
+        if not status["pending"] and not status["leased"]:
+            return n_done, n_failed
+
+        claimed_any = False
+        for unit_id in status["pending"] + status["leased"]:
+            if part_path(queue_dir, unit_id).exists():
+                continue
+            if not claim(queue_dir, unit_id, lease_timeout):
+                continue
+            claimed_any = True
+            lease_path = queue_dir / "leases" / f"{unit_id}.lease"
+            try:
+                # a part may have been written since the status was read.
+                if part_path(queue_dir, unit_id).exists():
+                    continue
+                with heartbeat(lease_path, lease_timeout / 4), track(
+                    "queue_unit", queue=queue_dir.name, unit=unit_id
+                ) as metrics:
+                    part = process_unit(read_unit(queue_dir, unit_id))
+                    metrics["rows_out"] = part.shape[0]
+                write_atomic(part_path(queue_dir, unit_id), part.to_parquet)
+                n_done += 1
+            except Exception:
+                (queue_dir / "errors" / f"{unit_id}.txt").write_text(
+                    f"{worker_id()}\n{traceback.format_exc()}"
+                )
+                n_failed += 1
+            finally:
+                release(queue_dir, unit_id)
+
+        if not claimed_any:
+            time.sleep(poll_s)
+
+
+def read_parts(queue_dir: Path):
+    """Reads the parts of all units of a queue, once they are all done.
+
+    queue_dir: Path = The queue directory.
+
+    Returns: A dictionary of unit id to its part as a dataframe, in unit id order.
+    """
+    status = queue_status(queue_dir)
+    missing = status["failed"] + status["leased"] + status["pending"]
+    if missing:
+        raise RuntimeError(
+            f"{len(missing)} units of {queue_dir} are not done: {missing[:10]}, "
+            f"{len(status['failed'])} of them failed, see {queue_dir / 'errors'}"
+        )
+    return {u: pd.read_parquet(part_path(queue_dir, u)) for u in status["done"]}